@@ -0,0 +1,180 @@
+# admission.py
+"""Admission control and load shedding for each worker
+
+Requests are sorted into classes by path. Each class has a concurrency limit
+and a bounded wait queue. A request that would have to wait longer than its
+class deadline is rejected at once with 503 and a Retry-After header. The
+wait is projected from an EWMA of the class's recent service times.
+
+Every request, running or queued, holds one of the worker's
+GUNICORN_THREADS threads. Non-critical classes together may only hold
+threads minus ADMISSION_RESERVED_THREADS. The remaining threads are kept for
+/health and /login, so the worker still answers health checks and logins
+when it is saturated with LLM calls.
+"""
+import math
+import os
+import threading
+import time
+
+CRITICAL = "critical"
+PRICING = "pricing"
+BULK = "bulk"
+OFFLINE = "offline"
+DEFAULT = "default"
+
+CRITICAL_PATHS = {"/health", "/login"}
+
+# (concurrency, queue length, deadline seconds, initial service-time estimate)
+#
+# Bulk jobs run for minutes, so they do not queue: a second one while the
+# slot is busy is turned away at once with a Retry-After from the EWMA.
+# Offline submissions only hand the file to the batch APIs and return, so
+# they get their own class instead of waiting behind a bulk job. They are
+# told apart by ?execution_mode=offline or an X-Execution-Mode header, since
+# the upload form is not parsed before admission.
+CLASS_DEFAULTS = {
+    PRICING: (4, 8, 15, 10.0),
+    BULK: (1, 0, 0, 60.0),
+    OFFLINE: (2, 4, 30, 5.0),
+    DEFAULT: (8, 16, 10, 0.5)
+}
+
+EWMA_ALPHA = 0.2
+
+def classify(path, execution_mode=None):
+    if path in CRITICAL_PATHS:
+        return CRITICAL
+    if path == "/api/bulk_price":
+        return OFFLINE if execution_mode == "offline" else BULK
+    if path == "/api/price":
+        return PRICING
+    return DEFAULT
+
+def get_admission_settings():
+    threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+    settings = {
+        "enabled": os.environ.get("ADMISSION_ENABLED", "True").lower() == "true",
+        # Threads left to critical requests no matter how busy the worker is
+        "shared_threads": max(1, threads - int(os.environ.get("ADMISSION_RESERVED_THREADS", "2"))),
+        "classes": {}
+    }
+    for name, (limit, queue, deadline, service_time) in CLASS_DEFAULTS.items():
+        prefix = f"ADMISSION_{name.upper()}"
+        settings["classes"][name] = {
+            "limit": int(os.environ.get(f"{prefix}_LIMIT", limit)),
+            "queue": int(os.environ.get(f"{prefix}_QUEUE", queue)),
+            "deadline": float(os.environ.get(f"{prefix}_DEADLINE", deadline)),
+            "service_time": service_time
+        }
+    return settings
+
+class Rejected(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"retry after {retry_after}s")
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """Per-class concurrency limits with bounded, deadline-aware queues"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.condition = threading.Condition()
+        self.active = {name: 0 for name in settings["classes"]}
+        self.waiting = {name: 0 for name in settings["classes"]}
+        self.service_time = {name: c["service_time"] for name, c in settings["classes"].items()}
+        self.rejected = {name: 0 for name in settings["classes"]}
+
+    def occupied(self):
+        return sum(self.active.values()) + sum(self.waiting.values())
+
+    def projected_wait(self, name, position):
+        """Seconds until the request `position` places back in the queue gets a slot"""
+        limit = self.settings["classes"][name]["limit"]
+        return (position + 1) * self.service_time[name] / max(limit, 1)
+
+    def can_start(self, name):
+        return (self.active[name] < self.settings["classes"][name]["limit"]
+                and sum(self.active.values()) < self.settings["shared_threads"])
+
+    def reject(self, name, wait):
+        self.rejected[name] += 1
+        raise Rejected(max(1, math.ceil(wait)))
+
+    def acquire(self, name):
+        """Block until `name` may run; raises Rejected when the wait would exceed its deadline"""
+        config = self.settings["classes"][name]
+        with self.condition:
+            if self.waiting[name] == 0 and self.can_start(name):
+                self.active[name] += 1
+                return
+            wait = self.projected_wait(name, self.waiting[name])
+            if (self.waiting[name] >= config["queue"] or wait > config["deadline"]
+                    or self.occupied() >= self.settings["shared_threads"]):
+                self.reject(name, wait)
+            self.waiting[name] += 1
+            deadline = time.monotonic() + config["deadline"]
+            try:
+                while not self.can_start(name):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.reject(name, self.projected_wait(name, self.waiting[name] - 1))
+                    self.condition.wait(remaining)
+                self.active[name] += 1
+            finally:
+                self.waiting[name] -= 1
+
+    def release(self, name, duration):
+        with self.condition:
+            self.active[name] -= 1
+            self.service_time[name] += EWMA_ALPHA * (duration - self.service_time[name])
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return {
+                name: {
+                    "active": self.active[name],
+                    "waiting": self.waiting[name],
+                    "limit": self.settings["classes"][name]["limit"],
+                    "service_time": round(self.service_time[name], 3),
+                    "rejected": self.rejected[name]
+                }
+                for name in self.settings["classes"]
+            }
+
+def register_admission(app):
+    """Admit or shed each request to `app` before any other handler runs"""
+    from flask import g, jsonify, request
+
+    settings = get_admission_settings()
+    controller = AdmissionController(settings)
+    if not settings["enabled"]:
+        return controller
+
+    def admit():
+        # Never request.form here: it would parse and spool the whole upload before admission
+        execution_mode = request.args.get("execution_mode") or request.headers.get("X-Execution-Mode")
+        name = classify(request.path, execution_mode)
+        if name == CRITICAL:
+            return None
+        try:
+            controller.acquire(name)
+        except Rejected as e:
+            response = jsonify({"error": "Server busy, please retry", "retry_after": e.retry_after})
+            response.status_code = 503
+            response.headers["Retry-After"] = str(e.retry_after)
+            return response
+        g.admission = (name, time.monotonic())
+        return None
+
+    def release(exc):
+        admission = g.pop("admission", None)
+        if admission is not None:
+            name, started = admission
+            controller.release(name, time.monotonic() - started)
+
+    # Run ahead of every other before_request hook
+    app.before_request_funcs.setdefault(None, []).insert(0, admit)
+    app.teardown_request(release)
+    return controller
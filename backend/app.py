@@ -7,7 +7,11 @@ except ImportError:
     except ImportError:
         from urllib.parse import quote as url_quote
 
-from flask import Flask, request, jsonify, redirect, url_for, render_template
+from flask import Flask, request, jsonify, redirect, url_for, render_template, send_file, stream_with_context
+try:
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:
+    DefaultJSONProvider = None
 from flask_cors import CORS
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 import os
@@ -22,23 +26,39 @@ import bcrypt
 import flask
 import werkzeug
 import csv
-from io import StringIO, BytesIO
+import io
+import tempfile
+import shutil
+from functools import wraps
 from google.cloud import storage
 from google.oauth2 import service_account
 from google.auth import compute_engine
-print("Python version:", sys.version)
-print("Werkzeug version:", werkzeug.__version__)
-print("Flask version:", flask.__version__)
 
 # Relative imports for backend modules
-from .llm_clients import get_claude_pricing, get_gemini_pricing, get_grok_pricing
+from . import batch_api
+from .admission import register_admission
 from .aggregator import aggregate_results
-from .cache import get_cached_result, store_result
+from .cache import entry_results, get_cache_key, get_cached_entry, is_shared_backend, store_result
+from .compression import make_etag, register_compression
+from .dispatch import INTERACTIVE, queue_stats
+from .logging_setup import configure_logging
+from .history import history_median_result, query_history, summarize_history
+from .codec import dumps_json, loads_json
+from .quotas import (
+    get_admin_users, get_usage, quota_exceeded, record_usage, reserve_rows, set_user_quota, usage_report, within_quota
+)
+from .pipeline import (
+    RESULT_FIELDS, ensemble_stats, get_ensemble_pricing, product_from_row, refresh_if_stale, row_with_results,
+    stream_bulk_results, stream_llm_pricing
+)
+from .sharding import stream_sharded_results
+from .warmup import start_warmup_scheduler
 
 load_dotenv()
 
-logging.basicConfig(level=logging.INFO)
+configure_logging()
 logger = logging.getLogger(__name__)
+logger.info("Starting with Python %s, Werkzeug %s, Flask %s", sys.version.split()[0], werkzeug.__version__, flask.__version__)
 
 app = Flask(__name__, static_folder='../frontend-dist', template_folder='../templates')
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "your-secure-secret-key")
@@ -47,6 +67,24 @@ app.config['SESSION_COOKIE_SECURE'] = True  # Ensure cookie is sent over HTTPS
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'  # Allow cross-subdomain requests
 CORS(app)
 
+if DefaultJSONProvider is not None:
+    class FastJSONProvider(DefaultJSONProvider):
+        """Route jsonify() and request.json through backend.codec (orjson when installed)"""
+        def dumps(self, obj, **kwargs):
+            return dumps_json(obj).decode('utf-8')
+
+        def loads(self, s, **kwargs):
+            return loads_json(s)
+
+        def response(self, *args, **kwargs):
+            obj = self._prepare_response_obj(args, kwargs)
+            return self._app.response_class(dumps_json(obj), mimetype=self.mimetype)
+
+    app.json = FastJSONProvider(app)
+
+register_compression(app)
+admission = register_admission(app)
+
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = "login"
@@ -94,6 +132,7 @@ def init_db():
         logger.error(f"Failed to initialize database {db_path}: {e}")
 
 init_db()
+start_warmup_scheduler()
 
 # Subdomain routing middleware
 @app.before_request
@@ -153,13 +192,11 @@ def logout():
 @app.route('/pricing/single')
 @login_required
 def index():
-    print("📥 Received GET /pricing/single request")
     return render_template('index.html.jinja2')
 
 @app.route('/pricing/bulk')
 @login_required
 def bulk():
-    print("📥 Received GET /pricing/bulk request")
     return render_template('bulk.html.jinja2')
 
 @app.route('/debug_oidc_token')
@@ -178,23 +215,68 @@ async def get_price_analysis():
     
     product_info = request.json
     use_sources = product_info.pop("use_sources", [])
+    history_days = product_info.pop("history_days", None)
+    # Server-sent events: partial consensus as each provider answers
+    stream = product_info.pop("stream", False) or request.accept_mimetypes.best == 'text/event-stream'
     
     if not product_info.get('brand') or not product_info.get('model'):
         return jsonify({"error": "Brand and model are required"}), 400
+
+    if history_days is not None:
+        try:
+            history_days = int(history_days)
+        except (TypeError, ValueError):
+            return jsonify({"error": "history_days must be a whole number of days"}), 400
+        if history_days < 0:
+            return jsonify({"error": "history_days must be a whole number of days"}), 400
+
+    if history_days:
+        # Answer from past valuations only, without calling any LLM
+        try:
+            history_results = history_median_result(product_info, days=history_days)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            # Fall through to the cache and the LLMs
+            logger.error(f"Error reading price history: {e}")
+            history_results = None
+        if history_results:
+            return jsonify({
+                "results": history_results,
+                "source": "history",
+                "observations": history_results["meta"]["observations"]
+            })
     
-    cached_results = get_cached_result(product_info)
-    if cached_results and not request.json.get("skip_cache", False):
-        return jsonify({
+    cached = get_cached_entry(product_info, decode=False)
+    if cached and not request.json.get("skip_cache", False):
+        refresh_if_stale(cached, use_sources)
+        etag = make_etag(cached["key"], cached["timestamp"])
+        if request.if_none_match.contains_weak(etag):
+            # Client already has this entry: skip decoding and serializing the body
+            response = app.response_class(status=304)
+            response.set_etag(etag, weak=True)
+            return response
+        cached_results = entry_results(cached)
+        payload = {
             "results": cached_results,
             "source": "cache",
-            "cached_at": cached_results.get("meta", {}).get("timestamp", "unknown")
-        })
+            "cached_at": cached_results.get("meta", {}).get("timestamp", "unknown"),
+            "stale": cached["stale"],
+            "match": {"key": cached["key"], "score": cached["score"]}
+        }
+        if stream:
+            response = event_stream_response(iter([("final", payload)]))
+        else:
+            response = jsonify(payload)
+        response.set_etag(etag, weak=True)
+        return response
+    
+    if stream:
+        return event_stream_response(run_async_generator(stream_llm_pricing(product_info, use_sources, INTERACTIVE)))
     
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     
     try:
-        llm_results = loop.run_until_complete(get_all_llm_pricing(product_info, use_sources))
+        llm_results = loop.run_until_complete(get_ensemble_pricing(product_info, use_sources, INTERACTIVE))
         if not llm_results:
             return jsonify({
                 "error": "No results from any LLM",
@@ -213,13 +295,16 @@ async def get_price_analysis():
         final_results["meta"]["timestamp"] = datetime.now().isoformat()
         final_results["meta"]["models_used"] = [r["source"] for r in llm_results if "error" not in r]
         
-        store_result(product_info, final_results)
+        stored_at = store_result(product_info, final_results)
         
-        return jsonify({
+        response = jsonify({
             "results": final_results,
             "source": "llm",
             "llm_count": len(llm_results)
         })
+        if stored_at is not None:
+            response.set_etag(make_etag(get_cache_key(product_info), stored_at), weak=True)
+        return response
     
     except Exception as e:
         logger.error(f"Error processing request: {e}")
@@ -227,120 +312,70 @@ async def get_price_analysis():
     finally:
         loop.close()
 
-async def process_product_batch(products, use_sources):
-    """Process a batch of products by combining them into a single LLM request"""
-    if not products:
-        return []
-    
-    # Combine prompts for all products in the batch
-    combined_prompt = ""
-    for idx, product in enumerate(products):
-        if not product["brand"] or not product["model"]:
-            return [{"product": product, "error": "Brand and model are required"} for product in products]
-        
-        # Check cache for each product
-        cached = get_cached_result(product)
-        if cached:
-            return [{"product": product, "results": cached, "source": "cache"} for product in products]
-        
-        condition = product.get('condition', 'excellent')
-        brand = product.get('brand', '')
-        model = product.get('model', '')
-        details = product.get('additional_details', '')
-        prompt = f"""
-        Item {idx + 1}:
-        Brand: {brand}
-        Model: {model}
-        Condition: {condition}
-        Additional Details: {details}
-        """
-        combined_prompt += prompt + "\n"
-    
-    combined_prompt += """
-    For each item listed above, provide a market price analysis with the following details:
-    1. A price range to buy the item at (for resale)
-    2. An initial listing price to maximize profit
-    3. A price to list at for a quick sale
-    4. The most likely final sale price
-    5. The estimated time to sell (in days or weeks)
-    Include explanations for each price range and time to sell, considering factors like rarity, collectible status, or market trends. Format the response as a JSON array where each element corresponds to an item in the order listed, with the structure:
-    [
-      {
-        "buy_price": {"min": value, "max": value, "explanation": "reason"},
-        "max_profit_price": {"min": value, "max": value, "explanation": "reason"},
-        "quick_sale_price": {"min": value, "max": value, "explanation": "reason"},
-        "expected_sale_price": {"min": value, "max": value, "explanation": "reason"},
-        "estimated_time_to_sell": {"min": value, "max": value, "unit": "days OR weeks", "explanation": "factors"},
-        "factors": ["factor1", "factor2"],
-        "market_analysis": "brief analysis"
-      },
-      ...
-    ]
-    """
-    
-    # Query LLMs with the combined prompt
-    llm_results = await get_all_llm_pricing({"combined_prompt": combined_prompt}, use_sources)
-    logger.info(f"LLM results for batch: {llm_results}")
-    
-    if not llm_results:
-        return [{"product": product, "error": "No LLM results"} for product in products]
-    
-    final_results = aggregate_results(llm_results)
-    if "error" in final_results:
-        return [{"product": product, "error": "Failed to aggregate LLM results: " + final_results["error"]} for product in products]
-    
-    # Ensure the results match the number of products
-    if not isinstance(final_results, list) or len(final_results) != len(products):
-        return [{"product": product, "error": "Unexpected LLM response format"} for product in products]
-    
-    # Store results in cache and return
-    batch_results = []
-    for product, result in zip(products, final_results):
-        store_result(product, result)
-        batch_results.append({"product": product, "results": result, "source": "llm"})
-    
-    return batch_results
+def sse_message(event, data):
+    return f"event: {event}\ndata: {dumps_json(data).decode('utf-8')}\n\n"
 
-async def process_product(product, use_sources):
-    """Process a single product (fallback for non-batched processing)"""
-    if not product["brand"] or not product["model"]:
-        return {"product": product, "error": "Brand and model are required"}
-    
-    cached = get_cached_result(product)
-    if cached:
-        return {"product": product, "results": cached, "source": "cache"}
-    
-    llm_results = await get_all_llm_pricing(product, use_sources)
-    logger.info(f"LLM results for {product['brand']} {product['model']}: {llm_results}")
-    if llm_results:
-        final_results = aggregate_results(llm_results)
-        if "error" in final_results:
-            return {"product": product, "error": "Failed to aggregate LLM results: " + final_results["error"]}
-        store_result(product, final_results)
-        return {"product": product, "results": final_results, "source": "llm"}
-    else:
-        return {"product": product, "error": "No LLM results"}
+def run_async_generator(agen):
+    """Drive an async generator from a sync one on a private event loop"""
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(agen.aclose())
+        loop.close()
+
+def event_stream_response(events):
+    """Stream (event, payload) pairs to the client as server-sent events"""
+    return app.response_class(
+        stream_with_context(sse_message(event, payload) for event, payload in events),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def get_storage_client():
+    # Initialize GCS client using Workload Identity
+    credentials = compute_engine.IDTokenCredentials(
+        audience=f"//iam.googleapis.com/projects/{os.environ.get('GOOGLE_CLOUD_PROJECT')}/locations/global/workloadIdentityPools/render-identity-pool/providers/render-oidc",
+        target_audience=f"//iam.googleapis.com/projects/{os.environ.get('GOOGLE_CLOUD_PROJECT')}/locations/global/workloadIdentityPools/render-identity-pool/providers/render-oidc"
+    )
+    return storage.Client(credentials=credentials, project=os.environ.get("GOOGLE_CLOUD_PROJECT"))
+
+def get_bulk_setting(name, default):
+    return int(os.environ.get(name, default))
+
+def get_execution_mode():
+    # Admission classifies from the query string or header; the form field is still accepted
+    return (request.args.get('execution_mode') or request.headers.get('X-Execution-Mode')
+            or request.form.get('execution_mode'))
 
 @app.route('/api/bulk_price', methods=['POST'])
 @login_required
 async def bulk_price():
+    exceeded = quota_exceeded(current_user.id)
+    if exceeded:
+        return jsonify({"error": f"Daily {exceeded} quota exceeded", "usage": get_usage(current_user.id)}), 429
+    execution_mode = get_execution_mode()
+    if execution_mode == 'sharded' and not is_shared_backend():
+        # Pool workers would neither see nor keep this worker's memory cache
+        return jsonify({"error": "execution_mode=sharded needs CACHE_BACKEND=sqlite or firebase"}), 400
+    
     # Check if processing from GCS
     gcs_bucket = request.form.get('gcs_bucket')
     gcs_file_path = request.form.get('gcs_file_path')
     
     if gcs_bucket and gcs_file_path:
-        # Initialize GCS client using Workload Identity
-        credentials = compute_engine.IDTokenCredentials(
-            audience=f"//iam.googleapis.com/projects/{os.environ.get('GOOGLE_CLOUD_PROJECT')}/locations/global/workloadIdentityPools/render-identity-pool/providers/render-oidc",
-            target_audience=f"//iam.googleapis.com/projects/{os.environ.get('GOOGLE_CLOUD_PROJECT')}/locations/global/workloadIdentityPools/render-identity-pool/providers/render-oidc"
-        )
-        storage_client = storage.Client(credentials=credentials, project=os.environ.get("GOOGLE_CLOUD_PROJECT"))
+        storage_client = get_storage_client()
         bucket = storage_client.bucket(gcs_bucket)
         blob = bucket.blob(gcs_file_path)
         
-        # Download CSV from GCS
+        # Stream the CSV from GCS in chunks, pinned to the generation we started reading
         try:
-            content = blob.download_as_text()
+            blob.reload()
+            source = blob.open('r', encoding='utf-8-sig', newline='', chunk_size=get_bulk_setting("BULK_GCS_CHUNK_SIZE", 1024 * 1024))
         except Exception as e:
             logger.error(f"Error downloading file from GCS: {e}")
             return jsonify({"error": f"Failed to download file from GCS: {str(e)}"}), 500
@@ -351,117 +386,279 @@ async def bulk_price():
         file = request.files['file']
         if not file.filename.endswith('.csv'):
             return jsonify({"error": "File must be a CSV"}), 400
-        content = file.read().decode('utf-8')
-    
+        source = io.TextIOWrapper(file.stream, encoding='utf-8-sig', newline='')
+
+    if execution_mode == 'offline':
+        # Hand the whole file to the providers' batch APIs and return immediately
+        return start_offline_job(source, blob if gcs_bucket and gcs_file_path else None, current_user.id)
+
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     
+    # Output rows are written as they finish; the spool only touches disk past 8 MB
+    spool = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024, mode='w+b')
+    output = io.TextIOWrapper(spool, encoding='utf-8', newline='', write_through=True)
+    send_csv = request.form.get('output_format') == 'csv'
+    
     try:
-        csv_reader = csv.DictReader(StringIO(content))
-        products = []
-        csv_rows = []
-        for row in csv_reader:
-            product = {
-                "brand": row["brand"],
-                "model": row["model"],
-                "condition": row["condition"],
-                "additional_details": row.get("additional_details", "")
-            }
-            products.append(product)
-            csv_rows.append(row)
+        csv_reader = csv.DictReader(source)
+        writer = csv.DictWriter(output, fieldnames=list(csv_reader.fieldnames or []) + RESULT_FIELDS)
+        writer.writeheader()
+        # Rows are counted against the user's daily quota as they are read
+        summary = {"rows": 0, "errors": 0, "from_cache": 0}
+        quota_rows = within_quota(current_user.id, csv_reader, summary)
+        rows = ((row, product_from_row(row)) for row in quota_rows)
         
         # Query all available LLMs
         use_sources = ["claude", "gemini", "grok"]
         
-        # Process in batches of 10
-        batch_size = 10
+        # Only the first rows are echoed back as JSON; the full output is the CSV
+        max_response_rows = get_bulk_setting("BULK_RESPONSE_MAX_ROWS", 1000)
         final_results = []
-        for i in range(0, len(products), batch_size):
-            batch = products[i:i + batch_size]
-            batch_results = await process_product_batch(batch, use_sources)
-            final_results.extend(batch_results)
-            if i + batch_size < len(products):
-                await asyncio.sleep(12)  # Throttle to avoid rate limits
-        
-        # Prepare updated CSV with pricing data
-        updated_rows = []
-        for product_result, original_row in zip(final_results, csv_rows):
-            row = original_row.copy()
+        if execution_mode == 'sharded':
+            # Spread parsing, extraction and aggregation over a process pool
+            results_stream = stream_sharded_results(quota_rows, use_sources, batch_size=10, user_id=current_user.id)
+        else:
+            results_stream = stream_bulk_results(
+                rows, use_sources,
+                batch_size=10,
+                max_in_flight=get_bulk_setting("BULK_MAX_IN_FLIGHT", 2),
+                user_id=current_user.id
+            )
+        async for row, product_result in results_stream:
+            writer.writerow(row_with_results(row, product_result))
+            summary["rows"] += 1
             if "error" in product_result:
-                row["buy_price_min"] = ""
-                row["buy_price_max"] = ""
-                row["max_profit_price_min"] = ""
-                row["max_profit_price_max"] = ""
-                row["quick_sale_price_min"] = ""
-                row["quick_sale_price_max"] = ""
-                row["expected_sale_price_min"] = ""
-                row["expected_sale_price_max"] = ""
-                row["time_to_sell_min"] = ""
-                row["time_to_sell_max"] = ""
-                row["time_to_sell_unit"] = ""
-                row["error"] = product_result["error"]
-            else:
-                result = product_result["results"]
-                row["buy_price_min"] = result["buy_price"]["min"]
-                row["buy_price_max"] = result["buy_price"]["max"]
-                row["max_profit_price_min"] = result["max_profit_price"]["min"]
-                row["max_profit_price_max"] = result["max_profit_price"]["max"]
-                row["quick_sale_price_min"] = result["quick_sale_price"]["min"]
-                row["quick_sale_price_max"] = result["quick_sale_price"]["max"]
-                row["expected_sale_price_min"] = result["expected_sale_price"]["min"]
-                row["expected_sale_price_max"] = result["expected_sale_price"]["max"]
-                row["time_to_sell_min"] = result["estimated_time_to_sell"]["min"]
-                row["time_to_sell_max"] = result["estimated_time_to_sell"]["max"]
-                row["time_to_sell_unit"] = result["estimated_time_to_sell"]["unit"]
-                row["error"] = ""
-            updated_rows.append(row)
+                summary["errors"] += 1
+            elif product_result.get("source") == "cache":
+                summary["from_cache"] += 1
+            if len(final_results) < max_response_rows:
+                final_results.append(product_result)
+        if summary.get("quota_exceeded"):
+            # Keep the rest of the file in the output, unpriced
+            quota_error = {"error": f"Daily {summary['quota_exceeded']} quota exceeded"}
+            for row in csv_reader:
+                writer.writerow(row_with_results(row, quota_error))
+                summary["rows"] += 1
+                summary["errors"] += 1
+        logger.info("Bulk request finished", extra=summary)
         
         # Write updated CSV back to GCS if applicable
         if gcs_bucket and gcs_file_path:
-            output = StringIO()
-            fieldnames = list(csv_rows[0].keys()) + [
-                "buy_price_min", "buy_price_max",
-                "max_profit_price_min", "max_profit_price_max",
-                "quick_sale_price_min", "quick_sale_price_max",
-                "expected_sale_price_min", "expected_sale_price_max",
-                "time_to_sell_min", "time_to_sell_max", "time_to_sell_unit",
-                "error"
-            ]
-            writer = csv.DictWriter(output, fieldnames=fieldnames)
-            writer.writeheader()
-            for row in updated_rows:
-                writer.writerow(row)
-            
+            source.close()
+            spool.seek(0)
             try:
-                blob.upload_from_string(output.getvalue(), content_type='text/csv')
+                # Large outputs go up as a chunked resumable upload straight from the spool
+                blob.upload_from_file(spool, content_type='text/csv')
                 logger.info(f"Updated CSV uploaded to GCS: {gcs_file_path}")
             except Exception as e:
                 logger.error(f"Error uploading updated CSV to GCS: {e}")
                 return jsonify({"error": f"Failed to upload updated CSV to GCS: {str(e)}"}), 500
+        elif send_csv:
+            spool.seek(0)
+            output.detach()
+            return send_file(spool, mimetype='text/csv', as_attachment=True, download_name='priced_' + file.filename)
         
-        return jsonify({"results": final_results})
+        return jsonify({
+            "results": final_results,
+            "summary": summary,
+            "truncated": summary["rows"] > len(final_results)
+        })
     except Exception as e:
         logger.error(f"Error processing bulk request: {e}")
         return jsonify({"error": str(e)}), 500
     finally:
+        if not send_csv:
+            spool.close()
         loop.close()
 
-async def get_all_llm_pricing(product_info, use_sources):
-    tasks = []
-    if "claude" in use_sources or not use_sources:
-        tasks.append(get_claude_pricing(product_info))
-    if "gemini" in use_sources:
-        tasks.append(get_gemini_pricing(product_info))
-    if "grok" in use_sources:
-        tasks.append(get_grok_pricing(product_info))
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-    valid_results = []
-    for result in results:
-        if isinstance(result, Exception):
-            logger.error(f"LLM error: {result}")
-        else:
-            valid_results.append(result)
-    return valid_results
+def write_offline_output(job, results_by_key):
+    """Write a collected batch job's priced CSV, uploading it over the GCS input if it came from there"""
+    with open(job["input_path"], encoding='utf-8', newline='') as f, \
+            open(job["output_path"], 'w', encoding='utf-8', newline='') as output:
+        batch_api.write_priced_csv(f, output, results_by_key)
+    if job.get("gcs_uri"):
+        bucket_name, _, blob_name = job["gcs_uri"][len("gs://"):].partition("/")
+        get_storage_client().bucket(bucket_name).blob(blob_name).upload_from_filename(job["output_path"], content_type='text/csv')
+        logger.info(f"Batch job {job['job_id']} output uploaded to {job['gcs_uri']}")
+
+# Pick up offline jobs that a restart or deploy left unfinished
+batch_api.resume_jobs(poll_interval=get_bulk_setting("BATCH_POLL_INTERVAL", 60), on_complete=write_offline_output)
+
+def start_offline_job(source, blob=None, user_id=None):
+    """Submit a bulk CSV as a provider batch job; results land in the cache and the job's output CSV
+
+    The whole file is reserved against `user_id`'s daily row quota up
+    front, and the job's estimated tokens are counted when it is collected.
+    The reservation is recorded in the job so it is refunded if the job
+    fails before it is collected.
+    """
+    job_dir = batch_api.get_job_dir()
+    os.makedirs(job_dir, exist_ok=True)
+    input_path = os.path.join(job_dir, f"input-{os.getpid()}-{datetime.now().strftime('%Y%m%d%H%M%S%f')}.csv")
+    reserved = 0
+    try:
+        with open(input_path, 'w', encoding='utf-8', newline='') as f:
+            shutil.copyfileobj(source, f)
+        with open(input_path, encoding='utf-8', newline='') as f:
+            products = batch_api.read_products(f)
+        reserved = reserve_rows(user_id, len(products))
+        if reserved < len(products):
+            record_usage(user_id, rows=-reserved)
+            os.remove(input_path)
+            return jsonify({
+                "error": f"Daily {quota_exceeded(user_id) or 'rows'} quota exceeded",
+                "details": f"The file has {len(products)} rows but only {reserved} are left today",
+                "usage": get_usage(user_id)
+            }), 429
+        job = batch_api.submit_job(products, ["claude", "gemini", "grok"], user_id=user_id)
+    except Exception as e:
+        logger.error(f"Error submitting batch job: {e}")
+        if reserved:
+            record_usage(user_id, rows=-reserved)
+        return jsonify({"error": f"Failed to submit batch job: {str(e)}"}), 500
+    finally:
+        source.close()
+
+    job["input_path"] = input_path
+    job["reserved_rows"] = reserved
+    job["output_path"] = os.path.join(job_dir, f"{job['job_id']}-priced.csv")
+    if blob is not None:
+        job["gcs_uri"] = f"gs://{blob.bucket.name}/{blob.name}"
+
+    batch_api.run_job_in_background(
+        job, poll_interval=get_bulk_setting("BATCH_POLL_INTERVAL", 60), on_complete=write_offline_output
+    )
+    return jsonify({
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "products": len(job["products"]),
+        "pending": len(job["pending"])
+    }), 202
+
+@app.route('/api/batch_jobs/<job_id>', methods=['GET'])
+@login_required
+def get_batch_job(job_id):
+    if not job_id.isalnum():
+        return jsonify({"error": "Invalid job id"}), 400
+    try:
+        job = batch_api.load_job(job_id)
+    except FileNotFoundError:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify({
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "created_at": job["created_at"],
+        "products": len(job["products"]),
+        "pending": len(job["pending"]),
+        "batches": {source: {"id": b["id"], "done": b.get("done", False)} for source, b in job["batches"].items()},
+        "report": job.get("report"),
+        "error": job.get("error"),
+        "gcs_uri": job.get("gcs_uri")
+    })
+
+@app.route('/api/batch_jobs/<job_id>/output', methods=['GET'])
+@login_required
+def get_batch_job_output(job_id):
+    if not job_id.isalnum():
+        return jsonify({"error": "Invalid job id"}), 400
+    try:
+        job = batch_api.load_job(job_id)
+    except FileNotFoundError:
+        return jsonify({"error": "Job not found"}), 404
+    if job["status"] != "completed" or not os.path.exists(job.get("output_path", "")):
+        return jsonify({"error": "Job has not completed", "status": job["status"]}), 409
+    return send_file(job["output_path"], mimetype='text/csv', as_attachment=True,
+                     download_name=f"priced_{job_id}.csv")
+
+def product_from_args(args):
+    return {
+        "brand": args.get('brand', ''),
+        "model": args.get('model', ''),
+        "condition": args.get('condition', '')
+    }
+
+@app.route('/api/history', methods=['GET'])
+@login_required
+def get_price_history():
+    product_info = product_from_args(request.args)
+    if not product_info['brand'] or not product_info['model']:
+        return jsonify({"error": "Brand and model are required"}), 400
+    try:
+        observations = query_history(
+            product_info,
+            since=request.args.get('since', type=int),
+            until=request.args.get('until', type=int),
+            limit=min(request.args.get('limit', 1000, type=int), 10000)
+        )
+    except sqlite3.Error as e:
+        logger.error(f"Error reading price history: {e}")
+        return jsonify({"error": "History unavailable"}), 500
+    return jsonify({"observations": observations, "count": len(observations)})
+
+@app.route('/api/history/summary', methods=['GET'])
+@login_required
+def get_price_history_summary():
+    product_info = product_from_args(request.args)
+    if not product_info['brand'] or not product_info['model']:
+        return jsonify({"error": "Brand and model are required"}), 400
+    try:
+        summary = summarize_history(product_info, days=request.args.get('days', 30, type=int))
+    except sqlite3.Error as e:
+        logger.error(f"Error reading price history: {e}")
+        return jsonify({"error": "History unavailable"}), 500
+    return jsonify(summary)
+
+@app.route('/api/dispatch/stats', methods=['GET'])
+@login_required
+def get_dispatch_stats():
+    try:
+        return jsonify(queue_stats())
+    except sqlite3.Error as e:
+        logger.error(f"Error reading dispatch stats: {e}")
+        return jsonify({"error": "Dispatch stats unavailable"}), 500
+
+def admin_required(view):
+    """Restrict a view to the usernames listed in ADMIN_USERS"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if current_user.username not in get_admin_users():
+            return jsonify({"error": "Admin access required"}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route('/api/admin/usage', methods=['GET'])
+@login_required
+@admin_required
+def get_usage_report():
+    try:
+        return jsonify(usage_report(request.args.get('day')))
+    except sqlite3.Error as e:
+        logger.error(f"Error reading usage: {e}")
+        return jsonify({"error": "Usage unavailable"}), 500
+
+@app.route('/api/admin/quotas/<int:user_id>', methods=['PUT'])
+@login_required
+@admin_required
+def update_user_quota(user_id):
+    changes = request.json or {}
+    try:
+        quota = set_user_quota(
+            user_id,
+            weight=changes.get('weight'),
+            max_concurrency=changes.get('max_concurrency'),
+            daily_rows=changes.get('daily_rows'),
+            daily_tokens=changes.get('daily_tokens')
+        )
+    except (sqlite3.Error, TypeError, ValueError) as e:
+        logger.error(f"Error updating quota for user {user_id}: {e}")
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"user_id": user_id, "quota": quota})
+
+@app.route('/api/ensemble/stats', methods=['GET'])
+@login_required
+def get_ensemble_stats():
+    return jsonify(ensemble_stats())
 
 @app.route('/api/models', methods=['GET'])
 @login_required
@@ -496,7 +693,8 @@ def health_check():
     return jsonify({
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "load": admission.stats()
     })
 
 if __name__ == '__main__':
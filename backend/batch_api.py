@@ -0,0 +1,468 @@
+# batch_api.py
+"""Offline bulk pricing through the providers' asynchronous batch endpoints
+
+Overnight repricing does not need interactive latency. This mode submits
+one request per unique product to Anthropic Message Batches (Claude) and to
+an OpenAI-style batch file for Grok, polls until both finish, then sends
+every product through the normal aggregate_results / store_result path. The
+cache and price history end up exactly as if the items had been priced
+interactively. A provider whose batch fails or expires is left out and
+the products are aggregated from the others. Batch calls are billed at
+batch rates and do not use the real-time rate limits that /api/price
+depends on. Gemini has no batch endpoint in the SDK we use, so it is
+skipped in this mode.
+
+Job state is a small JSON document, so a job can be collected by a
+different process (or after a restart) than the one that submitted it.
+Products that were not submitted are recorded with the reason, and cached
+ones with the cached result, so collecting never depends on the cache of
+the submitting process. resume_jobs() restarts the background wait and
+collect for unfinished jobs after a deploy; a lock file per job keeps
+several workers from collecting the same job.
+
+CLI:
+    python -m backend.batch_api run catalog.csv priced.csv --state job.json
+    python -m backend.batch_api collect --state job.json --input catalog.csv --output priced.csv
+
+Point ANTHROPIC_BATCH_BASE_URL / GROK_BATCH_BASE_URL at
+`python -m backend.batch_standin` to exercise the whole flow locally.
+"""
+import argparse
+import csv
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import anthropic
+from openai import OpenAI
+
+from .aggregator import aggregate_results
+from .cache import get_cached_entry, store_result
+from .llm_clients import (
+    CLAUDE_MODEL, CLAUDE_SYSTEM_PROMPT, GROK_MODEL, GROK_SYSTEM_PROMPT, create_llm_prompt, parse_pricing_response
+)
+from .logging_setup import configure_logging
+from .matcher import canonical_product_key
+from .pipeline import RESULT_FIELDS, dedupe_products, product_from_row, row_with_results
+from .quotas import estimate_tokens, record_usage
+
+logger = logging.getLogger(__name__)
+
+BATCH_SOURCES = ["claude", "grok"]
+
+# Jobs in these states still need to be waited for and collected
+UNFINISHED_STATUSES = ("submitted", "ready")
+
+def get_anthropic_batch_client():
+    return anthropic.Anthropic(
+        api_key=os.environ.get("ANTHROPIC_API_KEY"),
+        base_url=os.environ.get("ANTHROPIC_BATCH_BASE_URL") or None
+    )
+
+def get_grok_batch_client():
+    return OpenAI(
+        api_key=os.environ.get("GROK_API_KEY"),
+        base_url=os.environ.get("GROK_BATCH_BASE_URL", "https://api.x.ai/v1")
+    )
+
+def get_job_dir():
+    return os.environ.get("BATCH_JOB_DIR", "/opt/render/project/src/data/batch_jobs")
+
+def custom_id(index):
+    return f"item-{index}"
+
+# Claude: Anthropic Message Batches
+def submit_claude_batch(products):
+    requests = [
+        {
+            "custom_id": custom_id(index),
+            "params": {
+                "model": CLAUDE_MODEL,
+                "max_tokens": 2000,
+                "temperature": 0.0,
+                "system": CLAUDE_SYSTEM_PROMPT,
+                "messages": [{"role": "user", "content": create_llm_prompt(product)}]
+            }
+        }
+        for index, product in products
+    ]
+    batch = get_anthropic_batch_client().messages.batches.create(requests=requests)
+    logger.info(f"Submitted Claude batch {batch.id} with {len(requests)} requests")
+    return {"id": batch.id}
+
+def claude_batch_done(batch_info):
+    batch = get_anthropic_batch_client().messages.batches.retrieve(batch_info["id"])
+    return batch.processing_status == "ended"
+
+def cancel_claude_batch(batch_info):
+    get_anthropic_batch_client().messages.batches.cancel(batch_info["id"])
+
+def fetch_claude_results(batch_info):
+    results = {}
+    for entry in get_anthropic_batch_client().messages.batches.results(batch_info["id"]):
+        if entry.result.type == "succeeded":
+            content = "".join(block.text for block in entry.result.message.content if block.type == "text")
+            results[entry.custom_id] = parse_pricing_response("claude", content)
+        else:
+            results[entry.custom_id] = {"source": "claude", "error": f"Batch request {entry.result.type}"}
+    return results
+
+# Grok: OpenAI-style batch file
+def submit_grok_batch(products):
+    client = get_grok_batch_client()
+    lines = []
+    for index, product in products:
+        lines.append(json.dumps({
+            "custom_id": custom_id(index),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": GROK_MODEL,
+                "messages": [
+                    {"role": "system", "content": GROK_SYSTEM_PROMPT},
+                    {"role": "user", "content": create_llm_prompt(product)}
+                ],
+                "temperature": 0.0,
+                "max_tokens": 2000
+            }
+        }))
+    input_file = client.files.create(
+        file=("pricing_batch.jsonl", "\n".join(lines).encode("utf-8")),
+        purpose="batch"
+    )
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+    logger.info(f"Submitted Grok batch {batch.id} with {len(lines)} requests")
+    return {"id": batch.id, "input_file_id": input_file.id}
+
+def grok_batch_done(batch_info):
+    batch = get_grok_batch_client().batches.retrieve(batch_info["id"])
+    if batch.status in ("failed", "expired", "cancelled"):
+        # Finished without results; the job is collected with the other providers
+        batch_info["error"] = f"Grok batch {batch_info['id']} {batch.status}"
+        return True
+    if batch.status == "completed":
+        batch_info["output_file_id"] = batch.output_file_id
+        return True
+    return False
+
+def cancel_grok_batch(batch_info):
+    get_grok_batch_client().batches.cancel(batch_info["id"])
+
+def fetch_grok_results(batch_info):
+    results = {}
+    if not batch_info.get("output_file_id"):
+        return results
+    content = get_grok_batch_client().files.content(batch_info["output_file_id"]).text
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        response = entry.get("response") or {}
+        if entry.get("error") or response.get("status_code", 200) != 200:
+            results[entry["custom_id"]] = {"source": "grok", "error": str(entry.get("error") or response)}
+            continue
+        message = response["body"]["choices"][0]["message"]["content"]
+        results[entry["custom_id"]] = parse_pricing_response("grok", message)
+    return results
+
+PROVIDERS = {
+    "claude": (submit_claude_batch, claude_batch_done, fetch_claude_results, cancel_claude_batch),
+    "grok": (submit_grok_batch, grok_batch_done, fetch_grok_results, cancel_grok_batch)
+}
+
+def save_job(job, path=None):
+    path = path or os.path.join(get_job_dir(), f"{job['job_id']}.json")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(job, f)
+    os.replace(tmp_path, path)
+    return path
+
+def load_job(path_or_id):
+    path = path_or_id if os.path.exists(path_or_id) else os.path.join(get_job_dir(), f"{path_or_id}.json")
+    with open(path) as f:
+        return json.load(f)
+
+def submit_job(products, use_sources=None, user_id=None):
+    """Submit every uncached product to each provider's batch endpoint; returns the job state
+
+    Estimated tokens of a job submitted for `user_id` are counted towards
+    that user's daily quota when it is collected.
+    """
+    sources = [s for s in (use_sources or BATCH_SOURCES) if s in PROVIDERS]
+    skipped = [s for s in (use_sources or []) if s not in PROVIDERS]
+    if skipped:
+        logger.info(f"No batch endpoint for {skipped}; skipping them in offline mode")
+    if not sources:
+        raise ValueError("No requested source supports offline batch pricing")
+
+    unique_products, _ = dedupe_products(products)
+    pending = []
+    skipped_products = {}
+    for index, product in enumerate(unique_products):
+        if not product.get("brand") or not product.get("model"):
+            skipped_products[str(index)] = {"reason": "invalid"}
+            continue
+        cached = get_cached_entry(product)
+        if cached and not cached["stale"]:
+            skipped_products[str(index)] = {"reason": "cached", "results": cached["results"]}
+            continue
+        pending.append((index, product))
+
+    job = {
+        "job_id": uuid.uuid4().hex,
+        "created_at": datetime.now().isoformat(),
+        "status": "submitted",
+        "user_id": user_id,
+        "sources": sources,
+        "products": unique_products,
+        "pending": [index for index, _ in pending],
+        "skipped": skipped_products,
+        "batches": {}
+    }
+    if pending:
+        for source in sources:
+            submit, _, _, _ = PROVIDERS[source]
+            try:
+                job["batches"][source] = submit(pending)
+            except Exception:
+                # The job is never saved, so nothing would collect the batches already created
+                cancel_batches(job)
+                raise
+    else:
+        job["status"] = "ready"
+    return job
+
+def cancel_batches(job):
+    """Cancel every provider batch of a job that could not be fully submitted"""
+    for source, batch_info in job["batches"].items():
+        _, _, _, cancel = PROVIDERS[source]
+        try:
+            cancel(batch_info)
+            logger.info(f"Cancelled {source} batch {batch_info['id']}")
+        except Exception as e:
+            logger.error(f"Could not cancel {source} batch {batch_info['id']}: {e}")
+
+def poll_job(job):
+    """Check each provider batch once; returns True when every batch has finished"""
+    done = True
+    for source, batch_info in job["batches"].items():
+        if batch_info.get("done"):
+            continue
+        _, is_done, _, _ = PROVIDERS[source]
+        if is_done(batch_info):
+            batch_info["done"] = True
+            if batch_info.get("error"):
+                logger.error(f"{batch_info['error']}; collecting without {source}")
+            else:
+                logger.info(f"{source} batch {batch_info['id']} finished")
+        else:
+            done = False
+    if done:
+        job["status"] = "ready"
+    return done
+
+def wait_for_job(job, poll_interval=60, timeout=24 * 3600, state_path=None):
+    deadline = time.monotonic() + timeout
+    while not poll_job(job):
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Batch job {job['job_id']} did not finish within {timeout} seconds")
+        if state_path:
+            save_job(job, state_path)
+        time.sleep(poll_interval)
+    if state_path:
+        save_job(job, state_path)
+
+def collect_job(job):
+    """Aggregate and cache every product of a finished job
+
+    Returns product results keyed by canonical product key, shaped like the
+    interactive pipeline's results. A provider whose batch failed, or whose
+    results cannot be fetched, is left out and the products are aggregated
+    from the others.
+    """
+    provider_results = {}
+    for source, batch_info in job["batches"].items():
+        if batch_info.get("error"):
+            continue
+        _, _, fetch, _ = PROVIDERS[source]
+        try:
+            provider_results[source] = fetch(batch_info)
+        except Exception as e:
+            logger.error(f"Could not fetch {source} batch {batch_info['id']} results: {e}")
+            batch_info["error"] = f"Could not fetch results: {e}"
+
+    pending = set(job["pending"])
+    results_by_key = {}
+    report = {"products": len(job["products"]), "priced": 0, "from_cache": 0, "errors": 0}
+    tokens = 0
+    for index, product in enumerate(job["products"]):
+        key = canonical_product_key(product)
+        if index not in pending:
+            results_by_key[key] = skipped_result(product, job.get("skipped", {}).get(str(index)))
+            report["errors" if "error" in results_by_key[key] else "from_cache"] += 1
+            continue
+
+        llm_results = [
+            provider_results[source][custom_id(index)]
+            for source in provider_results
+            if custom_id(index) in provider_results[source]
+        ]
+        tokens += estimate_tokens(create_llm_prompt(product), llm_results)
+        final_results = aggregate_results(llm_results) if llm_results else {"error": "No LLM results"}
+        if "error" in final_results:
+            results_by_key[key] = {"product": product, "error": "Failed to aggregate LLM results: " + final_results["error"]}
+            report["errors"] += 1
+            continue
+        if "meta" not in final_results:
+            final_results["meta"] = {}
+        final_results["meta"]["timestamp"] = datetime.now().isoformat()
+        final_results["meta"]["models_used"] = [r["source"] for r in llm_results if "error" not in r]
+        final_results["meta"]["mode"] = "batch"
+        store_result(product, final_results)
+        results_by_key[key] = {"product": product, "results": final_results, "source": "batch"}
+        report["priced"] += 1
+
+    if job.get("user_id") is not None:
+        record_usage(job["user_id"], tokens=tokens)
+    report["estimated_tokens"] = tokens
+    report["failed_sources"] = [source for source, batch_info in job["batches"].items() if batch_info.get("error")]
+    job["status"] = "completed"
+    job["report"] = report
+    logger.info(f"Batch job {job['job_id']} collected: {report}")
+    return results_by_key
+
+def skipped_result(product, skipped):
+    """Result for a product that was not submitted, from the reason recorded at submit time"""
+    if not product.get("brand") or not product.get("model"):
+        return {"product": product, "error": "Brand and model are required"}
+    # A newer cache entry wins over the one embedded in the job
+    cached = get_cached_entry(product)
+    if cached:
+        return {"product": product, "results": cached["results"], "source": "cache"}
+    if skipped and skipped.get("results"):
+        return {"product": product, "results": skipped["results"], "source": "cache"}
+    return {"product": product, "error": "Cached result expired before the job was collected"}
+
+def write_priced_csv(source, output, results_by_key):
+    """Copy CSV rows from `source` to `output` with the pricing columns filled in"""
+    reader = csv.DictReader(source)
+    writer = csv.DictWriter(output, fieldnames=list(reader.fieldnames or []) + RESULT_FIELDS)
+    writer.writeheader()
+    for row in reader:
+        product_result = results_by_key.get(canonical_product_key(product_from_row(row)),
+                                            {"error": "Product missing from batch job"})
+        writer.writerow(row_with_results(row, product_result))
+
+def read_products(source):
+    return [product_from_row(row) for row in csv.DictReader(source)]
+
+def run_job_in_background(job, poll_interval=60, on_complete=None):
+    """Wait for and collect a submitted job on a daemon thread, persisting its state as it goes"""
+    return start_job_thread(save_job(job), poll_interval, on_complete)
+
+def start_job_thread(state_path, poll_interval=60, on_complete=None):
+    """Wait for and collect the job saved at `state_path` unless another process already is"""
+    def run():
+        with open(state_path + ".lock", "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logger.info(f"Batch job {state_path} is being collected by another process")
+                return
+            job = load_job(state_path)
+            if job["status"] not in UNFINISHED_STATUSES:
+                return
+            try:
+                wait_for_job(job, poll_interval=poll_interval, state_path=state_path)
+                results_by_key = collect_job(job)
+                if on_complete:
+                    on_complete(job, results_by_key)
+            except Exception as e:
+                logger.error(f"Batch job {job['job_id']} failed: {e}")
+                if job["status"] != "completed":
+                    refund_reserved_rows(job)
+                job["status"] = "failed"
+                job["error"] = str(e)
+            save_job(job, state_path)
+
+    thread = threading.Thread(target=run, name=f"batch-job-{os.path.basename(state_path)}", daemon=True)
+    thread.start()
+    return thread
+
+def refund_reserved_rows(job):
+    """Hand the rows reserved for a job that was never collected back to its user's daily quota"""
+    if job.get("user_id") is not None and job.get("reserved_rows"):
+        record_usage(job["user_id"], rows=-job["reserved_rows"])
+        logger.info(f"Refunded {job['reserved_rows']} rows of batch job {job['job_id']} to user {job['user_id']}")
+        job["reserved_rows"] = 0
+
+def resume_jobs(poll_interval=60, on_complete=None):
+    """Restart the background wait and collect of every unfinished job in BATCH_JOB_DIR"""
+    job_dir = get_job_dir()
+    if not os.path.isdir(job_dir):
+        return []
+    threads = []
+    for name in sorted(os.listdir(job_dir)):
+        if not name.endswith(".json"):
+            continue
+        state_path = os.path.join(job_dir, name)
+        try:
+            job = load_job(state_path)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not read batch job state {state_path}: {e}")
+            continue
+        if job.get("status") in UNFINISHED_STATUSES:
+            logger.info(f"Resuming batch job {job['job_id']} ({job['status']})")
+            threads.append(start_job_thread(state_path, poll_interval, on_complete))
+    return threads
+
+def main():
+    parser = argparse.ArgumentParser(description="Price a catalog through provider batch APIs.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="Submit, wait for and collect a job")
+    run_parser.add_argument("input", help="Input CSV (brand,model,condition,additional_details)")
+    run_parser.add_argument("output", help="Output CSV with pricing columns")
+    submit_parser = subparsers.add_parser("submit", help="Submit a job and exit")
+    submit_parser.add_argument("input", help="Input CSV (brand,model,condition,additional_details)")
+    collect_parser = subparsers.add_parser("collect", help="Wait for and collect a submitted job")
+    collect_parser.add_argument("--input", required=True, help="The CSV the job was submitted from")
+    collect_parser.add_argument("--output", required=True, help="Output CSV with pricing columns")
+    for sub in (run_parser, submit_parser, collect_parser):
+        sub.add_argument("--state", required=True, help="Job state file")
+        sub.add_argument("--sources", default=",".join(BATCH_SOURCES), help="Comma-separated providers")
+        sub.add_argument("--poll-interval", type=float, default=60, help="Seconds between status checks")
+    args = parser.parse_args()
+
+    if args.command in ("run", "submit"):
+        with open(args.input, newline='', encoding='utf-8-sig') as f:
+            products = read_products(f)
+        job = submit_job(products, [s.strip() for s in args.sources.split(",") if s.strip()])
+        save_job(job, args.state)
+        print(f"Submitted job {job['job_id']} ({len(job['pending'])} products to price)")
+        if args.command == "submit":
+            return
+    else:
+        job = load_job(args.state)
+
+    wait_for_job(job, poll_interval=args.poll_interval, state_path=args.state)
+    results_by_key = collect_job(job)
+    save_job(job, args.state)
+    with open(args.input, newline='', encoding='utf-8-sig') as source, \
+            open(args.output, "w", newline='', encoding='utf-8') as output:
+        write_priced_csv(source, output, results_by_key)
+    print(json.dumps(job["report"], indent=2))
+
+if __name__ == "__main__":
+    configure_logging()
+    main()
@@ -0,0 +1,226 @@
+# batch_standin.py
+"""Local stand-in for the provider batch endpoints used by backend.batch_api
+
+Implements just enough of Anthropic Message Batches (/v1/messages/batches)
+and the OpenAI-style files/batches API (/v1/files, /v1/batches) to run an
+offline job end to end without API keys or batch fees. Every request gets a
+canned pricing answer derived from the prompt, and batches report as
+finished after BATCH_STANDIN_DELAY seconds.
+
+    python -m backend.batch_standin --port 8765
+    ANTHROPIC_BATCH_BASE_URL=http://127.0.0.1:8765 \
+    GROK_BATCH_BASE_URL=http://127.0.0.1:8765/v1 \
+    python -m backend.batch_api run catalog.csv priced.csv --state job.json --poll-interval 1
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+batches = {}
+files = {}
+state_lock = threading.Lock()
+
+def canned_pricing(prompt):
+    """A deterministic, well-formed pricing answer for a prompt"""
+    base = 200 + int(hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:6], 16) % 4800
+
+    def price_range(low, high, explanation):
+        return {"min": round(base * low), "max": round(base * high), "explanation": explanation}
+
+    return json.dumps({
+        "buy_price": price_range(0.5, 0.6, "Stand-in sourcing range"),
+        "max_profit_price": price_range(1.1, 1.25, "Stand-in listing range"),
+        "quick_sale_price": price_range(0.8, 0.9, "Stand-in quick sale range"),
+        "expected_sale_price": price_range(0.95, 1.05, "Stand-in expected sale range"),
+        "estimated_time_to_sell": {"min": 7, "max": 21, "unit": "days", "explanation": "Stand-in estimate"},
+        "factors": ["stand-in"],
+        "market_analysis": "Canned answer from the local batch stand-in."
+    })
+
+def user_prompt(messages):
+    return "".join(m["content"] for m in messages if m.get("role") == "user" and isinstance(m.get("content"), str))
+
+def is_done(batch):
+    return time.time() - batch["created"] >= float(os.environ.get("BATCH_STANDIN_DELAY", "1"))
+
+class StandinHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_text(self, text, content_type="application/octet-stream"):
+        body = text.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_POST(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path == "/v1/messages/batches":
+            return self.create_message_batch(json.loads(self.read_body()))
+        if path == "/v1/files":
+            return self.upload_file(self.read_body())
+        if path == "/v1/batches":
+            return self.create_openai_batch(json.loads(self.read_body()))
+        match = re.fullmatch(r"/v1/(messages/)?batches/([\w-]+)/cancel", path)
+        if match and match.group(2) in batches:
+            self.read_body()
+            batch = batches[match.group(2)]
+            batch["cancelled"] = True
+            return self.send_json(self.message_batch(batch) if match.group(1) else self.openai_batch(batch))
+        self.send_json({"error": {"message": f"Unknown path {path}"}}, 404)
+
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        match = re.fullmatch(r"/v1/messages/batches/([\w-]+)(/results)?", path)
+        if match and match.group(1) in batches:
+            if match.group(2):
+                return self.send_text(batches[match.group(1)]["results"], "application/x-jsonl")
+            return self.send_json(self.message_batch(batches[match.group(1)]))
+        match = re.fullmatch(r"/v1/batches/([\w-]+)", path)
+        if match and match.group(1) in batches:
+            return self.send_json(self.openai_batch(batches[match.group(1)]))
+        match = re.fullmatch(r"/v1/files/([\w-]+)/content", path)
+        if match and match.group(1) in files:
+            return self.send_text(files[match.group(1)])
+        self.send_json({"error": {"message": f"Unknown path {path}"}}, 404)
+
+    # Anthropic Message Batches
+    def create_message_batch(self, payload):
+        lines = []
+        for item in payload["requests"]:
+            params = item["params"]
+            lines.append(json.dumps({
+                "custom_id": item["custom_id"],
+                "result": {
+                    "type": "succeeded",
+                    "message": {
+                        "id": f"msg_{uuid.uuid4().hex}",
+                        "type": "message",
+                        "role": "assistant",
+                        "model": params["model"],
+                        "content": [{"type": "text", "text": canned_pricing(user_prompt(params["messages"]))}],
+                        "stop_reason": "end_turn",
+                        "stop_sequence": None,
+                        "usage": {"input_tokens": 0, "output_tokens": 0}
+                    }
+                }
+            }))
+        batch = {"id": f"msgbatch_{uuid.uuid4().hex}", "created": time.time(), "count": len(lines),
+                 "results": "\n".join(lines)}
+        with state_lock:
+            batches[batch["id"]] = batch
+        self.send_json(self.message_batch(batch))
+
+    def message_batch(self, batch):
+        done = is_done(batch)
+        host = self.headers.get("Host")
+        created = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(batch["created"]))
+        return {
+            "id": batch["id"],
+            "type": "message_batch",
+            "processing_status": "ended" if done else "in_progress",
+            "request_counts": {
+                "processing": 0 if done else batch["count"], "succeeded": batch["count"] if done else 0,
+                "errored": 0, "canceled": 0, "expired": 0
+            },
+            "created_at": created,
+            "expires_at": created,
+            "ended_at": created if done else None,
+            "archived_at": None,
+            "cancel_initiated_at": None,
+            "results_url": f"http://{host}/v1/messages/batches/{batch['id']}/results" if done else None
+        }
+
+    # OpenAI-style files and batches
+    def upload_file(self, body):
+        message = BytesParser(policy=HTTP).parsebytes(
+            b"Content-Type: " + self.headers["Content-Type"].encode("latin-1") + b"\r\n\r\n" + body
+        )
+        content = ""
+        for part in message.iter_parts():
+            if part.get_param("name", header="content-disposition") == "file":
+                content = part.get_payload(decode=True).decode("utf-8")
+        file_id = f"file-{uuid.uuid4().hex}"
+        with state_lock:
+            files[file_id] = content
+        self.send_json({"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                        "filename": "input.jsonl", "purpose": "batch"})
+
+    def create_openai_batch(self, payload):
+        lines = []
+        for line in files.get(payload["input_file_id"], "").splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            lines.append(json.dumps({
+                "id": f"batch_req_{uuid.uuid4().hex}",
+                "custom_id": item["custom_id"],
+                "response": {
+                    "status_code": 200,
+                    "body": {
+                        "object": "chat.completion",
+                        "model": item["body"]["model"],
+                        "choices": [{
+                            "index": 0,
+                            "message": {"role": "assistant", "content": canned_pricing(user_prompt(item["body"]["messages"]))},
+                            "finish_reason": "stop"
+                        }]
+                    }
+                },
+                "error": None
+            }))
+        output_file_id = f"file-{uuid.uuid4().hex}"
+        batch = {"id": f"batch_{uuid.uuid4().hex}", "created": time.time(), "count": len(lines),
+                 "input_file_id": payload["input_file_id"], "endpoint": payload["endpoint"],
+                 "completion_window": payload["completion_window"], "output_file_id": output_file_id}
+        with state_lock:
+            files[output_file_id] = "\n".join(lines)
+            batches[batch["id"]] = batch
+        self.send_json(self.openai_batch(batch))
+
+    def openai_batch(self, batch):
+        done = is_done(batch)
+        return {
+            "id": batch["id"],
+            "object": "batch",
+            "endpoint": batch["endpoint"],
+            "input_file_id": batch["input_file_id"],
+            "completion_window": batch["completion_window"],
+            "status": "cancelled" if batch.get("cancelled") else "completed" if done else "in_progress",
+            "output_file_id": batch["output_file_id"] if done else None,
+            "created_at": int(batch["created"]),
+            "request_counts": {"total": batch["count"], "completed": batch["count"] if done else 0, "failed": 0}
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve stand-in provider batch endpoints.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), StandinHandler)
+    print(f"Batch stand-in listening on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+# bulk.py
+"""Headless bulk pricing: the /api/bulk_price pipeline without the web layer
+
+Prices one or more CSVs in the bulk upload format (brand,model,condition,
+additional_details). It uses the same stream_bulk_results /
+process_product_batch / cache pipeline as the upload endpoint, so dispatch
+priority, deduplication and caching all apply. There is no request
+timeout.
+
+Inputs may be local paths, local globs or gs://bucket/prefix* globs. Each
+input gets a priced output CSV. Output rows are written in input order and
+flushed as they finish, so an interrupted run resumes from the rows already
+in its output file.
+
+CLI:
+    python -m backend.bulk 'catalogs/*.csv' --output-dir priced/
+    python -m backend.bulk gs://my-bucket/catalogs/*.csv --output-dir gs://my-bucket/priced --processes 4
+"""
+import argparse
+import asyncio
+import csv
+import fnmatch
+import glob
+import hashlib
+import logging
+import os
+import sys
+import time
+
+from .cache import is_shared_backend
+from .logging_setup import configure_logging
+from .pipeline import RESULT_FIELDS, product_from_row, row_with_results, stream_bulk_results
+from .sharding import stream_sharded_results
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOURCES = ["claude", "gemini", "grok"]
+
+def is_gcs(path):
+    return path.startswith("gs://")
+
+def split_gcs(path):
+    bucket, _, name = path[len("gs://"):].partition("/")
+    return bucket, name
+
+def get_storage_client():
+    from google.cloud import storage
+    return storage.Client()
+
+# Files this tool writes; a glob that re-runs a job to resume it must not pick them up as inputs
+OUTPUT_SUFFIXES = (".priced.csv", ".partial")
+
+def is_output(path):
+    return path.endswith(OUTPUT_SUFFIXES)
+
+def expand_inputs(patterns):
+    """Resolve local paths/globs and gs:// globs to a sorted, de-duplicated list of CSV paths
+
+    Glob matches skip this tool's own outputs (*.priced.csv, *.partial).
+    """
+    paths = []
+    for pattern in patterns:
+        if is_gcs(pattern):
+            bucket, name = split_gcs(pattern)
+            if not glob.has_magic(name):
+                paths.append(pattern)
+                continue
+            prefix = name[:min(name.index(c) for c in "*?[" if c in name)]
+            for blob in get_storage_client().list_blobs(bucket, prefix=prefix):
+                if fnmatch.fnmatch(blob.name, name) and not is_output(blob.name):
+                    paths.append(f"gs://{bucket}/{blob.name}")
+        else:
+            matches = [path for path in glob.glob(pattern) if not is_output(path)]
+            paths.extend(matches if glob.has_magic(pattern) else [pattern])
+    return sorted(dict.fromkeys(paths))
+
+def output_path_for(input_path, output_dir):
+    """Where the priced CSV for `input_path` goes: in `output_dir`, or next to the input (local or GCS)"""
+    base = os.path.basename(split_gcs(input_path)[1] if is_gcs(input_path) else input_path)
+    name = f"{os.path.splitext(base)[0]}.priced.csv"
+    if output_dir is None:
+        if is_gcs(input_path):
+            return input_path.rsplit("/", 1)[0] + "/" + name
+        return os.path.join(os.path.dirname(input_path), name)
+    if is_gcs(output_dir):
+        return output_dir.rstrip("/") + "/" + name
+    return os.path.join(output_dir, name)
+
+def open_input(path):
+    if is_gcs(path):
+        bucket, name = split_gcs(path)
+        blob = get_storage_client().bucket(bucket).blob(name)
+        blob.reload()
+        return blob.open("r", encoding="utf-8-sig", newline="", chunk_size=1024 * 1024)
+    return open(path, encoding="utf-8-sig", newline="")
+
+def count_rows(path):
+    """Data rows in a local CSV (None for GCS inputs, where it would mean a second download)"""
+    if is_gcs(path):
+        return None
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        return max(0, sum(1 for _ in csv.reader(f)) - 1)
+
+def partial_path_for(input_path, output_path):
+    """Local partial file for a GCS output, keyed on the full input and output URIs"""
+    digest = hashlib.sha1(f"{input_path}\n{output_path}".encode("utf-8")).hexdigest()[:16]
+    return f"{os.path.basename(split_gcs(output_path)[1])}.{digest}.partial"
+
+def completed_rows(path, fieldnames):
+    """Data rows already written to a partial output file, trimming a torn last line
+
+    A file whose header is not `fieldnames` was written for another input,
+    so it counts as empty and is rewritten.
+    """
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+    with open(path, encoding="utf-8", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header != fieldnames:
+            if header is not None:
+                logger.warning(f"Header of {path} does not match this input; starting it over")
+            return 0
+        return sum(1 for _ in reader)
+
+class Progress:
+    """Live progress line on stderr (a periodic log line when stderr is not a terminal)"""
+
+    def __init__(self, label, total=None, skipped=0, interval=1.0):
+        self.label = label
+        self.total = total
+        self.skipped = skipped
+        self.interval = interval if sys.stderr.isatty() else 30.0
+        self.started = time.monotonic()
+        self.last_shown = 0
+        self.counts = {"rows": 0, "from_cache": 0, "errors": 0}
+
+    def update(self, product_result):
+        self.counts["rows"] += 1
+        if "error" in product_result:
+            self.counts["errors"] += 1
+        elif product_result.get("source") == "cache":
+            self.counts["from_cache"] += 1
+        if time.monotonic() - self.last_shown >= self.interval:
+            self.show()
+
+    def show(self, final=False):
+        self.last_shown = time.monotonic()
+        elapsed = max(self.last_shown - self.started, 1e-9)
+        done = self.skipped + self.counts["rows"]
+        rate = self.counts["rows"] / elapsed
+        line = (f"{self.label}: {done}" + (f"/{self.total}" if self.total is not None else "")
+                + f" rows, {rate:.1f} rows/s, {self.counts['from_cache']} cached, {self.counts['errors']} errors")
+        if self.total is not None and rate > 0 and not final:
+            line += f", ETA {int((self.total - done) / rate)}s"
+        if sys.stderr.isatty():
+            sys.stderr.write("\r" + line + ("\n" if final else ""))
+            sys.stderr.flush()
+        else:
+            logger.info(line)
+
+async def price_file(input_path, output_path, use_sources, batch_size=10, max_in_flight=2, batch_interval=12,
+                     processes=None):
+    """Price one CSV into `output_path`, resuming after any rows it already holds; returns the counts"""
+    upload_to = None
+    if is_gcs(output_path):
+        # Work on a local partial file so an interrupted run can resume, then upload it
+        upload_to = output_path
+        output_path = partial_path_for(input_path, output_path)
+    total = count_rows(input_path)
+
+    with open_input(input_path) as source:
+        reader = csv.DictReader(source)
+        fieldnames = list(reader.fieldnames or []) + RESULT_FIELDS
+        done = completed_rows(output_path, fieldnames)
+        progress = Progress(os.path.basename(input_path), total=total, skipped=done)
+
+        with open(output_path, "a", encoding="utf-8", newline="") as output:
+            writer = csv.DictWriter(output, fieldnames=fieldnames)
+            if done == 0:
+                output.truncate(0)
+                writer.writeheader()
+            else:
+                logger.info(f"Resuming {input_path} after {done} rows already in {output_path}")
+            for _ in range(done):
+                next(reader, None)
+
+            if processes and processes > 1:
+                results_stream = stream_sharded_results(reader, use_sources, processes=processes, batch_size=batch_size)
+            else:
+                rows = ((row, product_from_row(row)) for row in reader)
+                results_stream = stream_bulk_results(
+                    rows, use_sources, batch_size=batch_size, max_in_flight=max_in_flight, batch_interval=batch_interval
+                )
+            async for row, product_result in results_stream:
+                writer.writerow(row_with_results(row, product_result))
+                output.flush()
+                progress.update(product_result)
+    progress.show(final=True)
+
+    if upload_to:
+        bucket, name = split_gcs(upload_to)
+        get_storage_client().bucket(bucket).blob(name).upload_from_filename(output_path, content_type="text/csv")
+        os.remove(output_path)
+        logger.info(f"Uploaded {upload_to}")
+    return dict(progress.counts, skipped=done)
+
+def main():
+    parser = argparse.ArgumentParser(description="Price bulk CSVs through the pricing pipeline.")
+    parser.add_argument("inputs", nargs="+", help="CSV paths or globs, local or gs://bucket/path")
+    parser.add_argument("--output-dir", help="Local directory or gs:// prefix for the priced CSVs (default: next to each input)")
+    parser.add_argument("--sources", default=",".join(DEFAULT_SOURCES), help="Comma-separated LLMs to query")
+    parser.add_argument("--batch-size", type=int, default=10, help="Products per LLM batch")
+    parser.add_argument("--max-in-flight", type=int, default=2, help="Batches priced concurrently")
+    parser.add_argument("--batch-interval", type=float, default=12, help="Minimum seconds between LLM batch launches")
+    parser.add_argument("--processes", type=int, default=0, help="Shard each file across this many processes (needs CACHE_BACKEND=sqlite or firebase)")
+    args = parser.parse_args()
+
+    inputs = expand_inputs(args.inputs)
+    if not inputs:
+        parser.error("No input files matched")
+    if args.output_dir and not is_gcs(args.output_dir):
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    if args.processes > 1 and not is_shared_backend():
+        parser.error("--processes needs a shared cache backend (CACHE_BACKEND=sqlite or firebase)")
+
+    use_sources = [s.strip() for s in args.sources.split(",") if s.strip()]
+    for input_path in inputs:
+        output_path = output_path_for(input_path, args.output_dir)
+        counts = asyncio.run(price_file(
+            input_path, output_path, use_sources,
+            batch_size=args.batch_size,
+            max_in_flight=args.max_in_flight,
+            batch_interval=args.batch_interval,
+            processes=args.processes
+        ))
+        logger.info(f"Priced {input_path} -> {output_path}: {counts}")
+
+if __name__ == "__main__":
+    configure_logging()
+    main()
@@ -1,60 +1,298 @@
 # cache.py
 import os
+import json
 import time
+import sqlite3
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .codec import encode_record, decode_record
+from .history import record_observation
+from .matcher import ProductIndex
 
 logger = logging.getLogger(__name__)
 
 # In-memory cache for development
 in_memory_cache = {}
 
-def get_cached_result(product_info):
-    """Check if we have cached results for similar product"""
+# Similarity index over every key this process has stored or served, so
+# "LV Neverfull MM" can hit the entry cached for "Louis Vuitton - Neverfull MM"
+product_index = ProductIndex()
+
+# Background refreshes of stale entries, de-duplicated per cache key
+refresh_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("CACHE_REFRESH_WORKERS", "2")))
+refreshing_keys = set()
+refreshing_lock = threading.Lock()
+
+def get_cache_backend():
+    """Cache backend: "memory" (per worker), "sqlite" (shared by all workers on the box) or "firebase"
+
+    CACHE_BACKEND selects it explicitly; otherwise USE_FIREBASE=true keeps
+    selecting Firebase and everything else falls back to memory.
+    """
+    backend = os.environ.get("CACHE_BACKEND")
+    if backend:
+        return backend.lower()
     if os.environ.get("USE_FIREBASE", "False").lower() == "true":
-        return get_firebase_cached_result(product_info)
+        return "firebase"
+    return "memory"
+
+def is_shared_backend():
+    """True when other processes (and later runs) see the entries this process stores"""
+    return get_cache_backend() in ("sqlite", "firebase")
+
+def get_fuzzy_match_threshold():
+    return float(os.environ.get("FUZZY_MATCH_THRESHOLD", "0.8"))
+
+def get_cache_ttls():
+    """Soft TTL (serve fresh) and hard TTL (serve stale, then miss), in seconds"""
+    soft_ttl = int(os.environ.get("CACHE_SOFT_TTL", "86400"))  # 24 hours
+    hard_ttl = int(os.environ.get("CACHE_HARD_TTL", "604800"))  # 7 days
+    return soft_ttl, max(soft_ttl, hard_ttl)
+
+def get_cache_key(product_info):
+    # Create a simplified key for lookup (brand + model)
+    return f"{product_info.get('brand', '')}-{product_info.get('model', '')}"
+
+def get_cached_entry(product_info, decode=True):
+    """Look up cached results, falling back to the fuzzy product index
+
+    Returns a dict with the cached `results`, the cache `key` that served
+    them, the similarity `score` (1.0 for an exact key hit), the
+    `product_info` the entry was stored with, and `stale` when the entry is
+    past its soft TTL but within the hard one. Returns None on a miss.
+
+    With decode=False the encoded `record` is returned and `results` stays
+    None until entry_results() decodes it, so callers that may not need the
+    body (ETag revalidation, TTL checks) skip the decompress.
+    """
+    backend = get_cache_backend()
+    if backend == "firebase":
+        lookup = get_firebase_cache_entry
+    elif backend == "sqlite":
+        lookup = get_sqlite_cache_entry
+        sync_sqlite_index()
+    else:
+        lookup = get_memory_cache_entry
+    
+    cache_key = get_cache_key(product_info)
+    score = 1.0
+    cache_entry = lookup(cache_key)
+    if cache_entry is not None:
+        product_index.add(cache_key, product_info)
     else:
-        return get_memory_cached_result(product_info)
+        match = product_index.match(product_info, get_fuzzy_match_threshold())
+        if not match:
+            return None
+        cache_key, score = match
+        cache_entry = lookup(cache_key)
+        if cache_entry is None:
+            return None
+        logger.debug("Fuzzy cache hit for %s: %s (score %s)", get_cache_key(product_info), cache_key, score)
+    
+    soft_ttl, _ = get_cache_ttls()
+    age = int(time.time()) - cache_entry.get('timestamp', 0)
+    record = cache_entry.get('record')
+    results = cache_entry.get('results')
+    if results is None and record is not None and decode:
+        results = decode_record(record)
+    return {
+        "results": results,
+        "record": record,
+        "key": cache_key,
+        "score": score,
+        "product_info": cache_entry.get('product_info') or product_info,
+        "timestamp": cache_entry.get('timestamp', 0),
+        "age": age,
+        "stale": age >= soft_ttl
+    }
+
+def entry_results(entry):
+    """The results of a get_cached_entry() entry, decoding its record if that has not happened yet"""
+    if entry["results"] is None and entry["record"] is not None:
+        entry["results"] = decode_record(entry["record"])
+    return entry["results"]
+
+def get_cached_result(product_info):
+    """Check if we have cached results for similar product"""
+    entry = get_cached_entry(product_info)
+    return entry["results"] if entry else None
+
+def schedule_refresh(cache_key, refresh):
+    """Run `refresh()` in the background unless a refresh of `cache_key` is already queued
+
+    Returns True if a refresh was scheduled by this call.
+    """
+    with refreshing_lock:
+        if cache_key in refreshing_keys:
+            return False
+        refreshing_keys.add(cache_key)
+    
+    def run():
+        try:
+            refresh()
+            logger.info(f"Background refresh completed for {cache_key}")
+        except Exception as e:
+            logger.error(f"Background refresh failed for {cache_key}: {e}")
+        finally:
+            with refreshing_lock:
+                refreshing_keys.discard(cache_key)
+    
+    refresh_executor.submit(run)
+    logger.info(f"Scheduled background refresh for {cache_key}")
+    return True
 
 def store_result(product_info, results):
-    """Store results in cache"""
-    if os.environ.get("USE_FIREBASE", "False").lower() == "true":
+    """Store results in cache, returning the entry timestamp (None if the write failed)"""
+    product_index.add(get_cache_key(product_info), product_info)
+    record_observation(product_info, results)
+    backend = get_cache_backend()
+    if backend == "firebase":
         return store_firebase_result(product_info, results)
+    elif backend == "sqlite":
+        return store_sqlite_result(product_info, results)
     else:
         return store_memory_result(product_info, results)
 
+def is_within_hard_ttl(cache_entry):
+    _, hard_ttl = get_cache_ttls()
+    return int(time.time()) - cache_entry.get('timestamp', 0) < hard_ttl
+
 # In-memory cache implementation
-def get_memory_cached_result(product_info):
-    # Create a simplified key for lookup (brand + model)
-    cache_key = f"{product_info.get('brand', '')}-{product_info.get('model', '')}"
-    
+def get_memory_cache_entry(cache_key):
     if cache_key in in_memory_cache:
         cache_entry = in_memory_cache[cache_key]
         
-        # Check if cache is fresh (less than 24 hours old)
-        timestamp = cache_entry.get('timestamp', 0)
-        current_time = int(time.time())
-        if current_time - timestamp < 86400:  # 24 hours
-            logger.info(f"Cache hit for {cache_key}")
-            return cache_entry.get('results')
+        if is_within_hard_ttl(cache_entry):
+            logger.debug("Cache hit for %s", cache_key)
+            return {
+                'product_info': cache_entry['product_info'],
+                'record': cache_entry['record'],
+                'timestamp': cache_entry['timestamp']
+            }
         else:
-            logger.info(f"Cache expired for {cache_key}")
+            logger.debug("Cache expired for %s", cache_key)
     
     return None
 
 def store_memory_result(product_info, results):
-    # Create a simplified key for storage
-    cache_key = f"{product_info.get('brand', '')}-{product_info.get('model', '')}"
+    cache_key = get_cache_key(product_info)
+    timestamp = int(time.time())
     
+    # Results are kept compressed; they are only decoded when a hit needs the body
     in_memory_cache[cache_key] = {
         'product_info': product_info,
-        'results': results,
-        'timestamp': int(time.time())
+        'record': encode_record(results),
+        'timestamp': timestamp
     }
     
-    logger.info(f"Stored results in memory cache for {cache_key}")
+    logger.debug("Stored results in memory cache for %s", cache_key)
+    return timestamp
+
+# SQLite implementation (used when CACHE_BACKEND=sqlite)
+#
+# One WAL-mode database file per box: every gunicorn worker reads and writes
+# the same entries, readers never block on the single writer, and entries
+# survive restarts and deploys. Expiry is indexed so purges stay cheap.
+sqlite_local = threading.local()
+sqlite_state = {"last_purge": 0, "last_index_sync": None}
+
+def get_sqlite_cache_path():
+    return os.environ.get("CACHE_DB_PATH", "/opt/render/project/src/data/cache.db")
+
+def get_sqlite_connection():
+    """Per-thread connection to the shared cache database"""
+    conn = getattr(sqlite_local, "conn", None)
+    if conn is None:
+        db_path = get_sqlite_cache_path()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(db_path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS pricing_cache (
+                cache_key TEXT PRIMARY KEY,
+                product_info TEXT NOT NULL,
+                results BLOB NOT NULL,
+                timestamp INTEGER NOT NULL,
+                expires_at INTEGER NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_pricing_cache_expires_at ON pricing_cache (expires_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_pricing_cache_timestamp ON pricing_cache (timestamp)")
+        sqlite_local.conn = conn
+    return conn
+
+def get_sqlite_cache_entry(cache_key):
+    try:
+        row = get_sqlite_connection().execute(
+            "SELECT product_info, results, timestamp FROM pricing_cache WHERE cache_key = ? AND expires_at > ?",
+            (cache_key, int(time.time()))
+        ).fetchone()
+        if row:
+            logger.debug("SQLite cache hit for %s", cache_key)
+            return {
+                'product_info': json.loads(row[0]),
+                'record': row[1],
+                'timestamp': row[2]
+            }
+    except sqlite3.Error as e:
+        logger.error(f"Error checking SQLite cache: {e}")
+    
+    return None
+
+def store_sqlite_result(product_info, results):
+    cache_key = get_cache_key(product_info)
+    timestamp = int(time.time())
+    _, hard_ttl = get_cache_ttls()
+    try:
+        conn = get_sqlite_connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO pricing_cache (cache_key, product_info, results, timestamp, expires_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (cache_key, json.dumps(product_info), encode_record(results), timestamp, timestamp + hard_ttl)
+        )
+        logger.debug("Stored results in SQLite cache for %s", cache_key)
+        
+        # Drop hard-expired entries at most every 10 minutes
+        if timestamp - sqlite_state["last_purge"] >= 600:
+            sqlite_state["last_purge"] = timestamp
+            deleted = conn.execute("DELETE FROM pricing_cache WHERE expires_at <= ?", (timestamp,)).rowcount
+            if deleted:
+                logger.info(f"Purged {deleted} expired SQLite cache entries")
+        return timestamp
+    except sqlite3.Error as e:
+        logger.error(f"Error storing in SQLite cache: {e}")
+
+def sync_sqlite_index():
+    """Add entries written by other workers (or before a restart) to the fuzzy index
+
+    Loads every live entry the first time, then only entries newer than the
+    previous sync, at most every 30 seconds.
+    """
+    now = int(time.time())
+    last_sync = sqlite_state["last_index_sync"]
+    if last_sync is not None and now - last_sync < 30:
+        return
+    sqlite_state["last_index_sync"] = now
+    try:
+        if last_sync is None:
+            rows = get_sqlite_connection().execute(
+                "SELECT cache_key, product_info FROM pricing_cache WHERE expires_at > ?", (now,)
+            )
+        else:
+            rows = get_sqlite_connection().execute(
+                "SELECT cache_key, product_info FROM pricing_cache WHERE timestamp >= ?", (last_sync,)
+            )
+        for cache_key, product_info in rows:
+            product_index.add(cache_key, json.loads(product_info))
+    except sqlite3.Error as e:
+        logger.error(f"Error syncing fuzzy index from SQLite cache: {e}")
 
 # Firebase implementation (used when USE_FIREBASE=true)
-def get_firebase_cached_result(product_info):
+def get_firebase_cache_entry(cache_key):
     try:
         import firebase_admin
         from firebase_admin import firestore
@@ -68,23 +306,16 @@ def get_firebase_cached_result(product_info):
         
         db = firestore.client()
         
-        # Create a simplified key for lookup
-        cache_key = f"{product_info.get('brand', '')}-{product_info.get('model', '')}"
-        
         cache_ref = db.collection('pricing_cache').document(cache_key)
         doc = cache_ref.get()
         
         if doc.exists:
             data = doc.to_dict()
-            timestamp = data.get('timestamp', 0)
-            current_time = int(time.time())
-            
-            # Check if cache is fresh (less than 24 hours old)
-            if current_time - timestamp < 86400:  # 24 hours
-                logger.info(f"Firebase cache hit for {cache_key}")
-                return data.get('results')
+            if is_within_hard_ttl(data):
+                logger.debug("Firebase cache hit for %s", cache_key)
+                return data
             else:
-                logger.info(f"Firebase cache expired for {cache_key}")
+                logger.debug("Firebase cache expired for %s", cache_key)
     except Exception as e:
         logger.error(f"Error checking Firebase cache: {e}")
     
@@ -104,16 +335,17 @@ def store_firebase_result(product_info, results):
         
         db = firestore.client()
         
-        # Create a simplified key for storage
-        cache_key = f"{product_info.get('brand', '')}-{product_info.get('model', '')}"
+        cache_key = get_cache_key(product_info)
+        timestamp = int(time.time())
         
         cache_ref = db.collection('pricing_cache').document(cache_key)
         cache_ref.set({
             'product_info': product_info,
             'results': results,
-            'timestamp': int(time.time())
+            'timestamp': timestamp
         })
         
-        logger.info(f"Stored results in Firebase cache for {cache_key}")
+        logger.debug("Stored results in Firebase cache for %s", cache_key)
+        return timestamp
     except Exception as e:
         logger.error(f"Error storing in Firebase cache: {e}")
\ No newline at end of file
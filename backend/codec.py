@@ -0,0 +1,130 @@
+# codec.py
+"""Serialization for API responses and cache records
+
+Responses use orjson when it is installed. Cache records are stored in a
+compact positional layout (the fixed pricing schema becomes a flat list, so
+field names are not repeated in every entry), packed with msgpack and
+compressed with zstd. Without those packages records fall back to
+JSON + zlib. Every record starts with a one-byte format tag, so either
+format stays readable after a dependency is added or removed.
+
+The gain is size: msgpack + zstd records are about 70% smaller than plain
+JSON. Encoding and decoding take about as long as json.dumps / json.loads,
+with run-to-run noise either way (see benchmarks/bench_codec.py); they are
+not faster. The memory cache keeps records encoded too, so every cache hit
+that needs the body pays for a decompress (a 304 revalidation does not).
+"""
+import json
+import threading
+import zlib
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+    import zstandard
+except ImportError:
+    msgpack = None
+    zstandard = None
+
+PRICE_FIELDS = ["buy_price", "max_profit_price", "quick_sale_price", "expected_sale_price"]
+PRICE_KEYS = {"min", "max", "explanation"}
+TIME_KEYS = {"min", "max", "unit", "explanation"}
+
+FORMAT_ZSTD_MSGPACK = b"Z"
+FORMAT_ZLIB_JSON = b"J"
+
+COMPACT_V1 = 1
+RAW = 0
+
+# zstd (de)compressor objects must not be shared between threads
+zstd_local = threading.local()
+
+def get_zstd():
+    if not hasattr(zstd_local, "compressor"):
+        zstd_local.compressor = zstandard.ZstdCompressor(level=3)
+        zstd_local.decompressor = zstandard.ZstdDecompressor()
+    return zstd_local.compressor, zstd_local.decompressor
+
+def dumps_json(obj):
+    """Encode an API payload as UTF-8 JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=str).encode("utf-8")
+
+def loads_json(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def is_compactable(results):
+    """True if `results` is a single aggregated pricing dict in the standard schema"""
+    if not isinstance(results, dict):
+        return False
+    for field in PRICE_FIELDS:
+        value = results.get(field)
+        if not isinstance(value, dict) or set(value) != PRICE_KEYS:
+            return False
+    time_to_sell = results.get("estimated_time_to_sell")
+    if not isinstance(time_to_sell, dict) or set(time_to_sell) != TIME_KEYS:
+        return False
+    return isinstance(results.get("factors"), list) and isinstance(results.get("market_analysis"), str)
+
+def compact_results(results):
+    """Flatten a pricing dict into a positional list; anything else is kept as-is"""
+    if not is_compactable(results):
+        return [RAW, results]
+    prices = []
+    for field in PRICE_FIELDS:
+        value = results[field]
+        prices.extend([value["min"], value["max"], value["explanation"]])
+    time_to_sell = results["estimated_time_to_sell"]
+    extra = {k: v for k, v in results.items()
+             if k not in PRICE_FIELDS and k not in ("estimated_time_to_sell", "factors", "market_analysis")}
+    return [
+        COMPACT_V1,
+        prices,
+        [time_to_sell["min"], time_to_sell["max"], time_to_sell["unit"], time_to_sell["explanation"]],
+        results["factors"],
+        results["market_analysis"],
+        extra
+    ]
+
+def expand_results(compact):
+    if compact[0] == RAW:
+        return compact[1]
+    _, prices, time_to_sell, factors, market_analysis, extra = compact
+    results = {}
+    for i, field in enumerate(PRICE_FIELDS):
+        results[field] = {"min": prices[3 * i], "max": prices[3 * i + 1], "explanation": prices[3 * i + 2]}
+    results["estimated_time_to_sell"] = dict(zip(("min", "max", "unit", "explanation"), time_to_sell))
+    results["factors"] = factors
+    results["market_analysis"] = market_analysis
+    results.update(extra)
+    return results
+
+def encode_record(results):
+    """Encode cached pricing results as compact, compressed bytes"""
+    compact = compact_results(results)
+    if msgpack is not None:
+        compressor, _ = get_zstd()
+        return FORMAT_ZSTD_MSGPACK + compressor.compress(msgpack.packb(compact, use_bin_type=True, default=str))
+    return FORMAT_ZLIB_JSON + zlib.compress(json.dumps(compact, default=str).encode("utf-8"), 6)
+
+def decode_record(record):
+    """Decode bytes written by encode_record (or a legacy plain JSON string)"""
+    if isinstance(record, str):
+        return json.loads(record)
+    record = bytes(record)
+    tag, payload = record[:1], record[1:]
+    if tag == FORMAT_ZSTD_MSGPACK:
+        if msgpack is None:
+            raise RuntimeError("Cache record needs msgpack and zstandard to decode")
+        _, decompressor = get_zstd()
+        return expand_results(msgpack.unpackb(decompressor.decompress(payload), raw=False))
+    if tag == FORMAT_ZLIB_JSON:
+        return expand_results(json.loads(zlib.decompress(payload)))
+    return json.loads(record)
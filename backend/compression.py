@@ -0,0 +1,82 @@
+# compression.py
+"""Negotiated response compression and ETags for cached pricing results
+
+Responses larger than COMPRESSION_MIN_SIZE bytes are compressed with brotli
+(if installed) or gzip, whichever the client prefers. Cached `/api/price`
+answers carry an ETag derived from the cache key and entry timestamp, so a
+repeat lookup with If-None-Match can be answered with a 304 before the body
+is serialized.
+"""
+import gzip
+import hashlib
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/csv", "text/html", "text/plain", "text/css", "application/javascript"}
+
+def get_min_size():
+    return int(os.environ.get("COMPRESSION_MIN_SIZE", "1024"))
+
+def parse_accept_encoding(header):
+    """Map each accepted coding to its q-value, e.g. "br;q=1.0, gzip" -> {"br": 1.0, "gzip": 1.0}"""
+    codings = {}
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        codings[name.strip().lower()] = q
+    return codings
+
+def negotiate_encoding(header):
+    """Pick "br", "gzip" or None for an Accept-Encoding header"""
+    codings = parse_accept_encoding(header)
+    wildcard = codings.get("*", 0.0)
+    candidates = []
+    if brotli is not None:
+        candidates.append(("br", codings.get("br", wildcard)))
+    candidates.append(("gzip", codings.get("gzip", wildcard)))
+    best, q = max(candidates, key=lambda c: c[1])
+    return best if q > 0 else None
+
+def compress_body(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=4)
+    return gzip.compress(body, compresslevel=5)
+
+def make_etag(cache_key, timestamp):
+    """Entity tag for a cache entry: changes whenever the entry is rewritten"""
+    return hashlib.sha1(f"{cache_key}:{timestamp}".encode("utf-8")).hexdigest()
+
+def register_compression(app):
+    """Compress eligible responses from `app` after each request"""
+    from flask import request
+
+    @app.after_request
+    def compress_response(response):
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or "Content-Encoding" in response.headers
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+        response.vary.add("Accept-Encoding")
+        body = response.get_data()
+        if len(body) < get_min_size():
+            return response
+        encoding = negotiate_encoding(request.headers.get("Accept-Encoding"))
+        if encoding is None:
+            return response
+        response.set_data(compress_body(body, encoding))
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+    return compress_response
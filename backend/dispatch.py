@@ -0,0 +1,281 @@
+# dispatch.py
+"""Priority dispatch for provider calls shared by every worker on the box
+
+Every ensemble call to the LLM providers first takes a slot. There are
+DISPATCH_CAPACITY slots in total. Callers queue by priority class:
+interactive (/api/price), then bulk (/api/bulk_price, sharded workers,
+stale refreshes), then warmup. A class may only start while no higher class
+is waiting and while the slots reserved for the classes above it stay free.
+So with DISPATCH_RESERVE_INTERACTIVE=1, a bulk job can never take the last
+slot away from a staff member at the counter.
+
+Within a class, calls made on behalf of a user are ordered by weighted fair
+queuing. Each call is tagged with a virtual finish time,
+max(system clock, user's last tag) + cost / weight, and the smallest tag
+goes first. So one user's giant upload interleaves with everyone else's
+batches instead of starving them. A user at their max_concurrency is
+skipped until one of their calls finishes.
+
+Slots and waiters live in a small SQLite database, so gunicorn workers and
+sharding processes share one queue. Queue-wait times are recorded per class
+and exposed by queue_stats().
+"""
+import os
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+import statistics
+from contextlib import asynccontextmanager
+
+from .quotas import get_user_quota
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+WARMUP = "warmup"
+
+# Highest priority first
+PRIORITIES = [INTERACTIVE, BULK, WARMUP]
+
+# Waiters not seen for this long belong to a dead process
+WAITER_TTL = 30
+
+dispatch_local = threading.local()
+last_stats_prune = 0
+
+def dispatch_enabled():
+    return os.environ.get("DISPATCH_ENABLED", "True").lower() == "true"
+
+def get_dispatch_path():
+    return os.environ.get("DISPATCH_DB_PATH", "/opt/render/project/src/data/dispatch.db")
+
+def get_dispatch_settings():
+    return {
+        "capacity": int(os.environ.get("DISPATCH_CAPACITY", "4")),
+        "reserve": {
+            INTERACTIVE: int(os.environ.get("DISPATCH_RESERVE_INTERACTIVE", "1")),
+            BULK: int(os.environ.get("DISPATCH_RESERVE_BULK", "0"))
+        },
+        "lease_ttl": int(os.environ.get("DISPATCH_LEASE_TTL", "300")),
+        "poll_interval": float(os.environ.get("DISPATCH_POLL_INTERVAL", "0.05")),
+        "stats_window": int(os.environ.get("DISPATCH_STATS_WINDOW", "3600"))
+    }
+
+def get_dispatch_connection():
+    """Per-thread connection to the dispatch database"""
+    conn = getattr(dispatch_local, "conn", None)
+    if conn is None:
+        db_path = get_dispatch_path()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(db_path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        # Leases and waiters are transient, so an older layout is simply rebuilt
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(dispatch_waiters)")}
+        if columns and "finish_tag" not in columns:
+            conn.execute("DROP TABLE dispatch_waiters")
+            conn.execute("DROP TABLE IF EXISTS dispatch_leases")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS dispatch_leases (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                priority INTEGER NOT NULL,
+                acquired_at REAL NOT NULL,
+                user_id TEXT
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS dispatch_waiters (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                priority INTEGER NOT NULL,
+                enqueued_at REAL NOT NULL,
+                seen_at REAL NOT NULL,
+                user_id TEXT,
+                finish_tag REAL NOT NULL DEFAULT 0,
+                max_concurrency INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS dispatch_fair_tags (
+                user_id TEXT PRIMARY KEY,
+                tag REAL NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS dispatch_waits (
+                priority INTEGER NOT NULL,
+                waited REAL NOT NULL,
+                finished_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_dispatch_waits_finished_at ON dispatch_waits (finished_at)")
+        dispatch_local.conn = conn
+    return conn
+
+def reserved_above(rank, reserve):
+    """Slots a class of `rank` must leave free for the classes above it"""
+    return sum(reserve.get(priority, 0) for priority in PRIORITIES[:rank])
+
+def enqueue(conn, rank, now, user_id=None, cost=1):
+    """Add a waiter, tagged for weighted fair queuing when it belongs to a user"""
+    if user_id is None:
+        return conn.execute(
+            "INSERT INTO dispatch_waiters (priority, enqueued_at, seen_at) VALUES (?, ?, ?)", (rank, now, now)
+        ).lastrowid
+    quota = get_user_quota(user_id)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # The system clock ('' row) is the tag of the last call dispatched
+        tags = dict(conn.execute(
+            "SELECT user_id, tag FROM dispatch_fair_tags WHERE user_id IN ('', ?)", (str(user_id),)
+        ).fetchall())
+        finish_tag = max(tags.get("", 0.0), tags.get(str(user_id), 0.0)) + cost / max(quota["weight"], 0.001)
+        conn.execute("INSERT OR REPLACE INTO dispatch_fair_tags (user_id, tag) VALUES (?, ?)", (str(user_id), finish_tag))
+        waiter_id = conn.execute(
+            "INSERT INTO dispatch_waiters (priority, enqueued_at, seen_at, user_id, finish_tag, max_concurrency) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (rank, now, now, str(user_id), finish_tag, quota["max_concurrency"])
+        ).lastrowid
+        conn.execute("COMMIT")
+        return waiter_id
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+def try_acquire(conn, waiter_id, rank, settings):
+    """One scheduling attempt; returns a lease id, or None if the waiter must keep waiting"""
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Drop leases and waiters left behind by crashed processes
+        conn.execute("DELETE FROM dispatch_leases WHERE acquired_at < ?", (now - settings["lease_ttl"],))
+        conn.execute("DELETE FROM dispatch_waiters WHERE seen_at < ?", (now - WAITER_TTL,))
+        active = conn.execute("SELECT COUNT(*) FROM dispatch_leases").fetchone()[0]
+        waiter = conn.execute("SELECT user_id, finish_tag FROM dispatch_waiters WHERE id = ?", (waiter_id,)).fetchone()
+        if waiter is None:
+            raise LookupError(f"Dispatch waiter {waiter_id} expired")
+        user_id, finish_tag = waiter
+        # Waiters held back by their own concurrency limit do not block anyone
+        runnable = """
+            (w.user_id IS NULL OR w.max_concurrency <= 0
+             OR (SELECT COUNT(*) FROM dispatch_leases l WHERE l.user_id = w.user_id) < w.max_concurrency)
+        """
+        if not conn.execute(f"SELECT {runnable} FROM dispatch_waiters w WHERE id = ?", (waiter_id,)).fetchone()[0]:
+            ahead = 1
+        else:
+            ahead = conn.execute(
+                f"SELECT COUNT(*) FROM dispatch_waiters w WHERE {runnable} AND (w.priority < ? OR (w.priority = ? "
+                "AND (w.finish_tag < ? OR (w.finish_tag = ? AND w.id < ?))))",
+                (rank, rank, finish_tag, finish_tag, waiter_id)
+            ).fetchone()[0]
+        if ahead == 0 and active < settings["capacity"] - reserved_above(rank, settings["reserve"]):
+            conn.execute("DELETE FROM dispatch_waiters WHERE id = ?", (waiter_id,))
+            lease_id = conn.execute(
+                "INSERT INTO dispatch_leases (priority, acquired_at, user_id) VALUES (?, ?, ?)", (rank, now, user_id)
+            ).lastrowid
+            if user_id is not None:
+                conn.execute(
+                    "INSERT INTO dispatch_fair_tags (user_id, tag) VALUES ('', ?) "
+                    "ON CONFLICT (user_id) DO UPDATE SET tag = MAX(tag, excluded.tag)",
+                    (finish_tag,)
+                )
+        else:
+            conn.execute("UPDATE dispatch_waiters SET seen_at = ? WHERE id = ?", (now, waiter_id))
+            lease_id = None
+        conn.execute("COMMIT")
+        return lease_id
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+def record_wait(conn, rank, waited, settings):
+    global last_stats_prune
+    now = time.time()
+    conn.execute("INSERT INTO dispatch_waits (priority, waited, finished_at) VALUES (?, ?, ?)", (rank, waited, now))
+    if now - last_stats_prune > 60:
+        last_stats_prune = now
+        conn.execute("DELETE FROM dispatch_waits WHERE finished_at < ?", (now - settings["stats_window"],))
+
+@asynccontextmanager
+async def provider_slot(priority=INTERACTIVE, user_id=None, cost=1):
+    """Hold one provider dispatch slot for the duration of the block
+
+    `user_id` and `cost` (e.g. the number of products in a batch) place the
+    call in that user's fair share of its class.
+
+    If the dispatch database is unavailable the call goes ahead unscheduled
+    rather than failing the pricing request.
+    """
+    if not dispatch_enabled():
+        yield
+        return
+    settings = get_dispatch_settings()
+    rank = PRIORITIES.index(priority)
+    enqueued_at = time.time()
+    lease_id = None
+    waiter_id = None
+    try:
+        conn = get_dispatch_connection()
+        waiter_id = enqueue(conn, rank, enqueued_at, user_id, cost)
+        while lease_id is None:
+            try:
+                lease_id = try_acquire(conn, waiter_id, rank, settings)
+            except LookupError:
+                # Our event loop stalled past WAITER_TTL and the entry was reaped
+                waiter_id = enqueue(conn, rank, time.time(), user_id, cost)
+                continue
+            if lease_id is None:
+                await asyncio.sleep(settings["poll_interval"])
+        waited = time.time() - enqueued_at
+        record_wait(conn, rank, waited, settings)
+        if waited > 1:
+            logger.info(f"{priority} provider call waited {waited:.2f}s for a dispatch slot")
+    except sqlite3.Error as e:
+        logger.error(f"Provider dispatch unavailable, calling without a slot: {e}")
+    except BaseException:
+        # Cancelled while queued: give up our place in line
+        if waiter_id is not None and lease_id is None:
+            get_dispatch_connection().execute("DELETE FROM dispatch_waiters WHERE id = ?", (waiter_id,))
+        raise
+    try:
+        yield
+    finally:
+        if lease_id is not None:
+            try:
+                get_dispatch_connection().execute("DELETE FROM dispatch_leases WHERE id = ?", (lease_id,))
+            except sqlite3.Error as e:
+                logger.error(f"Error releasing dispatch slot: {e}")
+
+def queue_stats():
+    """Per-class queue-wait statistics over the last DISPATCH_STATS_WINDOW seconds, plus current load"""
+    settings = get_dispatch_settings()
+    conn = get_dispatch_connection()
+    now = time.time()
+    stats = {
+        "capacity": settings["capacity"],
+        "reserve": settings["reserve"],
+        "window_seconds": settings["stats_window"],
+        "classes": {}
+    }
+    for rank, priority in enumerate(PRIORITIES):
+        waits = sorted(row[0] for row in conn.execute(
+            "SELECT waited FROM dispatch_waits WHERE priority = ? AND finished_at >= ?",
+            (rank, now - settings["stats_window"])
+        ))
+        class_stats = {
+            "active": conn.execute("SELECT COUNT(*) FROM dispatch_leases WHERE priority = ?", (rank,)).fetchone()[0],
+            "waiting": conn.execute("SELECT COUNT(*) FROM dispatch_waiters WHERE priority = ?", (rank,)).fetchone()[0],
+            "dispatched": len(waits)
+        }
+        if waits:
+            class_stats["wait_seconds"] = {
+                "mean": round(statistics.fmean(waits), 3),
+                "p50": round(waits[len(waits) // 2], 3),
+                "p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3),
+                "max": round(waits[-1], 3)
+            }
+        stats["classes"][priority] = class_stats
+    return stats
@@ -0,0 +1,202 @@
+# history.py
+"""Append-only history of every LLM price observation
+
+The cache keeps only the latest valuation per key. This store keeps all of
+them in a local SQLite table indexed on (brand, model, condition,
+observed_at), using the same normalization as the fuzzy matcher. An item's
+range query is one index seek plus a short scan, so it stays fast with
+millions of rows.
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import statistics
+import threading
+
+from .matcher import normalize_brand, normalize_text, model_tokens
+
+logger = logging.getLogger(__name__)
+
+PRICE_FIELDS = ["buy_price", "max_profit_price", "quick_sale_price", "expected_sale_price"]
+
+history_local = threading.local()
+
+def history_enabled():
+    return os.environ.get("HISTORY_ENABLED", "True").lower() == "true"
+
+def get_history_path():
+    return os.environ.get("HISTORY_DB_PATH", "/opt/render/project/src/data/history.db")
+
+def get_history_connection():
+    """Per-thread connection to the history database"""
+    conn = getattr(history_local, "conn", None)
+    if conn is None:
+        db_path = get_history_path()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(db_path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS price_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                brand TEXT NOT NULL,
+                model TEXT NOT NULL,
+                condition TEXT NOT NULL,
+                observed_at INTEGER NOT NULL,
+                buy_price_min REAL,
+                buy_price_max REAL,
+                max_profit_price_min REAL,
+                max_profit_price_max REAL,
+                quick_sale_price_min REAL,
+                quick_sale_price_max REAL,
+                expected_sale_price_min REAL,
+                expected_sale_price_max REAL,
+                time_to_sell_min_days REAL,
+                time_to_sell_max_days REAL,
+                sources TEXT
+            )
+        """)
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_price_history_item
+            ON price_history (brand, model, condition, observed_at)
+        """)
+        history_local.conn = conn
+    return conn
+
+def normalize_item(product_info):
+    """(brand, model, condition) as stored in the history index"""
+    return (
+        normalize_brand(product_info.get('brand', '')),
+        " ".join(model_tokens(product_info)),
+        normalize_text(product_info.get('condition', ''))
+    )
+
+def to_number(value):
+    """A price or duration as a float; None when it is missing or not numeric (e.g. "N/A")"""
+    if isinstance(value, str):
+        value = value.replace(",", "").replace("$", "").strip()
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def to_days(value, unit):
+    value = to_number(value)
+    if value is None:
+        return None
+    return value * 7 if str(unit).lower() == "weeks" else value
+
+def record_observation(product_info, results, observed_at=None):
+    """Append one valuation; results that are not a single pricing dict are ignored"""
+    if not history_enabled() or not isinstance(results, dict):
+        return
+    if not all(isinstance(results.get(field), dict) for field in PRICE_FIELDS):
+        return
+    time_to_sell = results.get("estimated_time_to_sell") or {}
+    unit = time_to_sell.get("unit", "days")
+    values = [to_number(results[field].get(bound)) for field in PRICE_FIELDS for bound in ("min", "max")]
+    try:
+        get_history_connection().execute(
+            "INSERT INTO price_history (brand, model, condition, observed_at, "
+            "buy_price_min, buy_price_max, max_profit_price_min, max_profit_price_max, "
+            "quick_sale_price_min, quick_sale_price_max, expected_sale_price_min, expected_sale_price_max, "
+            "time_to_sell_min_days, time_to_sell_max_days, sources) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (*normalize_item(product_info), int(observed_at or time.time()), *values,
+             to_days(time_to_sell.get("min"), unit), to_days(time_to_sell.get("max"), unit),
+             json.dumps(results.get("meta", {}).get("sources", [])))
+        )
+    except (sqlite3.Error, TypeError) as e:
+        logger.error(f"Error recording price history: {e}")
+
+def query_history(product_info, since=None, until=None, limit=1000):
+    """Observations for one item in [since, until), newest first"""
+    rows = get_history_connection().execute(
+        "SELECT * FROM price_history WHERE brand = ? AND model = ? AND condition = ? "
+        "AND observed_at >= ? AND observed_at < ? ORDER BY observed_at DESC LIMIT ?",
+        (*normalize_item(product_info), int(since or 0), int(until or time.time() + 1), limit)
+    )
+    columns = [c[0] for c in rows.description]
+    return [dict(zip(columns, row)) for row in rows]
+
+def percentiles(values):
+    # Rows written before prices were coerced may hold TEXT; leave them out
+    values = sorted(v for v in values if isinstance(v, (int, float)))
+    if not values:
+        return None
+    if len(values) == 1:
+        p10 = p25 = p75 = p90 = values[0]
+    else:
+        deciles = statistics.quantiles(values, n=20, method="inclusive")
+        p10, p25, p75, p90 = deciles[1], deciles[4], deciles[14], deciles[17]
+    return {
+        "p10": round(p10, 2), "p25": round(p25, 2), "median": round(statistics.median(values), 2),
+        "p75": round(p75, 2), "p90": round(p90, 2)
+    }
+
+def trend(observations, field="expected_sale_price"):
+    """Least-squares slope of the range midpoint, in currency units per day"""
+    points = [
+        (o["observed_at"] / 86400, (o[f"{field}_min"] + o[f"{field}_max"]) / 2)
+        for o in observations
+        if isinstance(o[f"{field}_min"], (int, float)) and isinstance(o[f"{field}_max"], (int, float))
+    ]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    if spread == 0:
+        return None
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / spread
+    return {"per_day": round(slope, 2), "per_30_days": round(slope * 30, 2)}
+
+def summarize_history(product_info, days=30):
+    """Per-field percentile summaries and trend over the last `days` days"""
+    observations = query_history(product_info, since=time.time() - days * 86400, limit=100000)
+    summary = {"days": days, "observations": len(observations)}
+    if not observations:
+        return summary
+    for field in PRICE_FIELDS:
+        summary[field] = {
+            "min": percentiles(o[f"{field}_min"] for o in observations),
+            "max": percentiles(o[f"{field}_max"] for o in observations)
+        }
+    summary["time_to_sell_days"] = {
+        "min": percentiles(o["time_to_sell_min_days"] for o in observations),
+        "max": percentiles(o["time_to_sell_max_days"] for o in observations)
+    }
+    summary["trend"] = trend(observations)
+    summary["first_observed_at"] = observations[-1]["observed_at"]
+    summary["last_observed_at"] = observations[0]["observed_at"]
+    return summary
+
+def history_median_result(product_info, days=30):
+    """A pricing result built from the last `days` days' medians, or None without history"""
+    summary = summarize_history(product_info, days)
+    count = summary["observations"]
+    if not count:
+        return None
+    explanation = f"Median of {count} past valuation{'s' if count != 1 else ''} over the last {days} days"
+    results = {}
+    for field in PRICE_FIELDS:
+        results[field] = {
+            "min": round(summary[field]["min"]["median"]) if summary[field]["min"] else 0,
+            "max": round(summary[field]["max"]["median"]) if summary[field]["max"] else 0,
+            "explanation": explanation
+        }
+    time_min = summary["time_to_sell_days"]["min"]
+    time_max = summary["time_to_sell_days"]["max"]
+    results["estimated_time_to_sell"] = {
+        "min": round(time_min["median"]) if time_min else 0,
+        "max": round(time_max["median"]) if time_max else 0,
+        "unit": "days",
+        "explanation": explanation
+    }
+    results["factors"] = []
+    results["market_analysis"] = explanation + "."
+    results["meta"] = {"sources": ["history"], "observations": count, "trend": summary["trend"]}
+    return results
@@ -1,5 +1,6 @@
 # llm_clients.py
 import os
+import asyncio
 import requests
 import json
 import re
@@ -8,8 +9,6 @@ import anthropic
 import google.generativeai as genai
 from openai import AsyncOpenAI
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Initialize clients
@@ -45,8 +44,21 @@ class GrokClient:
 # Initialize Grok
 grok_client = GrokClient(api_key=os.environ.get("GROK_API_KEY"))
 
+# Aggregation weight and display name for each provider
+SOURCE_CONFIDENCE = {"claude": 0.9, "gemini": 0.8, "grok": 0.85}
+SOURCE_NAMES = {"claude": "Claude", "gemini": "Gemini", "grok": "Grok"}
+
+# Shared request settings, also used by the offline batch mode
+CLAUDE_MODEL = "claude-3-7-sonnet-20250219"
+CLAUDE_SYSTEM_PROMPT = "You are a luxury goods pricing expert with extensive knowledge of the resale market. Provide accurate price recommendations and sale time estimates based on current market data."
+GROK_MODEL = "grok-3-beta"
+GROK_SYSTEM_PROMPT = "You are a luxury goods pricing expert with extensive knowledge of the resale market."
+
 def create_llm_prompt(product_info):
-    """Create standardized prompt for all LLMs"""
+    """Create standardized prompt for all LLMs (or pass through a combined batch prompt)"""
+    if product_info.get("combined_prompt"):
+        return product_info["combined_prompt"]
+    
     condition = product_info.get('condition', 'excellent')
     brand = product_info.get('brand', '')
     model = product_info.get('model', '')
@@ -102,60 +114,66 @@ def create_llm_prompt(product_info):
     """
     return prompt
 
+def parse_pricing_response(source, content):
+    """Extract the pricing JSON from a model response (bare JSON or a ```json fence)"""
+    name = SOURCE_NAMES[source]
+    try:
+        pricing_data = json.loads(content)
+    except json.JSONDecodeError:
+        json_match = re.search(r'```json\s*([\s\S]*?)\s*```', content)
+        if json_match:
+            try:
+                pricing_data = json.loads(json_match.group(1))
+            except:
+                return {
+                    "error": f"Could not parse JSON from {name} response",
+                    "raw_response": content
+                }
+        else:
+            return {
+                "error": f"Could not extract JSON from {name} response",
+                "raw_response": content
+            }
+    
+    return {
+        "source": source,
+        "data": pricing_data,
+        "confidence": SOURCE_CONFIDENCE[source]
+    }
+
+def collect_claude_stream(prompt):
+    """Run a blocking streamed Claude request and return the concatenated text"""
+    stream = anthropic_client.messages.create(
+        model=CLAUDE_MODEL,
+        max_tokens=2000,
+        temperature=0.0,
+        system=CLAUDE_SYSTEM_PROMPT,
+        messages=[
+            {"role": "user", "content": prompt}
+        ],
+        stream=True,
+        extra_headers={
+            "output-128k-2025-02-19": "true"  # Include beta header for 128k output
+        }
+    )
+    
+    # Collect streamed content
+    parts = []
+    for event in stream:
+        if event.type == "content_block_delta":
+            parts.append(event.delta.text)
+    return "".join(parts)
+
 async def get_claude_pricing(product_info):
     """Get pricing analysis from Claude using streaming"""
     prompt = create_llm_prompt(product_info)
     
     try:
-        # Call Claude API with streaming
-        stream = anthropic_client.messages.create(
-            model="claude-3-7-sonnet-20250219",
-            max_tokens=2000,
-            temperature=0.0,
-            system="You are a luxury goods pricing expert with extensive knowledge of the resale market. Provide accurate price recommendations and sale time estimates based on current market data.",
-            messages=[
-                {"role": "user", "content": prompt}
-            ],
-            stream=True,
-            extra_headers={
-                "output-128k-2025-02-19": "true"  # Include beta header for 128k output
-            }
-        )
+        # The Anthropic client is synchronous: run it off the event loop so the
+        # other providers' requests go out (and come back) in the meantime
+        content = await asyncio.to_thread(collect_claude_stream, prompt)
         
-        # Collect streamed content
-        content = ""
-        for event in stream:
-            if event.type == "content_block_delta":
-                content += event.delta.text
-            elif event.type == "message_start":
-                logger.info("Claude streaming started")
-            elif event.type == "message_delta":
-                logger.info("Claude streaming delta received")
-        
-        # Try to extract JSON from the response
-        try:
-            pricing_data = json.loads(content)
-        except json.JSONDecodeError:
-            json_match = re.search(r'```json\s*([\s\S]*?)\s*```', content)
-            if json_match:
-                try:
-                    pricing_data = json.loads(json_match.group(1))
-                except:
-                    return {
-                        "error": "Could not parse JSON from Claude response",
-                        "raw_response": content
-                    }
-            else:
-                return {
-                    "error": "Could not extract JSON from Claude response",
-                    "raw_response": content
-                }
-        
-        return {
-            "source": "claude",
-            "data": pricing_data,
-            "confidence": 0.9
-        }
+        return parse_pricing_response("claude", content)
         
     except Exception as e:
         logger.error(f"Error getting pricing from Claude: {e}")
@@ -177,30 +195,7 @@ async def get_gemini_pricing(product_info):
         
         content = response.text
         
-        # Try to extract JSON from the response
-        try:
-            pricing_data = json.loads(content)
-        except json.JSONDecodeError:
-            json_match = re.search(r'```json\s*([\s\S]*?)\s*```', content)
-            if json_match:
-                try:
-                    pricing_data = json.loads(json_match.group(1))
-                except:
-                    return {
-                        "error": "Could not parse JSON from Gemini response",
-                        "raw_response": content
-                    }
-            else:
-                return {
-                    "error": "Could not extract JSON from Gemini response",
-                    "raw_response": content
-                }
-        
-        return {
-            "source": "gemini",
-            "data": pricing_data,
-            "confidence": 0.8
-        }
+        return parse_pricing_response("gemini", content)
         
     except Exception as e:
         logger.error(f"Error getting pricing from Gemini: {e}")
@@ -212,9 +207,9 @@ async def get_grok_pricing(product_info):
     
     try:
         response = await grok_client.chat.completions.create(
-            model="grok-3-beta",
+            model=GROK_MODEL,
             messages=[
-                {"role": "system", "content": "You are a luxury goods pricing expert with extensive knowledge of the resale market."},
+                {"role": "system", "content": GROK_SYSTEM_PROMPT},
                 {"role": "user", "content": prompt}
             ],
             temperature=0.0,
@@ -223,29 +218,7 @@ async def get_grok_pricing(product_info):
         
         content = response.choices[0].message.content
         
-        try:
-            pricing_data = json.loads(content)
-        except json.JSONDecodeError:
-            json_match = re.search(r'```json\s*([\s\S]*?)\s*```', content)
-            if json_match:
-                try:
-                    pricing_data = json.loads(json_match.group(1))
-                except:
-                    return {
-                        "error": "Could not parse JSON from Grok response",
-                        "raw_response": content
-                    }
-            else:
-                return {
-                    "error": "Could not extract JSON from Grok response",
-                    "raw_response": content
-                }
-        
-        return {
-            "source": "grok",
-            "data": pricing_data,
-            "confidence": 0.85
-        }
+        return parse_pricing_response("grok", content)
         
     except Exception as e:
         logger.error(f"Error getting pricing from Grok: {e}")
@@ -0,0 +1,119 @@
+# logging_setup.py
+"""Non-blocking, structured logging for the request hot path
+
+configure_logging() installs a QueueHandler on the root logger. A
+QueueListener thread does the formatting and writing, so a request thread
+only pays for building a record and putting it on a queue. Records whose
+arguments are plain values (str, numbers) are formatted on the listener
+thread. Anything else is formatted before the hand-off, so later changes
+to a dict or list cannot alter a log line after the fact.
+
+Output is one JSON object per line (LOG_FORMAT=json, the default) carrying
+any `extra=` fields, or the classic text format with LOG_FORMAT=text.
+
+Large payloads (raw LLM results) go through log_payload(). Only a
+LOG_PAYLOAD_SAMPLE_RATE fraction of calls write them, and each is cut to
+a bounded repr of about LOG_PAYLOAD_MAX_CHARS characters. The cost is
+bounded by those limits, not by the size of the payload.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import reprlib
+import sys
+import threading
+
+PLAIN_TYPES = (str, int, float, bool, type(None))
+
+# Attributes every LogRecord has; anything else came from `extra=`
+STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+listener = None
+configure_lock = threading.Lock()
+
+def get_payload_settings():
+    return {
+        "sample_rate": float(os.environ.get("LOG_PAYLOAD_SAMPLE_RATE", "0.01")),
+        "max_chars": int(os.environ.get("LOG_PAYLOAD_MAX_CHARS", "500"))
+    }
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record, including `extra=` fields"""
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in STANDARD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Queue records without formatting them when that is safe to defer"""
+
+    def prepare(self, record):
+        args = record.args or ()
+        if record.exc_info or not isinstance(args, tuple) or not all(isinstance(arg, PLAIN_TYPES) for arg in args):
+            return super().prepare(record)
+        return record
+
+def configure_logging(level=None, stream=None):
+    """Route all logging through a background listener writing to `stream` (stderr); safe to call more than once"""
+    global listener
+    with configure_lock:
+        if listener is not None:
+            return
+        handler = logging.StreamHandler(stream or sys.stderr)
+        if os.environ.get("LOG_FORMAT", "json").lower() == "text":
+            handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+        else:
+            handler.setFormatter(JSONFormatter())
+        log_queue = queue.SimpleQueue()
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(DeferredQueueHandler(log_queue))
+        root.setLevel(level or os.environ.get("LOG_LEVEL", "INFO").upper())
+        listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+        listener.start()
+        atexit.register(stop_logging)
+
+def stop_logging():
+    """Flush queued records and stop the listener thread"""
+    global listener
+    with configure_lock:
+        if listener is not None:
+            listener.stop()
+            listener = None
+
+payload_repr = reprlib.Repr()
+payload_repr.maxlevel = 4
+payload_repr.maxdict = 8
+payload_repr.maxlist = 6
+payload_repr.maxstring = 80
+payload_repr.maxother = 80
+
+def short(value, max_chars=None):
+    """A bounded repr of `value`, cut to max_chars characters"""
+    text = payload_repr.repr(value)
+    max_chars = max_chars or get_payload_settings()["max_chars"]
+    return text if len(text) <= max_chars else text[:max_chars] + "..."
+
+def log_payload(logger, label, payload, level=logging.INFO, **fields):
+    """Log a sampled, truncated view of a large payload with structured `fields`"""
+    if not logger.isEnabledFor(level):
+        return
+    settings = get_payload_settings()
+    if random.random() >= settings["sample_rate"]:
+        return
+    logger.log(level, "%s: %s", label, short(payload, settings["max_chars"]), extra=fields)
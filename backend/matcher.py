@@ -0,0 +1,266 @@
+# matcher.py
+import re
+import heapq
+import threading
+import unicodedata
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Common reseller shorthands mapped to a canonical brand name
+BRAND_ALIASES = {
+    "lv": "louis vuitton",
+    "louis": "louis vuitton",
+    "vuitton": "louis vuitton",
+    "ysl": "saint laurent",
+    "yves saint laurent": "saint laurent",
+    "saint laurent paris": "saint laurent",
+    "slp": "saint laurent",
+    "hermes paris": "hermes",
+    "bv": "bottega veneta",
+    "bottega": "bottega veneta",
+    "cdg": "comme des garcons",
+    "d&g": "dolce gabbana",
+    "dg": "dolce gabbana",
+    "dolce and gabbana": "dolce gabbana",
+    "dolce & gabbana": "dolce gabbana",
+    "mk": "michael kors",
+    "mcm worldwide": "mcm",
+    "vca": "van cleef arpels",
+    "van cleef": "van cleef arpels",
+    "van cleef & arpels": "van cleef arpels",
+    "van cleef and arpels": "van cleef arpels",
+    "ap": "audemars piguet",
+    "pp": "patek philippe",
+    "patek": "patek philippe",
+    "tag": "tag heuer",
+    "tag-heuer": "tag heuer",
+    "rolex sa": "rolex",
+    "goyard paris": "goyard",
+    "christian dior": "dior",
+    "cd": "dior",
+    "celine paris": "celine",
+    "givenchy paris": "givenchy",
+    "alexander mcqueen": "mcqueen",
+}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Words that do not tell two versions of a model apart ("Neverfull MM
+# Monogram" is the standard Neverfull MM); ignored by the similarity index
+NEUTRAL_WORDS = {
+    "bag", "handbag", "purse", "authentic", "genuine", "original",
+    "monogram", "the", "and", "with", "in", "of",
+}
+
+# Highest score a pair may get while either side has a word the other lacks.
+# A variant word ("Empreinte", "Jumbo", "GM") marks a different product, so
+# such pairs stay below any sensible FUZZY_MATCH_THRESHOLD.
+VARIANT_SCORE_CAP = 0.7
+
+
+def normalize_text(text):
+    """Lowercase, strip accents (Hermès -> hermes) and collapse punctuation"""
+    text = unicodedata.normalize("NFKD", str(text or ""))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(_TOKEN_RE.findall(text.lower()))
+
+
+def normalize_brand(brand):
+    """Resolve a brand string to its canonical name via the alias table"""
+    raw = str(brand or "").strip().lower()
+    if raw in BRAND_ALIASES:
+        return BRAND_ALIASES[raw]
+    normalized = normalize_text(brand)
+    return BRAND_ALIASES.get(normalized, normalized)
+
+
+# Every word that can spell a canonical brand, e.g. "louis vuitton" -> {louis, vuitton, lv}
+_BRAND_WORDS = {}
+for _alias, _canonical in BRAND_ALIASES.items():
+    _BRAND_WORDS.setdefault(_canonical, set(_canonical.split())).update(normalize_text(_alias).split())
+
+
+def model_tokens(product_info):
+    """Normalized model tokens with any repeated brand words removed"""
+    brand = normalize_brand(product_info.get('brand', ''))
+    tokens = normalize_text(product_info.get('model', '')).split()
+    # "Louis Vuitton Neverfull MM" typed into the model field -> "neverfull mm"
+    brand_words = _BRAND_WORDS.get(brand) or set(brand.split())
+    return [t for t in tokens if t not in brand_words] or tokens
+
+
+def canonical_product_key(product_info):
+    """Spelling-insensitive identity of a product, including condition and details
+
+    "LV | Neverfull MM | Excellent" and "Louis Vuitton | neverfull mm | excellent"
+    share a key; a different condition or additional details do not.
+    """
+    return "|".join([
+        normalize_brand(product_info.get('brand', '')),
+        " ".join(model_tokens(product_info)),
+        normalize_text(product_info.get('condition', '')),
+        normalize_text(product_info.get('additional_details', '')),
+    ])
+
+
+def trigrams(text):
+    padded = f" {text} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def _misspelled_pairs(left, right):
+    """Count leftover long tokens that are near-spellings of each other ("neverful"/"neverfull")"""
+    pairs = 0
+    right = [t for t in right if len(t) >= 5]
+    for token in left:
+        if len(token) < 5:
+            continue
+        grams = trigrams(token)
+        for other in right:
+            other_grams = trigrams(other)
+            if 2 * len(grams & other_grams) / (len(grams) + len(other_grams)) >= 0.7:
+                right.remove(other)
+                pairs += 1
+                break
+    return pairs
+
+
+def similarity(query_tokens, query_grams, entry_tokens, entry_grams):
+    """Blend of token-set overlap and character trigram dice, in [0, 1]
+
+    Token overlap dominates, and a word on only one side (other than a
+    misspelling of a word on the other) caps the score at VARIANT_SCORE_CAP,
+    so size, material or variant words ("MM" vs "GM", "Jumbo", "Empreinte")
+    keep otherwise similar strings apart; trigrams soften small spelling
+    differences.
+    """
+    if not query_tokens or not entry_tokens:
+        return 0.0
+    gram_score = 2 * len(query_grams & entry_grams) / (len(query_grams) + len(entry_grams))
+    common = len(query_tokens & entry_tokens)
+    misspelled = 0
+    if gram_score >= 0.6 and common < len(query_tokens) and common < len(entry_tokens):
+        # Character-level near match: let misspelled words count as shared
+        misspelled = _misspelled_pairs(query_tokens - entry_tokens, entry_tokens - query_tokens)
+        common += misspelled
+    containment = common / min(len(query_tokens), len(entry_tokens))
+    jaccard = common / (len(query_tokens | entry_tokens) - misspelled)
+    token_score = (containment + 3 * jaccard) / 4
+    score = 0.75 * token_score + 0.25 * gram_score
+    if common < max(len(query_tokens), len(entry_tokens)):
+        score = min(score, VARIANT_SCORE_CAP)
+    return score
+
+
+class ProductIndex:
+    """In-process similarity index over cached products
+
+    Entries are bucketed by canonical brand, and inside a bucket every model
+    token and trigram has a postings set. A lookup narrows to the entries
+    sharing the most query features (rarest postings first) and scores at
+    most `max_candidates` of them, which keeps lookups well under a
+    millisecond even with 100k entries.
+    """
+
+    def __init__(self, max_candidates=150):
+        self.max_candidates = max_candidates
+        self._entries = {}   # cache_key -> (brand, tokens, grams)
+        self._tokens = {}    # brand -> token -> set(cache_key)
+        self._grams = {}     # brand -> trigram -> set(cache_key)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, cache_key):
+        return cache_key in self._entries
+
+    @staticmethod
+    def _features(product_info):
+        brand = normalize_brand(product_info.get('brand', ''))
+        tokens = model_tokens(product_info)
+        tokens = [t for t in tokens if t not in NEUTRAL_WORDS] or tokens
+        return brand, frozenset(tokens), trigrams(" ".join(tokens))
+
+    def add(self, cache_key, product_info):
+        brand, tokens, grams = self._features(product_info)
+        if not tokens:
+            return
+        with self._lock:
+            if cache_key in self._entries:
+                self._remove(cache_key)
+            self._entries[cache_key] = (brand, tokens, grams)
+            token_postings = self._tokens.setdefault(brand, {})
+            for token in tokens:
+                token_postings.setdefault(token, set()).add(cache_key)
+            gram_postings = self._grams.setdefault(brand, {})
+            for gram in grams:
+                gram_postings.setdefault(gram, set()).add(cache_key)
+
+    def remove(self, cache_key):
+        with self._lock:
+            self._remove(cache_key)
+
+    def _remove(self, cache_key):
+        entry = self._entries.pop(cache_key, None)
+        if entry is None:
+            return
+        brand, tokens, grams = entry
+        for postings, features in ((self._tokens[brand], tokens), (self._grams[brand], grams)):
+            for feature in features:
+                keys = postings.get(feature)
+                if keys is not None:
+                    keys.discard(cache_key)
+                    if not keys:
+                        del postings[feature]
+
+    def _candidates(self, postings, features, size):
+        """Up to `max_candidates` keys sharing the most features, closest in token count first
+
+        Postings are intersected rarest first while that leaves any key, so
+        the entries sharing the most query features come first. If even
+        those are too many, the ones whose token count is closest to `size`
+        (the query's) are kept rather than an arbitrary subset.
+        """
+        lists = sorted((postings[f] for f in features if f in postings), key=len)
+        if not lists:
+            return set()
+        narrowed = lists[0]
+        for keys in lists[1:]:
+            both = narrowed & keys
+            if both:
+                narrowed = both
+        if len(narrowed) > self.max_candidates:
+            return set(heapq.nsmallest(
+                self.max_candidates, narrowed, key=lambda key: abs(len(self._entries[key][1]) - size)
+            ))
+        candidates = set(narrowed)
+        for keys in lists:
+            if len(candidates) >= self.max_candidates:
+                break
+            for key in keys:
+                candidates.add(key)
+                if len(candidates) >= self.max_candidates:
+                    break
+        return candidates
+
+    def match(self, product_info, threshold):
+        """Return (cache_key, score) of the best entry scoring >= threshold, or None"""
+        brand, tokens, grams = self._features(product_info)
+        if not tokens:
+            return None
+        with self._lock:
+            candidates = self._candidates(self._tokens.get(brand, {}), tokens, len(tokens))
+            if not candidates:
+                # No shared word at all: fall back to trigram postings for typos
+                candidates = self._candidates(self._grams.get(brand, {}), grams, len(tokens))
+            best_key, best_score = None, 0.0
+            for key in candidates:
+                _, entry_tokens, entry_grams = self._entries[key]
+                score = similarity(tokens, grams, entry_tokens, entry_grams)
+                if score > best_score:
+                    best_key, best_score = key, score
+        if best_key is not None and best_score >= threshold:
+            return best_key, round(best_score, 3)
+        return None
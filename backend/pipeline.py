@@ -0,0 +1,537 @@
+# pipeline.py
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+import statistics
+from collections import Counter, OrderedDict, deque
+from datetime import datetime
+
+from .llm_clients import SOURCE_NAMES, create_llm_prompt, get_claude_pricing, get_gemini_pricing, get_grok_pricing
+from .aggregator import aggregate_results, calculate_variation
+from .cache import get_cached_entry, store_result, schedule_refresh
+from .codec import PRICE_FIELDS
+from .dispatch import BULK, INTERACTIVE, provider_slot
+from .logging_setup import log_payload
+from .matcher import canonical_product_key
+from .quotas import estimate_tokens, record_usage
+
+logger = logging.getLogger(__name__)
+
+# Adaptive ensemble counters for this worker
+ensemble_counts = Counter()
+ensemble_lock = threading.Lock()
+
+def product_from_row(row):
+    """Build a product dict from a bulk/catalog CSV row"""
+    return {
+        "brand": row["brand"],
+        "model": row["model"],
+        "condition": row["condition"],
+        "additional_details": row.get("additional_details", "")
+    }
+
+# Pricing columns appended to every bulk/catalog output row
+RESULT_FIELDS = [
+    "buy_price_min", "buy_price_max",
+    "max_profit_price_min", "max_profit_price_max",
+    "quick_sale_price_min", "quick_sale_price_max",
+    "expected_sale_price_min", "expected_sale_price_max",
+    "time_to_sell_min", "time_to_sell_max", "time_to_sell_unit",
+    "error"
+]
+
+def row_with_results(original_row, product_result):
+    """Copy of a CSV row with the pricing columns filled in from a product result"""
+    row = original_row.copy()
+    if "error" in product_result:
+        for field in RESULT_FIELDS:
+            row[field] = ""
+        row["error"] = product_result["error"]
+    else:
+        result = product_result["results"]
+        row["buy_price_min"] = result["buy_price"]["min"]
+        row["buy_price_max"] = result["buy_price"]["max"]
+        row["max_profit_price_min"] = result["max_profit_price"]["min"]
+        row["max_profit_price_max"] = result["max_profit_price"]["max"]
+        row["quick_sale_price_min"] = result["quick_sale_price"]["min"]
+        row["quick_sale_price_max"] = result["quick_sale_price"]["max"]
+        row["expected_sale_price_min"] = result["expected_sale_price"]["min"]
+        row["expected_sale_price_max"] = result["expected_sale_price"]["max"]
+        row["time_to_sell_min"] = result["estimated_time_to_sell"]["min"]
+        row["time_to_sell_max"] = result["estimated_time_to_sell"]["max"]
+        row["time_to_sell_unit"] = result["estimated_time_to_sell"]["unit"]
+        row["error"] = ""
+    return row
+
+def chunked(iterable, size):
+    """Yield lists of up to `size` items without materializing the iterable"""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+async def get_all_llm_pricing(product_info, use_sources, priority=INTERACTIVE, user_id=None, cost=1):
+    """Query the requested providers concurrently once a `priority` dispatch slot is free
+
+    Calls made for `user_id` are fair-queued against that user's share and
+    their estimated tokens are counted towards the user's daily quota.
+    """
+    tasks = []
+    if "claude" in use_sources or not use_sources:
+        tasks.append(get_claude_pricing(product_info))
+    if "gemini" in use_sources:
+        tasks.append(get_gemini_pricing(product_info))
+    if "grok" in use_sources:
+        tasks.append(get_grok_pricing(product_info))
+    async with provider_slot(priority, user_id, cost):
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+    valid_results = []
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(f"LLM error: {result}")
+        else:
+            valid_results.append(result)
+    if user_id is not None:
+        record_usage(user_id, tokens=estimate_tokens(create_llm_prompt(product_info), valid_results))
+    return valid_results
+
+def get_ensemble_settings():
+    return {
+        "adaptive": os.environ.get("ADAPTIVE_ENSEMBLE", "True").lower() == "true",
+        "primary": os.environ.get("PRIMARY_MODEL", "claude"),
+        "high_value": float(os.environ.get("HIGH_VALUE_THRESHOLD", "5000")),
+        "second_opinion_rate": float(os.environ.get("SECOND_OPINION_RATE", "0.1")),
+        "escalation_cv": float(os.environ.get("ESCALATION_CV", "0.25"))
+    }
+
+def result_items(result):
+    """The pricing dicts in one provider result (a list for combined batch prompts)"""
+    data = result["data"]
+    return data if isinstance(data, list) else [data]
+
+def expected_value(result, items=1):
+    """Highest expected sale price in a provider result, or None if it is malformed
+
+    A result that does not hold exactly `items` pricing dicts counts as
+    malformed, since its rows cannot be matched back to the products.
+    """
+    try:
+        if len(result_items(result)) != items:
+            return None
+        return max(float(item["expected_sale_price"]["max"]) for item in result_items(result))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def max_variation(results):
+    """Largest price CV between providers across every item, or None if they cannot be compared"""
+    try:
+        per_item = zip(*(result_items(r) for r in results))
+        return max(
+            max(cv["min_cv"], cv["max_cv"])
+            for items in per_item
+            for field, cv in calculate_variation([{"data": item} for item in items]).items()
+            if field in PRICE_FIELDS
+        )
+    except (KeyError, TypeError, ValueError, ZeroDivisionError, statistics.StatisticsError):
+        return None
+
+def aggregate_batch_item(llm_results, position):
+    """Aggregate the `position`-th item of list-shaped (combined batch prompt) provider results"""
+    try:
+        return aggregate_results([dict(result, data=result["data"][position]) for result in llm_results])
+    except (KeyError, IndexError, TypeError, ValueError, ZeroDivisionError) as e:
+        return {"error": f"Malformed result for item {position + 1}: {e!r}"}
+
+async def get_ensemble_pricing(product_info, use_sources, priority=INTERACTIVE, user_id=None, cost=1, items=1,
+                               calls=None):
+    """Price with the primary model first and escalate to the rest of the ensemble only when needed
+
+    The remaining providers are queried when the primary's answer is
+    missing, malformed or holds the wrong number of items, when it prices the item at HIGH_VALUE_THRESHOLD or
+    more, or when a sampled second opinion (SECOND_OPINION_RATE of items)
+    disagrees with it by a price CV of ESCALATION_CV or more.
+
+    `items` is the number of products in the prompt (for a combined batch
+    prompt) and `calls`, if given, is a dict counting the providers queried.
+    """
+    settings = get_ensemble_settings()
+    sources = [source for source in SOURCE_NAMES if source in use_sources] if use_sources else ["claude"]
+    queried = []
+
+    async def query(batch):
+        queried.extend(batch)
+        return await get_all_llm_pricing(product_info, batch, priority, user_id, cost)
+
+    reason = None
+    if not settings["adaptive"] or len(sources) < 2:
+        results = await query(sources)
+    else:
+        primary = settings["primary"] if settings["primary"] in sources else sources[0]
+        remaining = [source for source in sources if source != primary]
+        results = await query([primary])
+        valid = [r for r in results if "error" not in r]
+        value = expected_value(valid[0], items) if valid else None
+
+        if value is None:
+            reason = "primary_failed"
+        elif value >= settings["high_value"]:
+            reason = "high_value"
+        elif random.random() < settings["second_opinion_rate"]:
+            second = await query(remaining[:1])
+            results += second
+            remaining = remaining[1:]
+            second_valid = [r for r in second if "error" not in r]
+            if second_valid:
+                variation = max_variation(valid + second_valid)
+                if variation is None or variation >= settings["escalation_cv"]:
+                    reason = "disagreement"
+
+        if reason and remaining:
+            results += await query(remaining)
+            logger.info("Escalated to the full ensemble (%s) after %s", reason, primary)
+
+    if calls is not None:
+        for source in queried:
+            calls[source] = calls.get(source, 0) + 1
+    count_ensemble_call(len(queried), reason, items)
+    return results
+
+def count_ensemble_call(calls, reason, items=1):
+    with ensemble_lock:
+        ensemble_counts["items"] += items
+        ensemble_counts["provider_calls"] += calls
+        if reason:
+            ensemble_counts[f"escalated_{reason}"] += 1
+
+def ensemble_stats():
+    """Provider calls per priced item and escalations by reason, since this worker started"""
+    with ensemble_lock:
+        stats = dict(ensemble_counts)
+    items = stats.get("items", 0)
+    stats["calls_per_item"] = round(stats.get("provider_calls", 0) / items, 2) if items else None
+    return stats
+
+PROVIDER_CALLS = {"claude": get_claude_pricing, "gemini": get_gemini_pricing, "grok": get_grok_pricing}
+
+async def stream_llm_pricing(product_info, use_sources, priority=INTERACTIVE):
+    """Query every requested provider at once, yielding an updated consensus as each one answers
+
+    Yields ("partial", payload) after every provider result and a final
+    ("final", payload) once all have answered, where payload holds the
+    aggregate so far, the provider that just arrived and calculate_variation
+    across the valid results. The final consensus is stored in the cache.
+    """
+    sources = [source for source in SOURCE_NAMES if source in use_sources] if use_sources else ["claude"]
+    results = []
+    async with provider_slot(priority):
+        pending = [asyncio.ensure_future(PROVIDER_CALLS[source](product_info)) for source in sources]
+        try:
+            for next_result in asyncio.as_completed(pending):
+                try:
+                    result = await next_result
+                except Exception as e:
+                    logger.error(f"LLM error: {e}")
+                    continue
+                results.append(result)
+                valid = [r for r in results if "error" not in r]
+                payload = {
+                    "provider": result.get("source"),
+                    "provider_error": result.get("error"),
+                    "received": len(results),
+                    "expected": len(sources),
+                    "models_used": [r["source"] for r in valid]
+                }
+                if valid:
+                    try:
+                        payload["results"] = aggregate_results(valid)
+                        payload["variation"] = calculate_variation(valid) if len(valid) > 1 else {}
+                    except Exception as e:
+                        logger.error(f"Error aggregating streamed LLM results: {e}")
+                        yield "error", {"error": "Failed to aggregate LLM results", "details": str(e),
+                                        "received": len(results), "expected": len(sources)}
+                        return
+                if len(results) < len(sources):
+                    yield "partial", payload
+        finally:
+            for task in pending:
+                task.cancel()
+
+    valid = [r for r in results if "error" not in r]
+    if not valid:
+        yield "error", {"error": "No results from any LLM", "received": len(results), "expected": len(sources)}
+        return
+    try:
+        final_results = aggregate_results(valid)
+        variation = calculate_variation(valid) if len(valid) > 1 else {}
+    except Exception as e:
+        logger.error(f"Error aggregating streamed LLM results: {e}")
+        yield "error", {"error": "Failed to aggregate LLM results", "details": str(e),
+                        "received": len(results), "expected": len(sources)}
+        return
+    if "meta" not in final_results:
+        final_results["meta"] = {}
+    final_results["meta"]["timestamp"] = datetime.now().isoformat()
+    final_results["meta"]["models_used"] = [r["source"] for r in valid]
+    stored_at = store_result(product_info, final_results)
+    yield "final", {
+        "results": final_results,
+        "source": "llm",
+        "llm_count": len(results),
+        "variation": variation,
+        "stored_at": stored_at
+    }
+
+def dedupe_products(products):
+    """Group bulk rows that describe the same product
+
+    Returns the list of unique products (first occurrence wins) and, for
+    every input row, the index of its unique product, so results can be
+    fanned back out in the original row order.
+    """
+    unique_products = []
+    row_index = []
+    seen = {}
+    for product in products:
+        key = canonical_product_key(product)
+        if key not in seen:
+            seen[key] = len(unique_products)
+            unique_products.append(product)
+        row_index.append(seen[key])
+    return unique_products, row_index
+
+async def process_product_batch(products, use_sources, priority=BULK, user_id=None):
+    """Process a batch of products by combining them into a single LLM request
+
+    Stale cache hits are re-priced in the same request rather than queued
+    for a background refresh each, so a large upload cannot flood the
+    refresh pool with calls outside its batch throttle. The stale entry is
+    still served for a row the LLMs fail to price.
+    """
+    if not products:
+        return []
+    
+    # Resolve invalid and fresh cached products individually; only the rest go to the LLMs
+    batch_results = [None] * len(products)
+    pending = []
+    stale = {}
+    for idx, product in enumerate(products):
+        if not product["brand"] or not product["model"]:
+            batch_results[idx] = {"product": product, "error": "Brand and model are required"}
+            continue
+        
+        cached = get_cached_entry(product)
+        if cached:
+            match = {"key": cached["key"], "score": cached["score"]}
+            batch_results[idx] = {"product": product, "results": cached["results"], "source": "cache", "stale": cached["stale"], "match": match}
+            if not cached["stale"]:
+                continue
+            stale[idx] = batch_results[idx]
+        
+        pending.append(idx)
+    
+    if not pending:
+        return batch_results
+    
+    # Combine prompts for all uncached products in the batch
+    combined_prompt = ""
+    for item_number, idx in enumerate(pending):
+        product = products[idx]
+        condition = product.get('condition', 'excellent')
+        brand = product.get('brand', '')
+        model = product.get('model', '')
+        details = product.get('additional_details', '')
+        prompt = f"""
+        Item {item_number + 1}:
+        Brand: {brand}
+        Model: {model}
+        Condition: {condition}
+        Additional Details: {details}
+        """
+        combined_prompt += prompt + "\n"
+    
+    combined_prompt += """
+    For each item listed above, provide a market price analysis with the following details:
+    1. A price range to buy the item at (for resale)
+    2. An initial listing price to maximize profit
+    3. A price to list at for a quick sale
+    4. The most likely final sale price
+    5. The estimated time to sell (in days or weeks)
+    Include explanations for each price range and time to sell, considering factors like rarity, collectible status, or market trends. Format the response as a JSON array where each element corresponds to an item in the order listed, with the structure:
+    [
+      {
+        "buy_price": {"min": value, "max": value, "explanation": "reason"},
+        "max_profit_price": {"min": value, "max": value, "explanation": "reason"},
+        "quick_sale_price": {"min": value, "max": value, "explanation": "reason"},
+        "expected_sale_price": {"min": value, "max": value, "explanation": "reason"},
+        "estimated_time_to_sell": {"min": value, "max": value, "unit": "days OR weeks", "explanation": "factors"},
+        "factors": ["factor1", "factor2"],
+        "market_analysis": "brief analysis"
+      },
+      ...
+    ]
+    """
+    
+    # Query LLMs with the combined prompt
+    llm_results = await get_ensemble_pricing(
+        {"combined_prompt": combined_prompt}, use_sources, priority, user_id=user_id, cost=len(pending),
+        items=len(pending)
+    )
+    logger.info("LLM batch priced", extra={
+        "items": len(pending),
+        "sources": [r.get("source") for r in llm_results],
+        "errors": sum(1 for r in llm_results if "error" in r)
+    })
+    log_payload(logger, "LLM results for batch", llm_results)
+    
+    def fail(error):
+        for idx in pending:
+            batch_results[idx] = stale.get(idx) or {"product": products[idx], "error": error}
+        return batch_results
+    
+    if not llm_results:
+        return fail("No LLM results")
+    
+    valid_results = [r for r in llm_results if "error" not in r]
+    if not valid_results:
+        return fail("Failed to aggregate LLM results: " + aggregate_results(llm_results)["error"])
+    
+    # Only providers that answered with one entry per uncached product can be aggregated
+    usable_results = [r for r in valid_results if isinstance(r["data"], list) and len(r["data"]) == len(pending)]
+    if len(usable_results) < len(valid_results):
+        logger.warning(f"Ignoring {len(valid_results) - len(usable_results)} LLM results not shaped as a {len(pending)}-item list")
+    if not usable_results:
+        return fail("Unexpected LLM response format")
+    
+    # Aggregate each item across providers, then store results in cache and return
+    for position, idx in enumerate(pending):
+        result = aggregate_batch_item(usable_results, position)
+        if "error" in result:
+            batch_results[idx] = stale.get(idx) or {"product": products[idx], "error": "Failed to aggregate LLM results: " + result["error"]}
+            continue
+        store_result(products[idx], result)
+        batch_results[idx] = {"product": products[idx], "results": result, "source": "llm"}
+    
+    return batch_results
+
+async def process_product(product, use_sources, priority=BULK):
+    """Process a single product (fallback for non-batched processing)"""
+    if not product["brand"] or not product["model"]:
+        return {"product": product, "error": "Brand and model are required"}
+    
+    cached = get_cached_entry(product)
+    if cached:
+        refresh_if_stale(cached, use_sources)
+        match = {"key": cached["key"], "score": cached["score"]}
+        return {"product": product, "results": cached["results"], "source": "cache", "stale": cached["stale"], "match": match}
+    
+    llm_results = await get_ensemble_pricing(product, use_sources, priority)
+    log_payload(logger, "LLM results", llm_results, brand=product['brand'], model=product['model'])
+    if llm_results:
+        final_results = aggregate_results(llm_results)
+        if "error" in final_results:
+            return {"product": product, "error": "Failed to aggregate LLM results: " + final_results["error"]}
+        store_result(product, final_results)
+        return {"product": product, "results": final_results, "source": "llm"}
+    else:
+        return {"product": product, "error": "No LLM results"}
+
+async def refresh_product(product, use_sources, priority=BULK, calls=None):
+    """Re-price a product from the LLMs and overwrite its cache entry, counting providers queried in `calls`"""
+    llm_results = await get_ensemble_pricing(product, use_sources, priority, calls=calls)
+    if not llm_results:
+        raise RuntimeError("No LLM results")
+    final_results = aggregate_results(llm_results)
+    if "error" in final_results:
+        raise RuntimeError("Failed to aggregate LLM results: " + final_results["error"])
+    if "meta" not in final_results:
+        final_results["meta"] = {}
+    final_results["meta"]["timestamp"] = datetime.now().isoformat()
+    final_results["meta"]["models_used"] = [r["source"] for r in llm_results if "error" not in r]
+    store_result(product, final_results)
+    return final_results
+
+def refresh_if_stale(cached, use_sources):
+    """Serve-stale-while-revalidate: queue a background re-price of a stale cache entry"""
+    if not cached.get("stale"):
+        return
+    product = dict(cached["product_info"])
+    schedule_refresh(cached["key"], lambda: asyncio.run(refresh_product(product, use_sources)))
+
+async def stream_bulk_results(rows, use_sources, batch_size=10, max_in_flight=2, batch_interval=12, recent_size=10000,
+                              throttle=None, priority=BULK, user_id=None):
+    """Price an iterable of (row, product) pairs, yielding (row, product_result) in input order
+
+    At most `max_in_flight` batches of `batch_size` rows are read ahead and
+    priced concurrently, and batches that need the LLMs are launched at least
+    `batch_interval` seconds apart. Repeated products reuse the result from a
+    bounded LRU of the `recent_size` most recent unique products, or wait
+    for a batch that is already pricing them (anything older is still served
+    by the pricing cache). Memory therefore stays flat however long the
+    input is.
+    
+    `throttle`, if given, is awaited before each such launch instead of the
+    fixed interval (e.g. a rate budget shared between processes). Provider
+    calls are dispatched at `priority`, in `user_id`'s fair share.
+    """
+    recent = OrderedDict()
+    pricing = {}  # key -> future of a product being priced by an in-flight batch
+    in_flight = deque()
+    last_launch = None
+    
+    async def price_chunk(chunk, keys, reused, waiting, to_price):
+        priced = {}
+        try:
+            if to_price:
+                batch_results = await process_product_batch(list(to_price.values()), use_sources, priority, user_id)
+                priced = dict(zip(to_price, batch_results))
+        except Exception as e:
+            for key in to_price:
+                pricing.pop(key).set_exception(e)
+            raise
+        for key, product_result in priced.items():
+            pricing.pop(key).set_result(product_result)
+            recent[key] = product_result
+            recent.move_to_end(key)
+            while len(recent) > recent_size:
+                recent.popitem(last=False)
+        for key, future in waiting.items():
+            priced[key] = await future
+        return [
+            (row, dict(priced.get(key) or reused[key], product=product))
+            for key, (row, product) in zip(keys, chunk)
+        ]
+    
+    for chunk in chunked(rows, batch_size):
+        keys = [canonical_product_key(product) for _, product in chunk]
+        reused = {key: recent[key] for key in keys if key in recent}
+        waiting = {key: pricing[key] for key in keys if key not in reused and key in pricing}
+        to_price = {}
+        for key, (_, product) in zip(keys, chunk):
+            if key not in reused and key not in waiting and key not in to_price:
+                to_price[key] = product
+                pricing[key] = asyncio.get_running_loop().create_future()
+        if to_price:
+            # Throttle launches that may reach the LLMs to avoid rate limits
+            if throttle is not None:
+                await throttle()
+            elif last_launch is not None:
+                wait = batch_interval - (time.monotonic() - last_launch)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            last_launch = time.monotonic()
+        in_flight.append(asyncio.ensure_future(price_chunk(chunk, keys, reused, waiting, to_price)))
+        
+        while len(in_flight) >= max_in_flight:
+            for item in await in_flight.popleft():
+                yield item
+    
+    while in_flight:
+        for item in await in_flight.popleft():
+            yield item
@@ -0,0 +1,193 @@
+# quotas.py
+"""Per-user bulk quotas and usage, stored next to the users table
+
+Each user can have a row in user_quotas:
+- weight: their share of bulk dispatch slots under weighted fair queuing
+- max_concurrency: how many provider calls they may have in flight at once
+- daily_rows and daily_tokens: daily limits, where 0 means unlimited
+
+Users without a row get the USER_DEFAULT_* settings. Usage is counted per
+user per UTC day in user_usage. Rows are reserved in blocks before they are
+priced, so parallel jobs of one user cannot overshoot the daily row limit
+by more than a block.
+"""
+import os
+import json
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Rows reserved against the daily quota at a time
+ROW_BLOCK = 100
+
+quota_local = threading.local()
+
+def get_users_db_path():
+    return os.environ.get("USERS_DB_PATH", "/opt/render/project/src/data/users.db")
+
+def get_default_quota():
+    return {
+        "weight": float(os.environ.get("USER_DEFAULT_WEIGHT", "1")),
+        "max_concurrency": int(os.environ.get("USER_DEFAULT_MAX_CONCURRENCY", "2")),
+        "daily_rows": int(os.environ.get("USER_DEFAULT_DAILY_ROWS", "20000")),
+        "daily_tokens": int(os.environ.get("USER_DEFAULT_DAILY_TOKENS", "0"))
+    }
+
+def get_admin_users():
+    return {name.strip() for name in os.environ.get("ADMIN_USERS", "").split(",") if name.strip()}
+
+def today():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+def get_quota_connection():
+    """Per-thread connection to users.db with the quota tables in place"""
+    conn = getattr(quota_local, "conn", None)
+    if conn is None:
+        db_path = get_users_db_path()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(db_path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS user_quotas (
+                user_id INTEGER PRIMARY KEY,
+                weight REAL NOT NULL,
+                max_concurrency INTEGER NOT NULL,
+                daily_rows INTEGER NOT NULL,
+                daily_tokens INTEGER NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS user_usage (
+                user_id INTEGER NOT NULL,
+                day TEXT NOT NULL,
+                rows INTEGER NOT NULL DEFAULT 0,
+                tokens INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, day)
+            )
+        """)
+        quota_local.conn = conn
+    return conn
+
+def get_user_quota(user_id):
+    row = get_quota_connection().execute(
+        "SELECT weight, max_concurrency, daily_rows, daily_tokens FROM user_quotas WHERE user_id = ?", (user_id,)
+    ).fetchone()
+    if row is None:
+        return get_default_quota()
+    return dict(zip(("weight", "max_concurrency", "daily_rows", "daily_tokens"), row))
+
+def set_user_quota(user_id, **changes):
+    quota = get_user_quota(user_id)
+    quota.update({k: v for k, v in changes.items() if k in quota and v is not None})
+    get_quota_connection().execute(
+        "INSERT OR REPLACE INTO user_quotas (user_id, weight, max_concurrency, daily_rows, daily_tokens) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (user_id, float(quota["weight"]), int(quota["max_concurrency"]), int(quota["daily_rows"]), int(quota["daily_tokens"]))
+    )
+    return quota
+
+def get_usage(user_id, day=None):
+    row = get_quota_connection().execute(
+        "SELECT rows, tokens FROM user_usage WHERE user_id = ? AND day = ?", (user_id, day or today())
+    ).fetchone()
+    return {"rows": row[0], "tokens": row[1]} if row else {"rows": 0, "tokens": 0}
+
+def record_usage(user_id, rows=0, tokens=0):
+    if user_id is None:
+        return
+    try:
+        get_quota_connection().execute(
+            "INSERT INTO user_usage (user_id, day, rows, tokens) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (user_id, day) DO UPDATE SET rows = rows + excluded.rows, tokens = tokens + excluded.tokens",
+            (user_id, today(), rows, tokens)
+        )
+    except sqlite3.Error as e:
+        logger.error(f"Error recording usage for user {user_id}: {e}")
+
+def quota_exceeded(user_id):
+    """Name of the daily limit `user_id` has used up, or None"""
+    quota = get_user_quota(user_id)
+    usage = get_usage(user_id)
+    if quota["daily_rows"] and usage["rows"] >= quota["daily_rows"]:
+        return "rows"
+    if quota["daily_tokens"] and usage["tokens"] >= quota["daily_tokens"]:
+        return "tokens"
+    return None
+
+def reserve_rows(user_id, count):
+    """Atomically count up to `count` rows against today's quota; returns how many were granted"""
+    quota = get_user_quota(user_id)
+    conn = get_quota_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT rows, tokens FROM user_usage WHERE user_id = ? AND day = ?", (user_id, today())
+        ).fetchone()
+        used_rows, used_tokens = row or (0, 0)
+        if quota["daily_tokens"] and used_tokens >= quota["daily_tokens"]:
+            granted = 0
+        elif quota["daily_rows"]:
+            granted = max(0, min(count, quota["daily_rows"] - used_rows))
+        else:
+            granted = count
+        if granted:
+            conn.execute(
+                "INSERT INTO user_usage (user_id, day, rows, tokens) VALUES (?, ?, ?, 0) "
+                "ON CONFLICT (user_id, day) DO UPDATE SET rows = rows + excluded.rows",
+                (user_id, today(), granted)
+            )
+        conn.execute("COMMIT")
+        return granted
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+def within_quota(user_id, rows, status):
+    """Yield from `rows` while `user_id` has quota left
+
+    Rows are reserved ROW_BLOCK at a time; unused reservations are handed
+    back when the input ends. Once the quota runs out no further row is
+    read, so the caller can pass the rest through unpriced.
+    `status["quota_exceeded"]` names the limit that stopped the job, if any.
+    """
+    reserved = 0
+    rows = iter(rows)
+    try:
+        while True:
+            if not reserved:
+                reserved = reserve_rows(user_id, ROW_BLOCK)
+                if not reserved:
+                    status["quota_exceeded"] = quota_exceeded(user_id) or "rows"
+                    return
+            row = next(rows, None)
+            if row is None:
+                return
+            reserved -= 1
+            yield row
+    finally:
+        if reserved:
+            record_usage(user_id, rows=-reserved)
+
+def estimate_tokens(prompt, llm_results):
+    """Rough token count (4 characters per token) for one ensemble call"""
+    characters = len(prompt) * len(llm_results)
+    for result in llm_results:
+        characters += len(json.dumps(result.get("data", result.get("raw_response", ""))))
+    return characters // 4
+
+def usage_report(day=None):
+    """Usage and quota of every user on `day` (default today)"""
+    conn = get_quota_connection()
+    day = day or today()
+    report = []
+    for user_id, username in conn.execute("SELECT id, username FROM users ORDER BY username"):
+        report.append({
+            "user_id": user_id,
+            "username": username,
+            "usage": get_usage(user_id, day),
+            "quota": get_user_quota(user_id)
+        })
+    return {"day": day, "users": report}
@@ -0,0 +1,120 @@
+# sharding.py
+"""Process-pool execution mode for large bulk jobs
+
+The parent process only splits the CSV into chunks of rows and writes the
+merged output. Each worker process runs its own asyncio provider loop over a
+chunk (prompting, JSON extraction, aggregation and output row formatting),
+so the CPU-side work spreads over every core. All workers draw from one
+token bucket in shared memory, so the whole pool stays within the same
+provider rate budget as a single worker. Results come back in the original
+row order.
+
+Workers read and write the pricing cache themselves, so sharding needs a
+shared backend (CACHE_BACKEND=sqlite or firebase). With the per-process
+memory backend a worker would neither see entries already cached nor keep
+the ones it prices once the pool exits, so stream_sharded_results refuses
+to run.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from .cache import is_shared_backend
+from .logging_setup import configure_logging
+from .pipeline import chunked, product_from_row, stream_bulk_results
+
+logger = logging.getLogger(__name__)
+
+class SharedRateLimiter:
+    """Token bucket shared by every process in the pool
+
+    Allows `per_minute` acquisitions per minute with bursts of up to `burst`.
+    """
+
+    def __init__(self, per_minute, burst=1, context=None):
+        context = context or multiprocessing.get_context()
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.tokens = context.Value('d', float(burst), lock=False)
+        self.updated = context.Value('d', time.time(), lock=False)
+        self.lock = context.Lock()
+
+    def try_acquire(self):
+        """Take a token if one is available; otherwise return seconds until the next one"""
+        with self.lock:
+            now = time.time()
+            self.tokens.value = min(self.burst, self.tokens.value + (now - self.updated.value) * self.rate)
+            self.updated.value = now
+            if self.tokens.value >= 1:
+                self.tokens.value -= 1
+                return 0
+            return (1 - self.tokens.value) / self.rate
+
+    async def acquire(self):
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+# Set in each worker process by init_worker
+worker_limiter = None
+
+def init_worker(limiter):
+    global worker_limiter
+    worker_limiter = limiter
+    configure_logging()
+
+def price_chunk(rows, use_sources, batch_size, user_id=None):
+    """Worker entry point: price a chunk of CSV rows, returning (row, product_result) pairs in order"""
+    async def run():
+        pairs = ((row, product_from_row(row)) for row in rows)
+        return [item async for item in stream_bulk_results(
+            pairs, use_sources, batch_size=batch_size, throttle=worker_limiter.acquire, user_id=user_id
+        )]
+    return asyncio.run(run())
+
+def get_shard_settings():
+    return {
+        "processes": int(os.environ.get("SHARD_PROCESSES", os.cpu_count() or 1)),
+        "chunk_rows": int(os.environ.get("SHARD_CHUNK_ROWS", "200")),
+        # One batch every 12 seconds, the same budget as the single-worker path
+        "batches_per_minute": float(os.environ.get("SHARD_BATCHES_PER_MINUTE", "5"))
+    }
+
+async def stream_sharded_results(rows, use_sources, processes=None, chunk_rows=None, batch_size=10,
+                                 batches_per_minute=None, user_id=None):
+    """Price CSV rows across a process pool, yielding (row, product_result) in input order
+
+    At most two chunks per process are queued at once, so memory stays
+    bounded by the chunk size rather than the file size. Raises RuntimeError
+    unless the cache backend is shared between processes.
+    """
+    if not is_shared_backend():
+        raise RuntimeError("Sharded pricing needs a shared cache backend (CACHE_BACKEND=sqlite or firebase)")
+    settings = get_shard_settings()
+    processes = processes or settings["processes"]
+    chunk_rows = chunk_rows or settings["chunk_rows"]
+    batches_per_minute = batches_per_minute or settings["batches_per_minute"]
+
+    # Spawn fresh interpreters: forking a server worker would copy its threads and client connections
+    context = multiprocessing.get_context("spawn")
+    limiter = SharedRateLimiter(batches_per_minute, context=context)
+    loop = asyncio.get_running_loop()
+    logger.info(f"Sharding bulk job across {processes} processes, {chunk_rows} rows per chunk")
+
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context,
+                             initializer=init_worker, initargs=(limiter,)) as pool:
+        pending = deque()
+        for chunk in chunked(rows, chunk_rows):
+            pending.append(loop.run_in_executor(pool, price_chunk, chunk, use_sources, batch_size, user_id))
+            while len(pending) >= processes * 2:
+                for item in await pending.popleft():
+                    yield item
+        while pending:
+            for item in await pending.popleft():
+                yield item
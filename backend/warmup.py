@@ -0,0 +1,225 @@
+# warmup.py
+"""Cache warm-up job for a known catalog
+
+Reads a catalog CSV in the bulk upload format (brand,model,condition,
+additional_details) and re-prices every product whose cache entry is
+missing or will go stale within the horizon, most urgent first, within a
+provider call budget and rate.
+
+CLI:
+    python -m backend.warmup catalog.csv --max-calls 300 --rate 10 --off-peak 1-6
+
+Scheduled: set WARMUP_CATALOG_PATH and the app starts a background thread
+that runs the job once a day inside WARMUP_OFF_PEAK_HOURS. A lock file
+keeps multiple gunicorn workers from warming at the same time.
+
+Warm-up needs a shared cache backend (CACHE_BACKEND=sqlite or firebase).
+With the per-process memory backend the CLI would only warm its own
+short-lived process, and the scheduler would only warm whichever worker
+took the lock. The CLI refuses to run and the scheduler does not start in
+that case.
+"""
+import argparse
+import asyncio
+import csv
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from .cache import get_cached_entry, get_cache_key, get_cache_ttls, is_shared_backend
+from .dispatch import WARMUP
+from .logging_setup import configure_logging
+from .pipeline import dedupe_products, product_from_row, refresh_product
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOURCES = ["claude", "gemini", "grok"]
+
+# Rough USD cost of one pricing call per provider, for the warm-up report.
+# Override with WARMUP_COST_CLAUDE, WARMUP_COST_GEMINI, WARMUP_COST_GROK.
+ESTIMATED_CALL_COST = {
+    "claude": 0.03,
+    "gemini": 0.01,
+    "grok": 0.03
+}
+
+def get_call_cost(source):
+    return float(os.environ.get(f"WARMUP_COST_{source.upper()}", ESTIMATED_CALL_COST.get(source, 0)))
+
+def load_catalog(path):
+    """Read a catalog CSV and return its unique products"""
+    with open(path, newline='', encoding='utf-8') as f:
+        products = [product_from_row(row) for row in csv.DictReader(f)]
+    unique_products, _ = dedupe_products(products)
+    return unique_products
+
+def parse_hours(window):
+    """Parse an "H-H" off-peak window such as "1-6" or "22-5" into (start, end)"""
+    start, end = window.split("-")
+    return int(start) % 24, int(end) % 24
+
+def in_window(window, now=None):
+    start, end = window
+    hour = (now or datetime.now()).hour
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+def select_due(products, horizon):
+    """Products whose entry is missing or stale within `horizon` seconds, most urgent first
+
+    Products sharing a cache key (the catalog dedupe also tells condition
+    and details apart, the cache does not) are only refreshed once.
+    """
+    soft_ttl, _ = get_cache_ttls()
+    due = []
+    seen = set()
+    for product in products:
+        key = get_cache_key(product)
+        if key in seen:
+            continue
+        seen.add(key)
+        cached = get_cached_entry(product, decode=False)
+        if cached is None:
+            due.append((float("inf"), product))
+        elif cached["age"] >= soft_ttl - horizon:
+            due.append((cached["age"], product))
+    due.sort(key=lambda item: item[0], reverse=True)
+    return [product for _, product in due]
+
+async def warm_cache(products, use_sources=None, horizon=21600, max_calls=300, rate_per_minute=10, window=None):
+    """Refresh due catalog entries within a provider call budget
+
+    Returns a report with how many keys were refreshed and what it cost.
+    """
+    sources = use_sources or DEFAULT_SOURCES
+    started = time.monotonic()
+    due = select_due(products, horizon)
+    interval = 60.0 / rate_per_minute if rate_per_minute else 0
+    report = {
+        "catalog_products": len(products),
+        "due": len(due),
+        "refreshed": 0,
+        "failed": 0,
+        "provider_calls": {source: 0 for source in sources},
+        "stopped": None
+    }
+
+    for product in due:
+        # Leave room for a full-ensemble escalation so the budget is never overshot
+        if sum(report["provider_calls"].values()) + len(sources) > max_calls:
+            report["stopped"] = "call budget exhausted"
+            break
+        if window and not in_window(window):
+            report["stopped"] = "off-peak window closed"
+            break
+
+        call_started = time.monotonic()
+        try:
+            # Charged with the providers actually queried (usually just the primary model)
+            await refresh_product(product, sources, WARMUP, calls=report["provider_calls"])
+            report["refreshed"] += 1
+        except Exception as e:
+            logger.error(f"Warm-up failed for {product['brand']} {product['model']}: {e}")
+            report["failed"] += 1
+
+        remaining = interval - (time.monotonic() - call_started)
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+
+    report["estimated_cost_usd"] = round(sum(
+        calls * get_call_cost(source) for source, calls in report["provider_calls"].items()
+    ), 4)
+    report["elapsed_seconds"] = round(time.monotonic() - started, 1)
+    logger.info(f"Cache warm-up report: {report}")
+    return report
+
+def get_warmup_settings():
+    return {
+        "horizon": int(os.environ.get("WARMUP_HORIZON", "21600")),  # 6 hours
+        "max_calls": int(os.environ.get("WARMUP_MAX_CALLS", "300")),
+        "rate_per_minute": float(os.environ.get("WARMUP_RATE_PER_MINUTE", "10")),
+        "window": parse_hours(os.environ.get("WARMUP_OFF_PEAK_HOURS", "1-6"))
+    }
+
+def run_scheduled_warmup(catalog_path):
+    """Run one warm-up pass unless another worker holds the lock"""
+    lock_path = os.environ.get("WARMUP_LOCK_PATH", "/tmp/pricing-warmup.lock")
+    with open(lock_path, "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logger.info("Cache warm-up already running in another worker")
+            return None
+        try:
+            return asyncio.run(warm_cache(load_catalog(catalog_path), **get_warmup_settings()))
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def seconds_until(hour, now=None):
+    now = now or datetime.now()
+    target = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return (target - now).total_seconds()
+
+def start_warmup_scheduler():
+    """Start the daily off-peak warm-up thread if WARMUP_CATALOG_PATH is set"""
+    catalog_path = os.environ.get("WARMUP_CATALOG_PATH")
+    if not catalog_path:
+        return None
+    if not is_shared_backend():
+        logger.warning("WARMUP_CATALOG_PATH is set but the cache backend is per-process; "
+                       "set CACHE_BACKEND=sqlite or firebase to enable cache warm-up")
+        return None
+
+    def loop():
+        while True:
+            start_hour, _ = get_warmup_settings()["window"]
+            time.sleep(seconds_until(start_hour))
+            try:
+                run_scheduled_warmup(catalog_path)
+            except Exception as e:
+                logger.error(f"Scheduled cache warm-up failed: {e}")
+
+    thread = threading.Thread(target=loop, name="cache-warmup", daemon=True)
+    thread.start()
+    logger.info(f"Cache warm-up scheduled daily for {catalog_path}")
+    return thread
+
+def main():
+    settings = get_warmup_settings()
+    parser = argparse.ArgumentParser(description="Refresh cache entries for a catalog before they expire.")
+    parser.add_argument("catalog", help="Catalog CSV (brand,model,condition,additional_details)")
+    parser.add_argument("--sources", default=",".join(DEFAULT_SOURCES), help="Comma-separated LLMs to query")
+    parser.add_argument("--horizon", type=int, default=settings["horizon"], help="Refresh entries going stale within this many seconds")
+    parser.add_argument("--max-calls", type=int, default=settings["max_calls"], help="Provider call budget for this run")
+    parser.add_argument("--rate", type=float, default=settings["rate_per_minute"], help="Maximum products refreshed per minute")
+    parser.add_argument("--off-peak", help="Only run inside this local hour window, e.g. 1-6")
+    args = parser.parse_args()
+    if not is_shared_backend():
+        parser.error("the cache backend is per-process, so warming it from here has no effect; "
+                     "set CACHE_BACKEND=sqlite or firebase")
+
+    window = parse_hours(args.off_peak) if args.off_peak else None
+    if window and not in_window(window):
+        print(f"Outside off-peak window {args.off_peak}; nothing to do.")
+        return
+
+    report = asyncio.run(warm_cache(
+        load_catalog(args.catalog),
+        use_sources=[s.strip() for s in args.sources.split(",") if s.strip()],
+        horizon=args.horizon,
+        max_calls=args.max_calls,
+        rate_per_minute=args.rate,
+        window=window
+    ))
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    configure_logging()
+    main()
@@ -0,0 +1,76 @@
+# benchmarks/bench_codec.py
+"""Encode/decode time and size of cache records and API responses
+
+    python benchmarks/bench_codec.py [--records 2000] [--rows 1000]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import codec
+from benchmarks.fixtures import bulk_response, results_set
+
+def timed(fn, items, repeat=3):
+    """Best-of-`repeat` seconds to run fn over items, and the outputs"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = [fn(item) for item in items]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, out
+
+def report(name, encode, decode, items):
+    enc_time, encoded = timed(encode, items)
+    dec_time, decoded = timed(decode, encoded)
+    assert decoded == items, f"{name} did not round-trip"
+    size = sum(len(e) for e in encoded)
+    per = 1e6 / len(items)
+    print(f"  {name:<26} {enc_time * per:8.1f} us {dec_time * per:8.1f} us {size / len(items):9.0f} B")
+    return size, enc_time, dec_time
+
+def compare(stats, baseline):
+    """One line relating a codec's size and time to the json baseline"""
+    size, enc_time, dec_time = stats
+    print(f"    -> {100 * (1 - size / baseline[0]):.0f}% smaller than json; "
+          f"encode {enc_time / baseline[1]:.2f}x, decode {dec_time / baseline[2]:.2f}x json's time")
+
+def bench_records(count):
+    items = results_set(count)
+    print(f"Cache records ({count} aggregated results)")
+    print(f"  {'codec':<26} {'encode':>11} {'decode':>11} {'bytes/rec':>11}")
+    baseline = report("json (previous)", lambda r: json.dumps(r).encode(), json.loads, items)
+    zlib_json = report("compact json + zlib", lambda r: codec.FORMAT_ZLIB_JSON + zlib.compress(
+        json.dumps(codec.compact_results(r)).encode(), 6), codec.decode_record, items)
+    compare(zlib_json, baseline)
+    if codec.msgpack is not None:
+        packed = report("compact msgpack + zstd", codec.encode_record, codec.decode_record, items)
+        compare(packed, baseline)
+    else:
+        print("  (msgpack/zstandard not installed; skipping compact msgpack + zstd)")
+
+def bench_responses(rows):
+    payload = bulk_response(rows)
+    print(f"\nAPI responses (bulk payload, {rows} rows)")
+    encoders = [("json.dumps (jsonify)", lambda p: json.dumps(p).encode())]
+    if codec.orjson is not None:
+        encoders.append(("orjson", codec.dumps_json))
+    for name, encode in encoders:
+        elapsed, out = timed(encode, [payload])
+        print(f"  {name:<26} {elapsed * 1000:8.1f} ms {len(out[0]) / 1024:9.0f} KiB")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--rows", type=int, default=1000)
+    args = parser.parse_args()
+    bench_records(args.records)
+    bench_responses(args.rows)
+
+if __name__ == "__main__":
+    main()
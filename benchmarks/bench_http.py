@@ -0,0 +1,93 @@
+# benchmarks/bench_http.py
+"""Bandwidth and latency saved by response compression and ETag revalidation
+
+    python benchmarks/bench_http.py [--rows 1000] [--mbps 20]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import codec, compression
+from benchmarks.fixtures import bulk_response, results_set
+
+def best_of(fn, repeat=5):
+    best, out = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, out
+
+def transfer_ms(size, mbps):
+    return size * 8 / (mbps * 1e6) * 1000
+
+def bench_compression(rows, mbps):
+    body = codec.dumps_json(bulk_response(rows))
+    print(f"/api/bulk_price response, {rows} rows, {mbps} Mbit/s link")
+    print(f"  {'encoding':<10} {'bytes':>12} {'ratio':>7} {'compress':>10} {'transfer':>10} {'total':>10}")
+    base = transfer_ms(len(body), mbps)
+    print(f"  {'identity':<10} {len(body):>12,} {1:>7.1f} {0:>8.1f}ms {base:>8.1f}ms {base:>8.1f}ms")
+    encodings = ["gzip"] + (["br"] if compression.brotli is not None else [])
+    for encoding in encodings:
+        elapsed, out = best_of(lambda: compression.compress_body(body, encoding))
+        cost = elapsed * 1000
+        wire = transfer_ms(len(out), mbps)
+        print(f"  {encoding:<10} {len(out):>12,} {len(body) / len(out):>7.1f} {cost:>8.1f}ms {wire:>8.1f}ms {cost + wire:>8.1f}ms")
+    if compression.brotli is None:
+        print("  (brotli not installed; skipping br)")
+
+def bench_etag(count, mbps):
+    # Real lookups against the in-memory cache backend, as /api/price does them
+    os.environ["CACHE_BACKEND"] = "memory"
+    os.environ["HISTORY_ENABLED"] = "False"
+    from backend import cache
+    products = [{"brand": "Brand", "model": f"Model {i}", "condition": "excellent"} for i in range(count)]
+    for product, result in zip(products, results_set(count)):
+        cache.store_result(product, result)
+    client_etags = {}
+    for product in products:
+        entry = cache.get_cached_entry(product, decode=False)
+        client_etags[entry["key"]] = compression.make_etag(entry["key"], entry["timestamp"])
+
+    def full_response():
+        # Cache hit without a matching ETag: look up, decode, serialize, compress
+        sizes = 0
+        for product in products:
+            entry = cache.get_cached_entry(product, decode=False)
+            compression.make_etag(entry["key"], entry["timestamp"])
+            body = codec.dumps_json({"results": cache.entry_results(entry), "source": "cache"})
+            sizes += len(compression.compress_body(body, "gzip"))
+        return sizes
+
+    def not_modified():
+        # Cache hit with a matching If-None-Match: look up and compare entity tags only
+        matched = 0
+        for product in products:
+            entry = cache.get_cached_entry(product, decode=False)
+            matched += compression.make_etag(entry["key"], entry["timestamp"]) == client_etags[entry["key"]]
+        return matched
+
+    full_time, full_bytes = best_of(full_response, repeat=3)
+    etag_time, matched = best_of(not_modified, repeat=3)
+    assert matched == count
+    per_full = full_time / count * 1e6
+    per_304 = etag_time / count * 1e6
+    print(f"\nRepeat /api/price cache hits ({count} entries, lookup included)")
+    print(f"  200 full body   {per_full:8.1f} us server  {full_bytes / count:8.0f} B  {transfer_ms(full_bytes / count, mbps):6.2f} ms on the wire")
+    print(f"  304 via ETag    {per_304:8.1f} us server  {0:8.0f} B  {0:6.2f} ms on the wire")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--entries", type=int, default=2000)
+    parser.add_argument("--mbps", type=float, default=20)
+    args = parser.parse_args()
+    bench_compression(args.rows, args.mbps)
+    bench_etag(args.entries, args.mbps)
+
+if __name__ == "__main__":
+    main()
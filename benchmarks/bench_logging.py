@@ -0,0 +1,114 @@
+# benchmarks/bench_logging.py
+"""Per-batch logging cost and volume on the bulk path, before and after backend.logging_setup
+
+Replays the log calls one bulk batch used to make (the full LLM payload
+f-string, per-item cache lines at INFO, Claude stream events). It then
+replays the calls it makes now (a structured summary line, a sampled and
+truncated payload, per-item lines at DEBUG) through the queue handler. For
+each it reports CPU time in the request thread, total process CPU and
+bytes written.
+
+    python benchmarks/bench_logging.py [--batches 500] [--items 10]
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import logging_setup
+from benchmarks.fixtures import results_set
+
+class CountingStream:
+    """A write-only stream that only counts bytes"""
+
+    def __init__(self):
+        self.bytes = 0
+
+    def write(self, text):
+        self.bytes += len(text.encode("utf-8"))
+
+    def flush(self):
+        pass
+
+def llm_results(items, seed):
+    """Provider results for one combined batch prompt"""
+    return [
+        {"source": source, "data": results_set(items, seed=seed + i), "confidence": 0.9}
+        for i, source in enumerate(("claude", "gemini", "grok"))
+    ]
+
+def reset_root():
+    logging_setup.stop_logging()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+def old_batch(logger, cache_logger, client_logger, results, keys):
+    client_logger.info("Claude streaming started")
+    client_logger.info("Claude streaming delta received")
+    logger.info(f"LLM results for batch: {results}")
+    for key in keys:
+        cache_logger.info(f"Stored results in memory cache for {key}")
+
+def new_batch(logger, cache_logger, client_logger, results, keys):
+    logger.info("LLM batch priced", extra={
+        "items": len(keys),
+        "sources": [r.get("source") for r in results],
+        "errors": sum(1 for r in results if "error" in r)
+    })
+    logging_setup.log_payload(logger, "LLM results for batch", results)
+    for key in keys:
+        cache_logger.debug("Stored results in memory cache for %s", key)
+
+def run(name, batch, batches, items, configure):
+    stream = CountingStream()
+    reset_root()
+    configure(stream)
+    logger = logging.getLogger("backend.pipeline")
+    cache_logger = logging.getLogger("backend.cache")
+    client_logger = logging.getLogger("backend.llm_clients")
+    payloads = [llm_results(items, seed) for seed in range(20)]
+    keys = [f"Brand-Model {i}" for i in range(items)]
+
+    thread_start = time.thread_time()
+    process_start = time.process_time()
+    wall_start = time.perf_counter()
+    for i in range(batches):
+        batch(logger, cache_logger, client_logger, payloads[i % len(payloads)], keys)
+    thread_cpu = time.thread_time() - thread_start
+    # Drain the queue so the listener's work is counted in process CPU and bytes
+    logging_setup.stop_logging()
+    process_cpu = time.process_time() - process_start
+    wall = time.perf_counter() - wall_start
+    reset_root()
+    print(f"  {name:<34} {thread_cpu / batches * 1e6:9.1f} us {process_cpu / batches * 1e6:9.1f} us "
+          f"{wall:7.2f} s {stream.bytes / batches / 1024:9.1f} KiB")
+    return thread_cpu, stream.bytes
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batches", type=int, default=500)
+    parser.add_argument("--items", type=int, default=10)
+    args = parser.parse_args()
+
+    def configure_old(stream):
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+        logging.getLogger().addHandler(handler)
+        logging.getLogger().setLevel(logging.INFO)
+
+    def configure_new(stream):
+        logging_setup.configure_logging(level="INFO", stream=stream)
+
+    print(f"Bulk logging, {args.batches} batches of {args.items} items, 3 providers")
+    print(f"  {'mode':<34} {'req CPU/batch':>12} {'all CPU/batch':>12} {'wall':>9} {'log/batch':>13}")
+    old_cpu, old_bytes = run("f-string payload, INFO (previous)", old_batch, args.batches, args.items, configure_old)
+    new_cpu, new_bytes = run("structured, sampled, queued", new_batch, args.batches, args.items, configure_new)
+    print(f"    -> request-thread CPU {100 * (1 - new_cpu / old_cpu):.0f}% lower, "
+          f"log volume {100 * (1 - new_bytes / max(old_bytes, 1)):.1f}% lower")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+# benchmarks/fixtures.py
+"""Realistic pricing payloads shared by the benchmark scripts"""
+import random
+from datetime import datetime
+
+BRANDS = ["Louis Vuitton", "Chanel", "Hermès", "Gucci", "Prada", "Dior", "Celine", "Bottega Veneta", "Rolex", "Cartier"]
+MODELS = ["Neverfull MM", "Speedy 30", "Classic Flap Medium", "Birkin 30", "Kelly 28", "Jackie 1961", "Galleria",
+          "Lady Dior", "Luggage Nano", "Cassette", "Submariner", "Tank Must", "Alma PM", "Boy Bag", "Marmont"]
+CONDITIONS = ["excellent", "very good", "good", "fair"]
+WORDS = ("demand strong resale market condition canvas leather hardware authenticity seasonal trend collectors "
+         "retail price increase comparable listings sell-through rate vintage limited edition colorway popular "
+         "classic iconic waitlist secondary platforms discount buyers premium scarcity wear corners patina").split()
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+def pricing_result(rng):
+    """One aggregated result shaped like aggregate_results() output"""
+    base = rng.randint(300, 12000)
+    result = {}
+    for field, factor in (("buy_price", 0.55), ("max_profit_price", 1.1), ("quick_sale_price", 0.8), ("expected_sale_price", 0.95)):
+        low = round(base * factor)
+        result[field] = {"min": low, "max": round(low * 1.15), "explanation": sentence(rng, 35)}
+    result["estimated_time_to_sell"] = {"min": rng.randint(3, 14), "max": rng.randint(15, 45), "unit": "days",
+                                        "explanation": sentence(rng, 30)}
+    result["factors"] = [sentence(rng, 6) for _ in range(5)]
+    result["market_analysis"] = " ".join(sentence(rng, 20) for _ in range(4))
+    result["meta"] = {
+        "sources": ["claude", "gemini", "grok"],
+        "price_range_variation": {f: {"min_cv": round(rng.random() / 5, 2), "max_cv": round(rng.random() / 5, 2)}
+                                  for f in ("buy_price", "max_profit_price", "quick_sale_price", "expected_sale_price")},
+        "timestamp": datetime(2025, 4, 1, 12, 0).isoformat(),
+        "models_used": ["claude", "gemini", "grok"]
+    }
+    return result
+
+def product(rng):
+    return {"brand": rng.choice(BRANDS), "model": rng.choice(MODELS), "condition": rng.choice(CONDITIONS),
+            "additional_details": sentence(rng, 6)}
+
+def bulk_response(rows, seed=0):
+    """Payload shaped like /api/bulk_price's JSON response"""
+    rng = random.Random(seed)
+    return {"results": [{"product": product(rng), "results": pricing_result(rng), "source": "llm"} for _ in range(rows)]}
+
+def results_set(count, seed=0):
+    rng = random.Random(seed)
+    return [pricing_result(rng) for _ in range(count)]
@@ -1,3 +1,9 @@
 # gunicorn.conf.py
+import os
+
 timeout = 120  # Increase timeout to 120 seconds
-workers = 2    # Number of workers (adjust based on your Render plan)
\ No newline at end of file
+workers = 2    # Number of workers (adjust based on your Render plan)
+# Threaded workers, so a slow LLM call holds one thread instead of the whole worker;
+# backend/admission.py keeps ADMISSION_RESERVED_THREADS of these free for /health and /login
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
@@ -0,0 +1,14 @@
+# conftest.py
+"""Test settings: dummy provider keys so the clients can be constructed, and state kept in a temp dir"""
+import os
+import tempfile
+
+test_data_dir = tempfile.mkdtemp(prefix="pricing-tool-tests-")
+
+for key in ("ANTHROPIC_API_KEY", "GOOGLE_API_KEY", "GROK_API_KEY"):
+    os.environ.setdefault(key, "test")
+os.environ["CACHE_BACKEND"] = "memory"
+os.environ["DISPATCH_ENABLED"] = "False"
+os.environ["HISTORY_ENABLED"] = "False"
+os.environ["CACHE_DB_PATH"] = os.path.join(test_data_dir, "cache.db")
+os.environ["USERS_DB_PATH"] = os.path.join(test_data_dir, "users.db")
@@ -0,0 +1,79 @@
+# test_batch_api.py
+import pytest
+
+from backend import batch_api, quotas
+
+PRICE_FIELDS = ("buy_price", "max_profit_price", "quick_sale_price", "expected_sale_price")
+
+def pricing(source, value):
+    data = {field: {"min": value, "max": value, "explanation": field} for field in PRICE_FIELDS}
+    data["estimated_time_to_sell"] = {"min": 1, "max": 2, "unit": "weeks", "explanation": "demand"}
+    data["factors"] = ["rarity"]
+    data["market_analysis"] = "steady"
+    return {"source": source, "data": data, "confidence": 1.0}
+
+def products(count):
+    return [{"brand": "Hermes", "model": f"Birkin {size}", "condition": "excellent", "additional_details": ""}
+            for size in range(25, 25 + count * 5, 5)]
+
+@pytest.fixture
+def providers(monkeypatch):
+    """Stub batch providers: Claude succeeds, Grok's batch is reported as expired"""
+    cancelled = []
+
+    def submit(source):
+        def submit_batch(pending):
+            return {"id": f"{source}-batch", "indexes": [index for index, _ in pending]}
+        return submit_batch
+
+    def grok_done(batch_info):
+        batch_info["error"] = f"Grok batch {batch_info['id']} expired"
+        return True
+
+    def fetch_claude(batch_info):
+        return {batch_api.custom_id(index): pricing("claude", 100) for index in batch_info["indexes"]}
+
+    monkeypatch.setattr(batch_api, "PROVIDERS", {
+        "claude": (submit("claude"), lambda batch_info: True, fetch_claude, cancelled.append),
+        "grok": (submit("grok"), grok_done, lambda batch_info: pytest.fail("fetched a failed batch"),
+                 cancelled.append)
+    })
+    monkeypatch.setattr(batch_api, "store_result", lambda product, result: None)
+    return {"cancelled": cancelled}
+
+def test_failed_provider_batch_is_collected_without_it(providers):
+    job = batch_api.submit_job(products(2), ["claude", "grok"])
+    batch_api.wait_for_job(job, poll_interval=0)
+    results_by_key = batch_api.collect_job(job)
+
+    assert job["status"] == "completed"
+    assert job["report"]["priced"] == 2
+    assert job["report"]["failed_sources"] == ["grok"]
+    for product_result in results_by_key.values():
+        assert product_result["results"]["meta"]["models_used"] == ["claude"]
+
+def test_submit_failure_cancels_batches_already_created(providers, monkeypatch):
+    def fail(pending):
+        raise RuntimeError("upload rejected")
+
+    monkeypatch.setitem(batch_api.PROVIDERS, "grok", (fail,) + batch_api.PROVIDERS["grok"][1:])
+    with pytest.raises(RuntimeError):
+        batch_api.submit_job(products(2), ["claude", "grok"])
+
+    assert [batch_info["id"] for batch_info in providers["cancelled"]] == ["claude-batch"]
+
+def test_failed_background_job_refunds_reserved_rows(providers, monkeypatch, tmp_path):
+    def wait_for_job(job, poll_interval=60, state_path=None):
+        raise RuntimeError("provider unreachable")
+
+    monkeypatch.setattr(batch_api, "wait_for_job", wait_for_job)
+    user_id = 38
+    job = batch_api.submit_job(products(2), ["claude", "grok"], user_id=user_id)
+    job["reserved_rows"] = quotas.reserve_rows(user_id, 2)
+    state_path = batch_api.save_job(job, str(tmp_path / "job.json"))
+    batch_api.start_job_thread(state_path, poll_interval=0).join()
+
+    job = batch_api.load_job(state_path)
+    assert job["status"] == "failed"
+    assert job["reserved_rows"] == 0
+    assert quotas.get_usage(user_id)["rows"] == 0
@@ -0,0 +1,52 @@
+# test_bulk.py
+import asyncio
+import csv
+
+import pytest
+
+from backend import bulk
+from backend.pipeline import RESULT_FIELDS
+
+INPUT_FIELDS = ["brand", "model", "condition", "additional_details"]
+
+@pytest.fixture
+def priced(monkeypatch):
+    """Stub pipeline recording the rows it is asked to price"""
+    seen = []
+
+    async def stream_bulk_results(rows, use_sources, **kwargs):
+        for row, product in rows:
+            seen.append(row["model"])
+            yield row, {"product": product, "error": "not priced in tests"}
+
+    monkeypatch.setattr(bulk, "stream_bulk_results", stream_bulk_results)
+    return seen
+
+def write_csv(path, fieldnames, rows):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(fieldnames)
+        writer.writerows(rows)
+
+def test_resume_skips_rows_already_written(priced, tmp_path):
+    write_csv(tmp_path / "in.csv", INPUT_FIELDS, [["Hermes", f"Birkin {size}", "excellent", ""] for size in (25, 30, 35)])
+    write_csv(tmp_path / "out.csv", INPUT_FIELDS + RESULT_FIELDS, [["Hermes", "Birkin 25", "excellent", ""]])
+    counts = asyncio.run(bulk.price_file(str(tmp_path / "in.csv"), str(tmp_path / "out.csv"), ["claude"]))
+
+    assert priced == ["Birkin 30", "Birkin 35"]
+    assert counts["skipped"] == 1
+
+def test_partial_with_another_header_is_rewritten(priced, tmp_path):
+    write_csv(tmp_path / "in.csv", INPUT_FIELDS, [["Hermes", f"Birkin {size}", "excellent", ""] for size in (25, 30)])
+    write_csv(tmp_path / "out.csv", ["sku"] + RESULT_FIELDS, [["A1"]])
+    asyncio.run(bulk.price_file(str(tmp_path / "in.csv"), str(tmp_path / "out.csv"), ["claude"]))
+
+    assert priced == ["Birkin 25", "Birkin 30"]
+    with open(tmp_path / "out.csv", encoding="utf-8", newline="") as f:
+        assert next(csv.reader(f)) == INPUT_FIELDS + RESULT_FIELDS
+
+def test_gcs_partials_are_keyed_on_the_full_uri():
+    first = bulk.partial_path_for("gs://a/catalog.csv", "gs://a/priced/catalog.priced.csv")
+    second = bulk.partial_path_for("gs://b/catalog.csv", "gs://b/priced/catalog.priced.csv")
+    assert first != second
+    assert first.endswith(".partial") and bulk.is_output(first)
@@ -0,0 +1,81 @@
+# test_dispatch.py
+import asyncio
+import os
+
+import pytest
+
+from backend import dispatch, quotas
+from backend.dispatch import BULK, INTERACTIVE, PRIORITIES
+
+@pytest.fixture
+def conn(monkeypatch, tmp_path):
+    """A fresh dispatch database (and quota table) with one slot and no reserve"""
+    monkeypatch.setenv("DISPATCH_ENABLED", "True")
+    monkeypatch.setenv("DISPATCH_DB_PATH", os.path.join(tmp_path, "dispatch.db"))
+    monkeypatch.setenv("USERS_DB_PATH", os.path.join(tmp_path, "users.db"))
+    monkeypatch.setenv("DISPATCH_CAPACITY", "1")
+    monkeypatch.setenv("DISPATCH_RESERVE_INTERACTIVE", "0")
+    monkeypatch.setenv("DISPATCH_POLL_INTERVAL", "0.01")
+    monkeypatch.setattr(dispatch, "dispatch_local", dispatch.threading.local())
+    monkeypatch.setattr(quotas, "quota_local", quotas.threading.local())
+    return dispatch.get_dispatch_connection()
+
+def wait(conn, priority, user_id=None):
+    return dispatch.enqueue(conn, PRIORITIES.index(priority), dispatch.time.time(), user_id)
+
+def acquire(conn, waiter_id, priority):
+    return dispatch.try_acquire(conn, waiter_id, PRIORITIES.index(priority), dispatch.get_dispatch_settings())
+
+def release(conn, lease_id):
+    conn.execute("DELETE FROM dispatch_leases WHERE id = ?", (lease_id,))
+
+def test_interactive_jumps_ahead_of_queued_bulk(conn):
+    running = acquire(conn, wait(conn, BULK), BULK)
+    queued_bulk = wait(conn, BULK)
+    interactive = wait(conn, INTERACTIVE)
+    assert acquire(conn, interactive, INTERACTIVE) is None
+
+    release(conn, running)
+    assert acquire(conn, queued_bulk, BULK) is None
+    assert acquire(conn, interactive, INTERACTIVE) is not None
+
+def test_reserve_keeps_a_slot_free_for_interactive(conn, monkeypatch):
+    monkeypatch.setenv("DISPATCH_CAPACITY", "2")
+    monkeypatch.setenv("DISPATCH_RESERVE_INTERACTIVE", "1")
+    assert acquire(conn, wait(conn, BULK), BULK) is not None
+    assert acquire(conn, wait(conn, BULK), BULK) is None
+    assert acquire(conn, wait(conn, INTERACTIVE), INTERACTIVE) is not None
+
+def test_users_interleave_under_fair_queuing(conn):
+    waiters = [(wait(conn, BULK, user_id=1), 1) for _ in range(3)]
+    waiters += [(wait(conn, BULK, user_id=2), 2) for _ in range(2)]
+
+    order = []
+    while waiters:
+        for waiter in waiters:
+            lease_id = acquire(conn, waiter[0], BULK)
+            if lease_id is not None:
+                order.append(waiter[1])
+                waiters.remove(waiter)
+                release(conn, lease_id)
+                break
+    assert order == [1, 2, 1, 2, 1]
+
+def test_cancelled_waiter_leaves_the_queue(conn):
+    running = acquire(conn, wait(conn, BULK), BULK)
+
+    async def cancel_while_queued():
+        async def call():
+            async with dispatch.provider_slot(BULK):
+                pytest.fail("got a slot that was taken")
+
+        task = asyncio.ensure_future(call())
+        await asyncio.sleep(0.05)
+        assert conn.execute("SELECT COUNT(*) FROM dispatch_waiters").fetchone()[0] == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_while_queued())
+    assert conn.execute("SELECT COUNT(*) FROM dispatch_waiters").fetchone()[0] == 0
+    release(conn, running)
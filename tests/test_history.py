@@ -0,0 +1,39 @@
+# test_history.py
+import os
+
+import pytest
+
+from backend import history
+from backend.history import PRICE_FIELDS
+
+def pricing(value):
+    results = {field: {"min": value, "max": value, "explanation": field} for field in PRICE_FIELDS}
+    results["estimated_time_to_sell"] = {"min": "1", "max": 2, "unit": "weeks", "explanation": "demand"}
+    return results
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+    monkeypatch.setenv("HISTORY_ENABLED", "True")
+    monkeypatch.setenv("HISTORY_DB_PATH", os.path.join(tmp_path, "history.db"))
+    monkeypatch.setattr(history, "history_local", history.threading.local())
+    return {"brand": "Hermes", "model": "Birkin 30", "condition": "excellent"}
+
+def test_text_prices_are_coerced_or_skipped(store):
+    history.record_observation(store, pricing(1000))
+    history.record_observation(store, pricing("$1,200"))
+    history.record_observation(store, pricing("N/A"))
+
+    observations = history.query_history(store)
+    assert sorted(o["expected_sale_price_max"] for o in observations if o["expected_sale_price_max"]) == [1000, 1200]
+    assert {o["time_to_sell_min_days"] for o in observations} == {7.0}
+
+def test_median_ignores_legacy_text_rows(store):
+    history.record_observation(store, pricing(1000))
+    history.get_history_connection().execute(
+        "UPDATE price_history SET expected_sale_price_max = 'unknown'"
+    )
+    history.record_observation(store, pricing(1100))
+
+    result = history.history_median_result(store, days=1)
+    assert result["expected_sale_price"]["max"] == 1100
+    assert result["buy_price"]["max"] == 1050
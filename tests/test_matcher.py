@@ -0,0 +1,61 @@
+# test_matcher.py
+import pytest
+
+from backend.matcher import ProductIndex, canonical_product_key
+
+THRESHOLD = 0.8
+
+def product(brand, model):
+    return {"brand": brand, "model": model, "condition": "excellent"}
+
+@pytest.fixture
+def index():
+    index = ProductIndex()
+    for brand, model in [
+        ("Louis Vuitton", "Neverfull MM"),
+        ("Louis Vuitton", "Speedy 30"),
+        ("Chanel", "Classic Flap Medium"),
+        ("Hermes", "Birkin 30"),
+    ]:
+        index.add(f"{brand}-{model}", product(brand, model))
+    return index
+
+@pytest.mark.parametrize("brand, model, expected", [
+    ("LV", "Neverfull MM", "Louis Vuitton-Neverfull MM"),
+    ("louis vuitton", "neverfull mm", "Louis Vuitton-Neverfull MM"),
+    ("Louis Vuitton", "Louis Vuitton Neverfull MM Monogram", "Louis Vuitton-Neverfull MM"),
+    ("LV", "Neverful MM", "Louis Vuitton-Neverfull MM"),
+    ("Hermès", "Birkin 30", "Hermes-Birkin 30"),
+])
+def test_spelling_variants_match(index, brand, model, expected):
+    match = index.match(product(brand, model), THRESHOLD)
+    assert match is not None and match[0] == expected
+
+@pytest.mark.parametrize("brand, model", [
+    # Material variant of a cached model
+    ("Louis Vuitton", "Neverfull MM Empreinte"),
+    # Size variants
+    ("Chanel", "Classic Flap Jumbo Medium"),
+    ("Chanel", "Classic Flap"),
+    ("Louis Vuitton", "Neverfull GM"),
+    ("Louis Vuitton", "Speedy 25"),
+    ("Hermes", "Birkin 25"),
+    ("Hermes", "Birkin 30 Togo"),
+])
+def test_size_and_material_variants_do_not_match(index, brand, model):
+    assert index.match(product(brand, model), THRESHOLD) is None
+
+def test_canonical_key_ignores_spelling_but_not_condition():
+    assert canonical_product_key(product("LV", "Neverfull MM")) == canonical_product_key(product("louis vuitton", "neverfull mm"))
+    assert canonical_product_key(product("LV", "Neverfull MM")) != canonical_product_key(dict(product("LV", "Neverfull MM"), condition="fair"))
+
+@pytest.mark.parametrize("brand, model", [
+    ("LV", "neverfull mm"),
+    ("Louis Vuitton", "Louis Vuitton Neverfull MM Monogram"),
+    ("LV", "Neverful MM"),
+])
+def test_best_entry_survives_candidate_cap(index, brand, model):
+    for i in range(index.max_candidates + 250):
+        index.add(f"Louis Vuitton-Neverfull MM Damier {i}", product("Louis Vuitton", f"Neverfull MM Damier {i}"))
+    match = index.match(product(brand, model), THRESHOLD)
+    assert match is not None and match[0] == "Louis Vuitton-Neverfull MM"
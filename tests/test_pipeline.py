@@ -0,0 +1,135 @@
+# test_pipeline.py
+import asyncio
+
+import pytest
+
+from backend import pipeline
+
+PRICE_FIELDS = ("buy_price", "max_profit_price", "quick_sale_price", "expected_sale_price")
+
+def pricing(value):
+    item = {field: {"min": value, "max": value, "explanation": field} for field in PRICE_FIELDS}
+    item["estimated_time_to_sell"] = {"min": 1, "max": 2, "unit": "weeks", "explanation": "demand"}
+    item["factors"] = ["rarity"]
+    item["market_analysis"] = "steady"
+    return item
+
+def products(count):
+    return [{"brand": "Hermes", "model": f"Birkin {size}", "condition": "excellent", "additional_details": ""}
+            for size in range(25, 25 + count * 5, 5)]
+
+@pytest.fixture
+def providers(monkeypatch):
+    """Stub providers answering a combined prompt with one pricing dict per item"""
+    calls = []
+    prices = {"claude": [9000, 100, 200], "gemini": [8000, 120, 220], "grok": [10000, 110, 210]}
+
+    async def get_all_llm_pricing(product_info, use_sources, priority=None, user_id=None, cost=1):
+        calls.append(list(use_sources))
+        items = product_info["combined_prompt"].count("Item ")
+        return [
+            {"source": source, "data": [pricing(value) for value in prices[source][:items]],
+             "confidence": 1.0}
+            for source in use_sources
+        ]
+
+    stored = {}
+    monkeypatch.setattr(pipeline, "get_all_llm_pricing", get_all_llm_pricing)
+    monkeypatch.setattr(pipeline, "get_cached_entry", lambda product: None)
+    monkeypatch.setattr(pipeline, "store_result", lambda product, result: stored.update({product["model"]: result}))
+    monkeypatch.setattr(pipeline, "ensemble_counts", pipeline.Counter())
+    monkeypatch.setenv("HIGH_VALUE_THRESHOLD", "5000")
+    monkeypatch.setenv("SECOND_OPINION_RATE", "0")
+    return {"calls": calls, "prices": prices, "stored": stored}
+
+def test_escalated_batch_is_aggregated_per_item(providers):
+    batch = products(3)
+    results = asyncio.run(pipeline.process_product_batch(batch, ["claude", "gemini", "grok"]))
+
+    # The 9000 item is high-value, so the whole batch goes to the full ensemble
+    assert providers["calls"] == [["claude"], ["gemini", "grok"]]
+    assert [r.get("error") for r in results] == [None, None, None]
+    for position, result in enumerate(results):
+        expected = round(sum(prices[position] for prices in providers["prices"].values()) / 3)
+        assert result["source"] == "llm"
+        assert result["results"]["expected_sale_price"]["min"] == expected
+        assert result["results"]["meta"]["sources"] == ["claude", "gemini", "grok"]
+    assert set(providers["stored"]) == {product["model"] for product in batch}
+
+def test_batch_priced_by_primary_only(providers):
+    providers["prices"]["claude"][0] = 300
+    results = asyncio.run(pipeline.process_product_batch(products(3), ["claude", "gemini", "grok"]))
+
+    assert providers["calls"] == [["claude"]]
+    assert [r["results"]["expected_sale_price"]["max"] for r in results] == [300, 100, 200]
+    stats = pipeline.ensemble_stats()
+    assert stats["items"] == 3
+    assert stats["provider_calls"] == 1
+
+def test_malformed_item_fails_only_that_row(providers, monkeypatch):
+    broken = pricing(8500)
+    del broken["factors"]
+
+    async def get_all_llm_pricing(product_info, use_sources, priority=None, user_id=None, cost=1):
+        return [
+            {"source": source, "data": [broken if source == "gemini" else pricing(9000), pricing(100)],
+             "confidence": 1.0}
+            for source in use_sources
+        ]
+
+    monkeypatch.setattr(pipeline, "get_all_llm_pricing", get_all_llm_pricing)
+    results = asyncio.run(pipeline.process_product_batch(products(2), ["claude", "gemini", "grok"]))
+
+    assert results[0]["error"].startswith("Failed to aggregate LLM results")
+    assert results[1]["results"]["expected_sale_price"]["max"] == 100
+
+def test_short_batch_answer_escalates(providers):
+    providers["prices"]["claude"] = [300, 100]
+    results = asyncio.run(pipeline.process_product_batch(products(3), ["claude", "gemini", "grok"]))
+
+    assert providers["calls"] == [["claude"], ["gemini", "grok"]]
+    assert pipeline.ensemble_stats()["escalated_primary_failed"] == 1
+    assert [r["results"]["meta"]["sources"] for r in results] == [["gemini", "grok"]] * 3
+
+def test_stale_hits_are_repriced_in_the_batch(providers, monkeypatch):
+    providers["prices"]["claude"][0] = 300
+    batch = products(3)
+    entry = {"results": pricing(50), "key": "Hermes-Birkin 30", "score": 1.0, "stale": True}
+    monkeypatch.setattr(pipeline, "get_cached_entry", lambda product: entry if product == batch[1] else None)
+    monkeypatch.setattr(pipeline, "schedule_refresh", lambda key, refresh: pytest.fail("queued a background refresh"))
+    results = asyncio.run(pipeline.process_product_batch(batch, ["claude", "gemini", "grok"]))
+
+    assert providers["calls"] == [["claude"]]
+    assert [r["source"] for r in results] == ["llm", "llm", "llm"]
+    assert results[1]["results"]["expected_sale_price"]["max"] == 100
+
+def test_refresh_product_counts_providers_queried(providers, monkeypatch):
+    async def get_all_llm_pricing(product_info, use_sources, priority=None, user_id=None, cost=1):
+        return [{"source": source, "data": pricing(100), "confidence": 1.0} for source in use_sources]
+
+    monkeypatch.setattr(pipeline, "get_all_llm_pricing", get_all_llm_pricing)
+    calls = {}
+    asyncio.run(pipeline.refresh_product(products(1)[0], ["claude", "gemini", "grok"], calls=calls))
+
+    assert calls == {"claude": 1}
+
+def test_stream_bulk_results_waits_for_products_already_being_priced(monkeypatch):
+    batches = []
+
+    async def process_product_batch(batch, use_sources, priority=None, user_id=None):
+        batches.append([product["model"] for product in batch])
+        await asyncio.sleep(0.01)
+        return [{"product": product, "results": pricing(100), "source": "llm"} for product in batch]
+
+    monkeypatch.setattr(pipeline, "process_product_batch", process_product_batch)
+    catalog = products(3)
+    rows = [({"row": i}, catalog[i % 3]) for i in range(25)]
+
+    async def collect():
+        return [item async for item in pipeline.stream_bulk_results(rows, ["claude"], batch_size=10, batch_interval=0)]
+
+    results = asyncio.run(collect())
+
+    assert batches == [[product["model"] for product in catalog]]
+    assert [row["row"] for row, _ in results] == list(range(25))
+    assert all(result["product"] == catalog[row["row"] % 3] for row, result in results)
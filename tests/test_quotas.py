@@ -0,0 +1,41 @@
+# test_quotas.py
+import os
+
+import pytest
+
+from backend import quotas
+
+USER_ID = 7
+
+@pytest.fixture
+def user(monkeypatch, tmp_path):
+    monkeypatch.setenv("USERS_DB_PATH", os.path.join(tmp_path, "users.db"))
+    monkeypatch.setattr(quotas, "quota_local", quotas.threading.local())
+    return USER_ID
+
+def test_reserve_rows_grants_up_to_the_daily_limit(user):
+    quotas.set_user_quota(user, daily_rows=150)
+    assert quotas.reserve_rows(user, 100) == 100
+    assert quotas.reserve_rows(user, 100) == 50
+    assert quotas.reserve_rows(user, 100) == 0
+    assert quotas.get_usage(user)["rows"] == 150
+
+def test_reserve_rows_stops_at_the_token_limit(user):
+    quotas.set_user_quota(user, daily_tokens=10)
+    quotas.record_usage(user, tokens=10)
+    assert quotas.reserve_rows(user, 100) == 0
+
+def test_within_quota_stops_reading_at_the_limit(user):
+    quotas.set_user_quota(user, daily_rows=250)
+    status = {}
+    rows = iter(range(1000))
+    assert len(list(quotas.within_quota(user, rows, status))) == 250
+    assert status["quota_exceeded"] == "rows"
+    assert next(rows) == 250
+    assert quotas.get_usage(user)["rows"] == 250
+
+def test_within_quota_refunds_unused_reservation(user):
+    status = {}
+    assert len(list(quotas.within_quota(user, range(30), status))) == 30
+    assert "quota_exceeded" not in status
+    assert quotas.get_usage(user)["rows"] == 30